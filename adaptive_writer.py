@@ -0,0 +1,196 @@
+"""Module for bulk writes whose batch size adapts to the measured throughput of the target table."""
+import re
+import time
+from typing import Dict
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from log_handler import Logger
+from resilience import Resilience
+
+# Errors raised when a batch is too large for one statement rather than wrong in itself.
+PACKET_ERROR_PATTERNS = re.compile(
+    r"max_allowed_packet|packet too large|packet bigger|got a packet|too many sql variables|too many parameters|"
+    r"number of parameters must be between|more than 2100 parameters|statement too large|request too large",
+    re.IGNORECASE,
+)
+
+# MySQL drops the connection instead of answering when a packet exceeds max_allowed_packet (errors 2006, 2013, 2055).
+# These messages also mean a transient outage, so they only count as size errors for batches of `suspect_bytes` or more.
+CONNECTION_DROP_PATTERNS = re.compile(r"server has gone away|lost connection", re.IGNORECASE)
+
+
+class BatchTooLargeError(Exception):
+    """Raised for a batch rejected for its size. Its message avoids the transient-error patterns, so it isn't retried."""
+
+
+class AdaptiveBatchWriter():
+    """Appends a DataFrame in batches whose size is tuned AIMD-style during the load.
+
+    After each batch the rows per second are compared with the previous batch: while growing the batch keeps the rate
+    up it grows by `additive_increase` rows, when growing it made the rate drop (or a batch takes longer than
+    `max_latency`) it shrinks by `decrease_factor`. Batches never exceed `memory_ceiling` bytes of DataFrame memory. A batch rejected for
+    its size (e.g. MySQL max_allowed_packet, SQLite's variable limit) is split in half and retried, and half the failing
+    size becomes the new upper bound; on MySQL a dropped connection ("server has gone away") during a batch of at least
+    `suspect_bytes` counts as such a rejection. Each batch commits on its own, so with a `Resilience` a batch that failed on a
+    transient error (dropped connection, lock timeout) is retried by itself. Replacing an existing table loads a
+    `<table>__staging` table first and swaps it in at the end, so a failed load leaves the old table in place.
+    """
+    def __repr__(self):
+        return f"AdaptiveBatchWriter(table_name='{self.table_name}', batch_size={self.batch_size}, max_batch_size={self.max_batch_size})"
+
+
+    def __str__(self):
+        return "AdaptiveBatchWriter class that tunes the to_sql batch size while loading and splits oversized batches"
+
+
+    def __init__(self, engine, table_name: str, initial_batch_size: int = 1000, min_batch_size: int = 1, max_batch_size: int = 200000,
+                 additive_increase: int = None, decrease_factor: float = 0.5, tolerance: float = 0.1, max_latency: float = 5.0,
+                 memory_ceiling: int = 64 * 1024 ** 2, method: str = None, dtype: Dict = None, suspect_bytes: int = 1024 ** 2,
+                 resilience: Resilience = None, logger: Logger = None):
+        self.engine = engine
+        self.table_name = table_name
+        self.batch_size = initial_batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.additive_increase = additive_increase or initial_batch_size
+        self.decrease_factor = decrease_factor
+        self.tolerance = tolerance
+        self.max_latency = max_latency
+        self.memory_ceiling = memory_ceiling
+        self.method = method
+        self.dtype = dtype
+        self.suspect_bytes = suspect_bytes
+        self.resilience = resilience
+        self.logger = logger or Logger(name="adaptive_writer")
+        self.last_rows = None
+        self.last_rate = None
+
+
+    def is_packet_error(self, error: Exception, batch: pd.DataFrame = None) -> bool:
+        """Tell whether an error means the batch was too large for one statement.
+
+        A dropped connection counts too when the batch holds at least `suspect_bytes`, since that is how MySQL
+        rejects packets over max_allowed_packet.
+        """
+        if PACKET_ERROR_PATTERNS.search(str(error)):
+            return True
+        return batch is not None and CONNECTION_DROP_PATTERNS.search(str(error)) is not None and len(batch) * self.row_bytes(batch) >= self.suspect_bytes
+
+
+    def row_bytes(self, dataframe: pd.DataFrame) -> float:
+        """Estimate the memory of one row from a sample."""
+        sample = dataframe.head(1000)
+        return max(sample.memory_usage(deep=True, index=False).sum() / max(len(sample), 1), 1.0)
+
+
+    def to_sql(self, batch: pd.DataFrame, table_name: str, if_exists: str) -> None:
+        """Insert a batch with one to_sql call, raising BatchTooLargeError when it was rejected for its size."""
+        try:
+            batch.to_sql(name=table_name, con=self.engine, if_exists=if_exists, index=False, method=self.method, dtype=self.dtype)
+        except DBAPIError as error:
+            if self.is_packet_error(error, batch):
+                raise BatchTooLargeError(f"Batch of {len(batch)} rows rejected for its size") from error
+            raise
+
+
+    def insert(self, batch: pd.DataFrame, if_exists: str, report: Dict, table_name: str = None) -> None:
+        """Insert a batch into the table (or `table_name`), splitting it in half for as long as it is rejected for its size.
+
+        Size errors are told apart before `Resilience` sees them, so an oversized batch is split at once rather than
+        retried as a transient error.
+        """
+        table_name = table_name or self.table_name
+        try:
+            if self.resilience is not None:
+                self.resilience.call("write_batch", self.to_sql, batch, table_name, if_exists, endpoint=self.engine.url.render_as_string(hide_password=True))
+            else:
+                self.to_sql(batch, table_name, if_exists)
+        except BatchTooLargeError as error:
+            if len(batch) <= 1:
+                raise error.__cause__
+            # Stay below the size that failed instead of probing it again.
+            self.max_batch_size = max(self.min_batch_size, min(self.max_batch_size, len(batch) // 2))
+            self.batch_size = max(self.min_batch_size, min(self.batch_size, len(batch) // 2))
+            report["splits"] += 1
+            self.logger.log(f"Batch of {len(batch)} rows too large for '{self.table_name}', splitting it: {str(error.__cause__).splitlines()[0]}",
+                            level='warning')
+            half = len(batch) // 2
+            self.insert(batch.iloc[:half], if_exists, report, table_name)
+            self.insert(batch.iloc[half:], "append", report, table_name)
+
+
+    def adjust(self, rows: int, seconds: float) -> None:
+        """Grow the batch additively while the throughput holds up, shrink it multiplicatively when it drops."""
+        rate = rows / max(seconds, 1e-9)
+        # Only a drop after growing counts: smaller batches are expected to be slower per row.
+        slower = self.last_rate is not None and rows >= self.last_rows and rate < self.last_rate * (1 - self.tolerance)
+        if seconds > self.max_latency or slower:
+            self.batch_size = max(self.min_batch_size, int(self.batch_size * self.decrease_factor))
+        else:
+            self.batch_size = min(self.max_batch_size, self.batch_size + self.additive_increase)
+        self.last_rows, self.last_rate = rows, rate
+
+
+    def swap(self, staging: str) -> None:
+        """Replace the table with the staging table.
+
+        MySQL swaps both with one atomic RENAME TABLE. Other dialects drop the table and rename the staging table in one
+        transaction, which is atomic where DDL is transactional (PostgreSQL, SQLite, SQL Server).
+        """
+        quote = self.engine.dialect.identifier_preparer.quote
+        table, staged, old = quote(self.table_name), quote(staging), quote(f"{self.table_name}__old")
+        with self.engine.begin() as connection:
+            if self.engine.dialect.name in ("mysql", "mariadb"):
+                connection.execute(text(f"RENAME TABLE {table} TO {old}, {staged} TO {table}"))
+                connection.execute(text(f"DROP TABLE {old}"))
+            elif self.engine.dialect.name == "mssql":
+                connection.execute(text(f"DROP TABLE {table}"))
+                connection.execute(text("EXEC sp_rename :staging, :table"), {"staging": staging, "table": self.table_name})
+            else:
+                connection.execute(text(f"DROP TABLE {table}"))
+                connection.execute(text(f"ALTER TABLE {staged} RENAME TO {table}"))
+
+
+    def write(self, dataframe: pd.DataFrame, if_exists: str = "append") -> Dict:
+        """Write the DataFrame.
+
+        Args:
+            dataframe (pd.DataFrame): The rows to write.
+            if_exists (str, optional): What the first batch does if the table exists: "append", "replace" or "fail".
+                An existing table is replaced through a staging table, see `swap`. Defaults to "append".
+
+        Returns:
+            dict: 'rows', 'batches', 'splits', 'final_batch_size', 'max_batch_size', 'wall_time', 'rows_per_second',
+                'staged' and the 'history' of (batch size, seconds, bytes) per batch.
+        """
+        start = time.perf_counter()
+        row_bytes = self.row_bytes(dataframe)
+        self.max_batch_size = max(self.min_batch_size, min(self.max_batch_size, int(self.memory_ceiling // row_bytes)))
+        staged = if_exists == "replace" and inspect(self.engine).has_table(self.table_name)
+        table_name = f"{self.table_name}__staging" if staged else self.table_name
+        report = {"rows": 0, "batches": 0, "splits": 0, "staged": staged, "history": []}
+        position = 0
+        if dataframe.empty:
+            dataframe.to_sql(name=table_name, con=self.engine, if_exists=if_exists, index=False, dtype=self.dtype)
+        while position < len(dataframe):
+            size = max(self.min_batch_size, min(self.batch_size, self.max_batch_size))
+            batch = dataframe.iloc[position:position + size]
+            batch_start = time.perf_counter()
+            # The first batch also clears what a failed earlier load left in the staging table.
+            self.insert(batch, if_exists if position == 0 else "append", report, table_name)
+            seconds = time.perf_counter() - batch_start
+            report["history"].append((len(batch), seconds, int(len(batch) * row_bytes)))
+            report["rows"] += len(batch)
+            report["batches"] += 1
+            position += len(batch)
+            self.adjust(len(batch), seconds)
+        if staged:
+            self.swap(table_name)
+        report["final_batch_size"] = self.batch_size
+        report["max_batch_size"] = self.max_batch_size
+        report["wall_time"] = time.perf_counter() - start
+        report["rows_per_second"] = report["rows"] / report["wall_time"] if report["wall_time"] else 0.0
+        self.logger.log(f"Wrote {report['rows']} rows into '{self.table_name}' in {report['batches']} adaptive batches "
+                        f"(final size {self.batch_size}, {report['splits']} splits) at {report['rows_per_second']:.0f} rows/s.")
+        return report
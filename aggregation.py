@@ -0,0 +1,173 @@
+"""Module for declarative group-by aggregations compiled into SQL and executed by the database."""
+import time
+from typing import Dict, List, Sequence, Tuple, Union
+import pandas as pd
+from sqlalchemy import Column, Float, MetaData, Table, and_, distinct, func, inspect, select
+from sqlalchemy.sql import sqltypes
+from log_handler import Logger
+
+AGGREGATE_FUNCTIONS = {
+    "count": lambda column: func.count() if column is None else func.count(column),
+    "count_distinct": lambda column: func.count(distinct(column)),
+    "sum": func.sum,
+    "avg": func.avg,
+    "mean": func.avg,
+    "min": func.min,
+    "max": func.max,
+}
+
+FILTER_OPERATORS = {
+    "=": lambda column, value: column == value,
+    "==": lambda column, value: column == value,
+    "!=": lambda column, value: column != value,
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+    "in": lambda column, value: column.in_(list(value)),
+    "not in": lambda column, value: column.notin_(list(value)),
+    "like": lambda column, value: column.like(value),
+    "between": lambda column, value: column.between(value[0], value[1]),
+    "is null": lambda column, value: column.is_(None),
+    "is not null": lambda column, value: column.isnot(None),
+}
+
+
+class AggregationQuery():
+    """A group-by aggregation described by column names, compiled into dialect-correct SQL with SQLAlchemy Core.
+
+    Aggregates map an output column to a (function, column) pair, e.g. {"total": ("sum", "amount"), "rows": ("count", "*")},
+    with the functions of AGGREGATE_FUNCTIONS. Filters are (column, operator, value) triples with the operators of
+    FILTER_OPERATORS, or a dict of column to value (a list value means IN).
+    """
+    def __repr__(self):
+        return f"AggregationQuery(table_name='{self.table_name}', group_by={self.group_by}, aggregates={self.aggregates})"
+
+
+    def __str__(self):
+        return "AggregationQuery class that compiles group-by aggregations into SQL executed by the database"
+
+
+    def __init__(self, table_name: str, group_by: Sequence[str] = (), aggregates: Dict[str, Tuple[str, str]] = None,
+                 filters: Union[Dict, List[Tuple]] = None, order_by: Sequence[str] = (), limit: int = None):
+        self.table_name = table_name
+        self.group_by = list(group_by)
+        self.aggregates = dict(aggregates or {"count": ("count", "*")})
+        if isinstance(filters, dict):
+            filters = [(column, "in" if isinstance(value, (list, tuple, set)) else "=", value) for column, value in filters.items()]
+        self.filters = [tuple(condition) if len(condition) == 3 else (condition[0], condition[1], None) for condition in filters or []]
+        self.order_by = list(order_by)
+        self.limit = limit
+        for name, (function, _) in self.aggregates.items():
+            if function.lower() not in AGGREGATE_FUNCTIONS:
+                raise ValueError(f"Unsupported aggregate function for '{name}': {function}")
+        for _, operator, _ in self.filters:
+            if operator.lower() not in FILTER_OPERATORS:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+
+
+    def column(self, table: Table, name: str):
+        """Get a column of the table, raising a KeyError that names the table when it doesn't exist."""
+        if name not in table.c:
+            raise KeyError(f"Column '{name}' not found in table '{table.name}'.")
+        return table.c[name]
+
+
+    def build(self, table: Table):
+        """Compile the aggregation into a SELECT on the reflected table."""
+        group_columns = [self.column(table, name) for name in self.group_by]
+        aggregate_columns = [
+            AGGREGATE_FUNCTIONS[function.lower()](None if column in (None, "*") else self.column(table, column)).label(name)
+            for name, (function, column) in self.aggregates.items()
+        ]
+        statement = select(group_columns + aggregate_columns).select_from(table)
+        if self.filters:
+            statement = statement.where(and_(*[FILTER_OPERATORS[operator.lower()](self.column(table, column), value)
+                                               for column, operator, value in self.filters]))
+        if group_columns:
+            statement = statement.group_by(*group_columns)
+        order_columns = []
+        for name in self.order_by:
+            descending = name.startswith("-")
+            name = name.lstrip("-")
+            order_column = next((column for column in aggregate_columns if column.name == name), None)
+            order_column = order_column if order_column is not None else self.column(table, name)
+            order_columns.append(order_column.desc() if descending else order_column)
+        if order_columns:
+            statement = statement.order_by(*order_columns)
+        if self.limit is not None:
+            statement = statement.limit(self.limit)
+        return statement
+
+
+    def reflect(self, engine) -> Table:
+        """Reflect the source table."""
+        return Table(self.table_name, MetaData(), autoload_with=engine)
+
+
+    def execute(self, engine, execute_statement=None) -> pd.DataFrame:
+        """Run the aggregation on the database and return the aggregated rows.
+
+        Args:
+            engine: The SQLAlchemy engine of the database.
+            execute_statement (Callable, optional): Runs the statement on a connection and returns the rows, e.g.
+                `DatabaseHandler.execute_statement` to record it in the query profiler. Defaults to None.
+
+        Returns:
+            pd.DataFrame: One row per group.
+        """
+        statement = self.build(self.reflect(engine))
+        with engine.connect() as connection:
+            rows = execute_statement(connection, statement) if execute_statement else connection.execute(statement).fetchall()
+        return pd.DataFrame([tuple(row) for row in rows], columns=[column.name for column in statement.selected_columns])
+
+
+    def read(self, engine, summary_table: str, execute_statement=None) -> pd.DataFrame:
+        """Read the rows of a summary table written by `materialize`, sorted by `order_by`, without aggregating again.
+
+        Args:
+            engine: The SQLAlchemy engine of the database.
+            summary_table (str): The name of the summary table.
+            execute_statement (Callable, optional): Runs the statement on a connection and returns the rows. Defaults to None.
+
+        Returns:
+            pd.DataFrame: One row per group.
+        """
+        table = Table(summary_table, MetaData(), autoload_with=engine)
+        statement = select([table])
+        if self.order_by:
+            statement = statement.order_by(*[self.column(table, name.lstrip("-")).desc() if name.startswith("-") else self.column(table, name)
+                                             for name in self.order_by])
+        with engine.connect() as connection:
+            rows = execute_statement(connection, statement) if execute_statement else connection.execute(statement).fetchall()
+        return pd.DataFrame([tuple(row) for row in rows], columns=[column.name for column in statement.selected_columns])
+
+
+    def materialize(self, engine, summary_table: str, replace: bool = True, logger: Logger = None) -> int:
+        """Write the aggregation into a summary table with INSERT ... SELECT, so no rows leave the database.
+
+        Args:
+            engine: The SQLAlchemy engine of the database.
+            summary_table (str): The name of the summary table.
+            replace (bool, optional): Drop an existing summary table first, otherwise append to it. Defaults to True.
+            logger (Logger, optional): Logger for the summary. Defaults to None.
+
+        Returns:
+            int: The number of rows in the summary table.
+        """
+        start = time.perf_counter()
+        statement = self.build(self.reflect(engine))
+        metadata = MetaData()
+        # Aggregates whose type the dialect can't infer (e.g. avg on SQLite) are stored as floats.
+        target = Table(summary_table, metadata, *[
+            Column(column.name, Float() if isinstance(column.type, sqltypes.NullType) else column.type) for column in statement.selected_columns
+        ])
+        with engine.begin() as connection:
+            if replace and inspect(connection).has_table(summary_table):
+                target.drop(connection)
+            target.create(connection, checkfirst=True)
+            connection.execute(target.insert().from_select([column.name for column in statement.selected_columns], statement))
+            rows = connection.execute(select([func.count()]).select_from(target)).scalar()
+        if logger is not None:
+            logger.log(f"Materialized {rows} aggregated rows of '{self.table_name}' into '{summary_table}' in {time.perf_counter() - start:.4f}s.")
+        return rows
@@ -0,0 +1,145 @@
+"""Module for running a queue of database operations on one connection inside a single transaction."""
+import time
+from typing import Callable, Dict, List, Union
+import pandas as pd
+from sqlalchemy import text
+from log_handler import Logger
+
+
+class BatchExecutor():
+    """Unit of work that queues SQL statements and DataFrame writes and runs them in one transaction.
+
+    Example:
+        >>> with handler.batch("food_db") as batch:
+        ...     batch.drop_tables("old_recipes")
+        ...     batch.add_columns("recipes", [("rating", "INT")])
+        ...     batch.append_dataframe("recipes", dataframe)
+        >>> batch.report
+    """
+    def __repr__(self):
+        return f"BatchExecutor(operations={len(self.operations)})"
+
+
+    def __str__(self):
+        return "BatchExecutor class that runs queued database operations on one connection and commits once"
+
+
+    def __init__(self, engine, logger: Logger = None):
+        self.engine = engine
+        self.logger = logger or Logger(name="batch_executor")
+        self.operations = []
+        self.report = None
+        # MySQL, MariaDB and Oracle implicitly commit on DDL, so those statements can't be rolled back.
+        self.transactional_ddl = engine.dialect.name not in ("mysql", "mariadb", "oracle")
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+        else:
+            self.logger.log(f"Batch discarded without running because of {exc_type.__name__}: {exc_value}", level='error')
+        return False
+
+
+    def add(self, operation: Union[str, Callable], name: str = None, **params) -> "BatchExecutor":
+        """Queue an operation.
+
+        Args:
+            operation (str or Callable): A SQL statement, executed with `params` as bind parameters, or a callable
+                that receives the connection as its only argument.
+            name (str, optional): Label used in the report. Defaults to the statement or the callable name.
+            **params: Bind parameters for the SQL statement.
+
+        Returns:
+            BatchExecutor: self, so calls can be chained.
+        """
+        if isinstance(operation, str):
+            label = name or operation
+            self.operations.append((label, lambda connection: connection.execute(text(operation), params)))
+        else:
+            self.operations.append((name or getattr(operation, "__name__", "operation"), operation))
+        return self
+
+
+    def drop_tables(self, *table_names: str) -> "BatchExecutor":
+        """Queue DROP TABLE IF EXISTS statements for the given tables."""
+        for table_name in table_names:
+            self.add(f"DROP TABLE IF EXISTS {table_name}")
+        return self
+
+
+    def add_columns(self, table_name: str, columns: List[tuple]) -> "BatchExecutor":
+        """Queue ALTER TABLE ... ADD COLUMN statements.
+
+        Args:
+            table_name (str): The name of the table.
+            columns (List[tuple]): (column_name, column_definition) tuples, e.g. [("age", "INT")].
+        """
+        for column_name, column_def in columns:
+            self.add(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_def}")
+        return self
+
+
+    def append_dataframe(self, table_name: str, dataframe: pd.DataFrame, if_exists: str = "append") -> "BatchExecutor":
+        """Queue a DataFrame write into a table.
+
+        Args:
+            table_name (str): The name of the table.
+            dataframe (pd.DataFrame): The rows to write.
+            if_exists (str, optional): Passed to `DataFrame.to_sql`. Defaults to "append".
+        """
+        return self.add(lambda connection: dataframe.to_sql(name=table_name, con=connection, if_exists=if_exists, index=False),
+                        name=f"{if_exists} {len(dataframe)} rows into {table_name}")
+
+
+    def execute(self) -> Dict:
+        """Run the queued operations on a single connection and commit once. Any failure rolls back the whole batch.
+
+        Returns:
+            dict: {"committed": bool, "total_time": float, "error": str or None,
+                "operations": [{"name": str, "duration": float, "status": "ok" | "failed" | "skipped"}]}
+        """
+        operations, self.operations = self.operations, []
+        report = {"committed": False, "total_time": 0.0, "error": None,
+                  "operations": [{"name": name, "duration": 0.0, "status": "skipped"} for name, _ in operations]}
+        if not self.transactional_ddl:
+            self.logger.log(f"The {self.engine.dialect.name} dialect commits DDL implicitly, DDL in this batch can't be rolled back.", level='warning')
+        start = time.perf_counter()
+        with self.engine.connect() as connection:
+            dbapi_connection = connection.connection.dbapi_connection
+            sqlite = self.engine.dialect.name == "sqlite"
+            if sqlite:
+                # pysqlite only opens transactions before DML on its own, so BEGIN is issued explicitly to cover DDL too.
+                isolation_level = dbapi_connection.isolation_level
+                dbapi_connection.isolation_level = None
+            transaction = connection.begin()
+            try:
+                if sqlite:
+                    connection.exec_driver_sql("BEGIN")
+                for entry, (name, operation) in zip(report["operations"], operations):
+                    operation_start = time.perf_counter()
+                    try:
+                        operation(connection)
+                    except Exception:
+                        entry["status"] = "failed"
+                        raise
+                    finally:
+                        entry["duration"] = time.perf_counter() - operation_start
+                    entry["status"] = "ok"
+                transaction.commit()
+                report["committed"] = True
+            except Exception as exception:
+                transaction.rollback()
+                report["error"] = str(exception)
+                self.logger.log(f"Batch rolled back: {exception}", level='exception')
+            finally:
+                if sqlite:
+                    dbapi_connection.isolation_level = isolation_level
+        report["total_time"] = time.perf_counter() - start
+        self.logger.log(f"Batch of {len(operations)} operations {'committed' if report['committed'] else 'rolled back'} in {report['total_time']:.4f}s.")
+        self.report = report
+        return report
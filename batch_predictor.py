@@ -0,0 +1,160 @@
+"""Module for scoring a database table in chunks and writing the predictions back in bulk."""
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+import numpy as np
+from sqlalchemy import Column, Float, Integer, MetaData, Table, inspect
+from log_handler import Logger
+from data_loader import DatabaseBatchLoader
+
+
+class BatchPredictor():
+    """Pipelined batch inference: a prefetching reader, a pool of scorer threads and a bulk writer run concurrently.
+
+    NumPy and scikit-learn release the GIL in their heavy loops, so scoring threads run in parallel while the reader
+    fetches the next chunks and the writer inserts the previous ones. Each chunk replaces the predictions stored for
+    its keys, so a run can be repeated. A SQLite target in the source's file can't commit while the source is read in
+    rollback-journal mode, so its predictions are spooled to one temporary .npz file per chunk during the read and
+    written after it, unless the file uses WAL (see `wal`).
+    """
+    def __repr__(self):
+        return f"BatchPredictor(table_name='{self.table_name}', predictions_table='{self.predictions_table}')"
+
+
+    def __str__(self):
+        return "BatchPredictor class that scores a table in parallel chunks and bulk-writes the predictions"
+
+
+    def __init__(self, engine, table_name: str, feature_columns: List[str], key_column: str, predict: Callable, predictions_table: str,
+                 target_engine=None, chunk_size: int = 10000, workers: int = 4, wal: bool = False, logger: Logger = None):
+        self.engine = engine
+        self.target_engine = target_engine or engine
+        self.table_name = table_name
+        self.feature_columns = list(feature_columns)
+        self.key_column = key_column
+        self.predict = predict
+        self.predictions_table = predictions_table
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.wal = wal
+        self.logger = logger or Logger(name="batch_predictor")
+        self.lock = threading.Lock()
+
+
+    def create_predictions_table(self) -> Table:
+        """Create the predictions table (key, prediction) if it doesn't exist and return it."""
+        key_type = next((column['type'] for column in inspect(self.engine).get_columns(self.table_name) if column['name'] == self.key_column), None)
+        python_type = getattr(key_type, 'python_type', None) if key_type is not None else None
+        if python_type not in (int, float):
+            raise ValueError(f"The key column '{self.key_column}' must be a numeric column of '{self.table_name}'.")
+        metadata = MetaData()
+        table = Table(self.predictions_table, metadata,
+                      Column(self.key_column, Integer if python_type is int else Float, primary_key=True),
+                      Column("prediction", Float))
+        metadata.create_all(self.target_engine)
+        return table
+
+
+    def defer_writes(self) -> bool:
+        """Tell whether writes must wait for the end of the read: a SQLite target sharing the source's file outside WAL mode.
+
+        With `wal` the file is switched to WAL journaling first. The setting persists in the database file.
+        """
+        if self.target_engine.dialect.name != "sqlite" or self.engine.url.database != self.target_engine.url.database:
+            return False
+        with self.target_engine.connect() as connection:
+            if self.wal:
+                connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+            return str(connection.exec_driver_sql("PRAGMA journal_mode").scalar()).lower() != "wal"
+
+
+    def run(self) -> Dict:
+        """Score every row of the source table and write the predictions.
+
+        Returns:
+            dict: 'rows', 'chunks', 'wall_time', 'rows_per_second' and the cumulative 'read_time', 'score_time' and 'write_time'.
+        """
+        table = self.create_predictions_table()
+        defer = self.defer_writes()
+        # Deferred chunks wait on disk rather than in memory, so a large table doesn't hold every prediction at once.
+        spool = tempfile.TemporaryDirectory(prefix="predictions_") if defer else None
+        deferred = []
+        metrics = {"rows": 0, "chunks": 0, "read_time": 0.0, "score_time": 0.0, "write_time": 0.0}
+        loader = DatabaseBatchLoader(self.engine, self.table_name, self.feature_columns, key_column=self.key_column, batch_size=self.chunk_size,
+                                     prefetch=self.workers * 2, logger=self.logger)
+
+        def score(keys: np.ndarray, features: np.ndarray):
+            start = time.perf_counter()
+            predictions = np.asarray(self.predict(features), dtype=np.float64).ravel()
+            with self.lock:
+                metrics["score_time"] += time.perf_counter() - start
+            return keys, predictions
+
+        def write(keys: np.ndarray, predictions: np.ndarray):
+            start = time.perf_counter()
+            keys = [key.item() if hasattr(key, "item") else key for key in keys]
+            rows = [{self.key_column: key, "prediction": float(prediction)} for key, prediction in zip(keys, predictions)]
+            with self.target_engine.begin() as connection:
+                # Replace earlier predictions of these keys; 500 keys per IN list stay under SQLite's variable limit.
+                for position in range(0, len(keys), 500):
+                    connection.execute(table.delete().where(table.c[self.key_column].in_(keys[position:position + 500])))
+                connection.execute(table.insert(), rows)
+            with self.lock:
+                metrics["write_time"] += time.perf_counter() - start
+                metrics["rows"] += len(rows)
+                metrics["chunks"] += 1
+
+        def save(keys: np.ndarray, predictions: np.ndarray) -> str:
+            path = os.path.join(spool.name, f"{len(deferred):08d}.npz")
+            np.savez(path, keys=keys, predictions=predictions)
+            return path
+
+        def write_saved(path: str):
+            with np.load(path, allow_pickle=True) as saved:
+                keys, predictions = saved["keys"], saved["predictions"]
+            os.remove(path)
+            write(keys, predictions)
+
+        start = time.perf_counter()
+        backlog = self.workers * 2
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="score") as scorers, \
+                    ThreadPoolExecutor(max_workers=1, thread_name_prefix="write") as writer:
+                pending_scores, pending_writes = deque(), deque()
+                blocks = iter(loader)
+                while True:
+                    read_start = time.perf_counter()
+                    block = next(blocks, None)
+                    metrics["read_time"] += time.perf_counter() - read_start
+                    if block is None:
+                        break
+                    pending_scores.append(scorers.submit(score, block[0], block[1]))
+                    while pending_scores and (len(pending_scores) > backlog or pending_scores[0].done()):
+                        if defer:
+                            deferred.append(save(*pending_scores.popleft().result()))
+                        else:
+                            pending_writes.append(writer.submit(write, *pending_scores.popleft().result()))
+                    while len(pending_writes) > backlog:
+                        pending_writes.popleft().result()
+                while pending_scores:
+                    if defer:
+                        deferred.append(save(*pending_scores.popleft().result()))
+                    else:
+                        pending_writes.append(writer.submit(write, *pending_scores.popleft().result()))
+                while pending_writes:
+                    pending_writes.popleft().result()
+                # The read is over: the spooled chunks are written one by one.
+                for path in deferred:
+                    write_saved(path)
+        finally:
+            if spool is not None:
+                spool.cleanup()
+        metrics["wall_time"] = time.perf_counter() - start
+        metrics["rows_per_second"] = metrics["rows"] / metrics["wall_time"] if metrics["wall_time"] else 0.0
+        self.logger.log(f"Scored {metrics['rows']} rows of '{self.table_name}' into '{self.predictions_table}' in {metrics['wall_time']:.4f}s "
+                        f"({metrics['rows_per_second']:.0f} rows/s).")
+        return metrics
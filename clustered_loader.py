@@ -0,0 +1,177 @@
+"""Module for loading tables sorted and clustered on a key, with compression where the dialect supports it."""
+import time
+from typing import Dict, List, Sequence, Tuple
+import pandas as pd
+from sqlalchemy import MetaData, String, Table, and_, select, text
+from log_handler import Logger
+
+
+class ClusteredLoader():
+    """Loads a DataFrame sorted by a clustering key into a table whose primary key is that key.
+
+    The primary key is the clustered index on MySQL/InnoDB and SQL Server, so rows with neighbouring keys share pages
+    and range scans read fewer of them. PostgreSQL tables are reordered with CLUSTER after the load. On SQLite the
+    sorted insert makes the rowid order follow the key, and the primary key index finds the range. A key that isn't
+    unique gets a `_row_id` tiebreaker column in the primary key; NULL keys are rejected before the table is created.
+    Compression uses ROW_FORMAT=COMPRESSED on InnoDB and PAGE compression on SQL Server.
+    """
+    def __repr__(self):
+        return f"ClusteredLoader(table_name='{self.table_name}', cluster_key={self.cluster_key}, compress={self.compress})"
+
+
+    def __str__(self):
+        return "ClusteredLoader class that loads tables sorted on a clustered primary key and reports size and range-scan times"
+
+
+    def __init__(self, engine, table_name: str, cluster_key: Sequence[str], compress: bool = True, chunk_size: int = 10000,
+                 logger: Logger = None):
+        self.engine = engine
+        self.table_name = table_name
+        self.cluster_key = [cluster_key] if isinstance(cluster_key, str) else list(cluster_key)
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.logger = logger or Logger(name="clustered_loader")
+        self.dialect = engine.dialect.name
+
+
+    def prepare(self, dataframe: pd.DataFrame) -> Tuple[pd.DataFrame, List[str]]:
+        """Sort the rows by the clustering key and add the `_row_id` tiebreaker when the key isn't unique.
+
+        Returns:
+            Tuple[pd.DataFrame, List[str]]: The sorted rows and the primary key columns.
+
+        Raises:
+            KeyError: If a key column is missing.
+            ValueError: If a key column holds NULLs, which a primary key column can't store.
+        """
+        missing = [column for column in self.cluster_key if column not in dataframe.columns]
+        if missing:
+            raise KeyError(f"Clustering key columns not found: {missing}")
+        nulls = int(dataframe[self.cluster_key].isna().any(axis=1).sum())
+        if nulls:
+            raise ValueError(f"{nulls} rows have a NULL clustering key {self.cluster_key}, fill or drop them before loading.")
+        dataframe = dataframe.sort_values(self.cluster_key, kind="mergesort").reset_index(drop=True)
+        primary_key = list(self.cluster_key)
+        if dataframe.duplicated(subset=self.cluster_key).any():
+            dataframe.insert(len(dataframe.columns), "_row_id", range(len(dataframe)))
+            primary_key.append("_row_id")
+        return dataframe, primary_key
+
+
+    def create_statement(self, dataframe: pd.DataFrame, table_name: str, primary_key: List[str] = None) -> str:
+        """Build the CREATE TABLE statement, with the primary key and the dialect's clustering and compression options."""
+        # Key columns holding text need a bounded length to be indexable on MySQL and SQL Server.
+        dtypes = {column: String(max(int(dataframe[column].astype(str).str.len().max() or 1), 1))
+                  for column in (primary_key or []) if dataframe[column].dtype == object}
+        statement = pd.io.sql.get_schema(dataframe.head(0), table_name, keys=primary_key, con=self.engine, dtype=dtypes).rstrip().rstrip(";")
+        if self.compress and self.dialect in ("mysql", "mariadb"):
+            statement += " ENGINE=InnoDB ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8"
+        elif self.compress and self.dialect == "mssql":
+            statement += " WITH (DATA_COMPRESSION = PAGE)"
+        return statement
+
+
+    def write(self, dataframe: pd.DataFrame, table_name: str, primary_key: List[str] = None) -> float:
+        """Create a table and bulk insert the rows in their current order. Returns the load time in seconds.
+
+        The table is dropped again when the insert fails, so a retry doesn't find a half-loaded table.
+        """
+        start = time.perf_counter()
+        with self.engine.begin() as connection:
+            connection.execute(text(self.create_statement(dataframe, table_name, primary_key)))
+        try:
+            dataframe.to_sql(name=table_name, con=self.engine, if_exists="append", index=False, chunksize=self.chunk_size)
+        except Exception:
+            with self.engine.begin() as connection:
+                connection.execute(text(f"DROP TABLE {table_name}"))
+            raise
+        if primary_key and self.dialect == "postgresql":
+            with self.engine.begin() as connection:
+                connection.execute(text(f"CLUSTER {table_name} USING {table_name}_pkey"))
+                connection.execute(text(f"ANALYZE {table_name}"))
+        return time.perf_counter() - start
+
+
+    def table_size(self, table_name: str):
+        """Get the bytes a table (data and indexes) takes on disk, or None when the dialect can't tell."""
+        statements = {
+            "sqlite": "SELECT SUM(pgsize) FROM dbstat WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = :table_name)",
+            "mysql": "SELECT data_length + index_length FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :table_name",
+            "mariadb": "SELECT data_length + index_length FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :table_name",
+            "postgresql": "SELECT pg_total_relation_size(:table_name)",
+            "mssql": "SELECT SUM(a.total_pages) * 8192 FROM sys.partitions p JOIN sys.allocation_units a ON a.container_id = p.partition_id "
+                     "WHERE p.object_id = OBJECT_ID(:table_name)",
+        }
+        if self.dialect not in statements:
+            return None
+        try:
+            with self.engine.connect() as connection:
+                if self.dialect in ("mysql", "mariadb"):
+                    connection.execute(text(f"ANALYZE TABLE {table_name}"))
+                size = connection.execute(text(statements[self.dialect]), {"table_name": table_name}).scalar()
+            return int(size) if size is not None else None
+        except Exception as error:
+            self.logger.log(f"Could not measure the size of '{table_name}': {error}", level='warning')
+            return None
+
+
+    def scan_range(self, dataframe: pd.DataFrame, fraction: float = 0.02) -> Tuple:
+        """Pick a range of the first key column covering about `fraction` of the rows, around the median."""
+        values = dataframe[self.cluster_key[0]].dropna().sort_values(kind="mergesort").reset_index(drop=True)
+        if values.empty:
+            return None, None
+        bounds = values.iloc[[int(len(values) * (0.5 - fraction / 2)), min(int(len(values) * (0.5 + fraction / 2)), len(values) - 1)]]
+        return tuple(bounds.tolist())
+
+
+    def time_range_scan(self, table_name: str, low, high, repeat: int = 3) -> float:
+        """Time fetching every row whose first key column is in [low, high]. Returns the best of `repeat` runs in seconds."""
+        table = Table(table_name, MetaData(), autoload_with=self.engine)
+        key = table.c[self.cluster_key[0]]
+        statement = select([table]).where(and_(key >= low, key <= high))
+        timings = []
+        with self.engine.connect() as connection:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                connection.execute(statement).fetchall()
+                timings.append(time.perf_counter() - start)
+        return min(timings)
+
+
+    def measure(self, table_name: str, low, high) -> Dict:
+        """Measure the on-disk size and range-scan time of a table."""
+        return {"table_name": table_name, "bytes": self.table_size(table_name), "range_scan_seconds": self.time_range_scan(table_name, low, high)}
+
+
+    def load(self, dataframe: pd.DataFrame, compare: bool = False, scan_range: Tuple = None) -> Dict:
+        """Load the DataFrame sorted and clustered on the key.
+
+        Args:
+            dataframe (pd.DataFrame): The rows to load.
+            compare (bool, optional): Also load the rows as they come into a default heap table, measure it as the
+                'before' layout and drop it. This writes the data twice, use it to benchmark rather than to ingest.
+                Defaults to False.
+            scan_range (tuple, optional): (low, high) of the first key column for the range-scan timing. Defaults to
+                the middle 2% of the key values.
+
+        Returns:
+            dict: The 'primary_key', 'rows', 'load_seconds', the 'after' measurements ('bytes', 'range_scan_seconds')
+                and, with compare, the 'before' measurements.
+        """
+        # Checked before anything is created, so a rejected load leaves no table behind.
+        sorted_rows, primary_key = self.prepare(dataframe)
+        low, high = scan_range or self.scan_range(dataframe)
+        report = {"table_name": self.table_name, "rows": len(dataframe), "compressed": self.compress and self.dialect in ("mysql", "mariadb", "mssql")}
+        if compare:
+            baseline = f"{self.table_name}__unclustered"
+            self.write(dataframe, baseline)
+            report["before"] = self.measure(baseline, low, high)
+            with self.engine.begin() as connection:
+                connection.execute(text(f"DROP TABLE {baseline}"))
+        report["primary_key"] = primary_key
+        report["load_seconds"] = self.write(sorted_rows, self.table_name, primary_key)
+        report["after"] = self.measure(self.table_name, low, high)
+        self.logger.log(f"Loaded {len(dataframe)} rows into '{self.table_name}' clustered on {primary_key}: {report['after']['bytes']} bytes, "
+                        f"range scan {report['after']['range_scan_seconds']:.4f}s"
+                        + (f" (before: {report['before']['bytes']} bytes, {report['before']['range_scan_seconds']:.4f}s)." if compare else "."))
+        return report
@@ -0,0 +1,144 @@
+"""Module for streaming fixed-size NumPy batches out of a database table."""
+import queue
+import threading
+from typing import Iterator, List, Tuple
+import numpy as np
+from sqlalchemy import text
+from log_handler import Logger
+
+
+class DatabaseBatchLoader():
+    """Streams (features, target) NumPy batches from a table through a server-side cursor.
+
+    A background thread reads ahead up to `prefetch` batches while the caller trains on the current one, so memory is
+    bounded by the batch size, the shuffle buffer and the prefetch depth rather than by the table size. With a
+    `key_column` every batch is (keys, features, target) and the keys keep their database type instead of float64.
+
+    Example:
+        >>> loader = DatabaseBatchLoader(handler.get_engine("food_db"), "recipes", ["calories", "fat"], "rating", batch_size=4096)
+        >>> for features, target in loader:
+        ...     model.partial_fit(features, target)
+    """
+    def __repr__(self):
+        return f"DatabaseBatchLoader(table_name='{self.table_name}', batch_size={self.batch_size})"
+
+
+    def __str__(self):
+        return "DatabaseBatchLoader class that streams NumPy batches from a database table"
+
+
+    def __init__(self, engine, table_name: str, feature_columns: List[str], target_column: str = None, batch_size: int = 1024,
+                 shuffle_buffer: int = 0, prefetch: int = 2, seed: int = None, key_column: str = None, logger: Logger = None):
+        if key_column and shuffle_buffer:
+            raise ValueError("Keyed batches can't be shuffled.")
+        self.engine = engine
+        self.table_name = table_name
+        self.feature_columns = list(feature_columns)
+        self.target_column = target_column
+        self.key_column = key_column
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+        self.prefetch = prefetch
+        self.rng = np.random.default_rng(seed)
+        self.logger = logger or Logger(name="data_loader")
+        self.end_of_data = object()
+
+
+    def statement(self) -> str:
+        """Build the SELECT statement for the streamed columns."""
+        columns = ([self.key_column] if self.key_column else []) + self.feature_columns + ([self.target_column] if self.target_column else [])
+        return f"SELECT {', '.join(columns)} FROM {self.table_name}"
+
+
+    def split(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Split a block of rows into the feature matrix and the target vector (None without a target column).
+
+        A keyed block (keys, rows) is split into the keys, the feature matrix and the target vector.
+        """
+        if isinstance(rows, tuple):
+            keys, rows = rows
+            return (keys,) + self.split(rows)
+        if self.target_column:
+            return rows[:, :-1], rows[:, -1]
+        return rows, None
+
+
+    def read_blocks(self) -> Iterator[np.ndarray]:
+        """Read the table in blocks of `batch_size` rows, shuffling them through the buffer when enabled.
+
+        Yields:
+            np.ndarray: float64 blocks of shape (batch_size, columns). The last one may be shorter.
+        """
+        buffer = []
+        buffered_rows = 0
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(text(self.statement()))
+            while True:
+                rows = result.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                if self.key_column:
+                    yield np.array([row[0] for row in rows]), np.array([tuple(row)[1:] for row in rows], dtype=np.float64)
+                    continue
+                # Converting plain tuples is an order of magnitude faster than letting NumPy walk the Row objects.
+                block = np.array([tuple(row) for row in rows], dtype=np.float64)
+                if not self.shuffle_buffer:
+                    yield block
+                    continue
+                buffer.append(block)
+                buffered_rows += len(block)
+                if buffered_rows >= self.shuffle_buffer:
+                    pool = np.concatenate(buffer)
+                    self.rng.shuffle(pool)
+                    # Emit all but one batch and keep the remainder mixing with the rows still to come.
+                    cut = max(len(pool) - self.batch_size, 0) // self.batch_size * self.batch_size
+                    for start in range(0, cut, self.batch_size):
+                        yield pool[start:start + self.batch_size]
+                    buffer, buffered_rows = [pool[cut:]], len(pool) - cut
+        if buffer:
+            pool = np.concatenate(buffer)
+            self.rng.shuffle(pool)
+            for start in range(0, len(pool), self.batch_size):
+                yield pool[start:start + self.batch_size]
+
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        if not self.prefetch:
+            for block in self.read_blocks():
+                yield self.split(block)
+            return
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def producer():
+            try:
+                for block in self.read_blocks():
+                    if not put(block):
+                        return
+                put(self.end_of_data)
+            except Exception as exception:
+                self.logger.log(f"Reading batches from '{self.table_name}' failed: {exception}", level='exception')
+                put(exception)
+
+        thread = threading.Thread(target=producer, name=f"prefetch-{self.table_name}", daemon=True)
+        thread.start()
+        try:
+            while True:
+                block = batches.get()
+                if block is self.end_of_data:
+                    break
+                if isinstance(block, Exception):
+                    raise block
+                yield self.split(block)
+        finally:
+            stop.set()
+            thread.join()
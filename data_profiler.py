@@ -0,0 +1,204 @@
+"""Module for computing per-column statistics of ingested tables in bounded memory."""
+import json
+import time
+from collections import Counter
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, inspect
+
+
+class HyperLogLog():
+    """HyperLogLog distinct counter with 2**precision registers. Hashing is vectorized through pandas."""
+    def __repr__(self):
+        return f"HyperLogLog(precision={self.precision})"
+
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype=np.uint8)
+
+
+    def update(self, series: pd.Series) -> None:
+        """Add the non-null values of a Series."""
+        values = series.dropna()
+        if values.empty:
+            return
+        hashes = pd.util.hash_pandas_object(values.astype(str), index=False).to_numpy(dtype=np.uint64)
+        remaining_bits = 64 - self.precision
+        indexes = (hashes >> np.uint64(remaining_bits)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << remaining_bits) - 1)
+        bit_length = np.zeros(len(remainder), dtype=np.int64)
+        nonzero = remainder > 0
+        bit_length[nonzero] = np.floor(np.log2(remainder[nonzero].astype(np.float64))).astype(np.int64) + 1
+        ranks = (remaining_bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, indexes, ranks)
+
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Merge another counter of the same precision into this one."""
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+
+    def estimate(self) -> int:
+        """Estimate the number of distinct values added so far."""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class ColumnProfile():
+    """Incremental statistics of one column: null fraction, distinct estimate, min/max, top-k and a histogram."""
+    def __repr__(self):
+        return f"ColumnProfile(name='{self.name}', rows={self.rows})"
+
+
+    def __init__(self, name: str, top_k: int = 10, reservoir_size: int = 10000, bins: int = 20, seed: int = 0):
+        self.name = name
+        self.top_k = top_k
+        self.reservoir_size = reservoir_size
+        self.bins = bins
+        self.rng = np.random.default_rng(seed)
+        self.rows = 0
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        self.numeric = True
+        self.distinct = HyperLogLog()
+        self.counts = Counter()
+        self.reservoir = np.empty(0, dtype=np.float64)
+        self.seen_numeric = 0
+
+
+    def update(self, series: pd.Series) -> None:
+        """Add a chunk of the column."""
+        self.rows += len(series)
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        if values.empty:
+            return
+        self.distinct.update(values)
+        self.numeric = self.numeric and pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+        try:
+            minimum, maximum = values.min(), values.max()
+            self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+            self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+        except TypeError:
+            pass
+        self.counts.update(values.astype(str).value_counts().head(self.top_k * 10).to_dict())
+        if len(self.counts) > self.top_k * 100:
+            self.counts = Counter(dict(self.counts.most_common(self.top_k * 10)))
+        if self.numeric:
+            self.sample(values.to_numpy(dtype=np.float64))
+
+
+    def sample(self, values: np.ndarray) -> None:
+        """Keep a uniform reservoir sample of the numeric values for the histogram."""
+        free = self.reservoir_size - len(self.reservoir)
+        if free > 0:
+            self.reservoir = np.concatenate([self.reservoir, values[:free]])
+            self.seen_numeric += min(free, len(values))
+            values = values[free:]
+        if len(values):
+            positions = self.rng.integers(0, self.seen_numeric + np.arange(1, len(values) + 1))
+            keep = positions < self.reservoir_size
+            self.reservoir[positions[keep]] = values[keep]
+            self.seen_numeric += len(values)
+
+
+    def to_dict(self) -> Dict:
+        """Summarize the statistics."""
+        histogram = None
+        if self.numeric and len(self.reservoir):
+            counts, edges = np.histogram(self.reservoir, bins=self.bins)
+            scale = (self.rows - self.nulls) / len(self.reservoir)
+            histogram = {"edges": edges.tolist(), "counts": [int(round(count * scale)) for count in counts]}
+        return {
+            "column_name": self.name,
+            "rows": self.rows,
+            "null_fraction": self.nulls / self.rows if self.rows else 0.0,
+            "distinct_estimate": self.distinct.estimate(),
+            "min_value": None if self.minimum is None else str(self.minimum),
+            "max_value": None if self.maximum is None else str(self.maximum),
+            "top_k": self.counts.most_common(self.top_k),
+            "histogram": histogram,
+        }
+
+
+class TableProfiler():
+    """Profiles a table chunk by chunk and persists the result to the `_table_profiles` sidecar table."""
+    def __repr__(self):
+        return f"TableProfiler(table_name='{self.table_name}')"
+
+
+    def __str__(self):
+        return "TableProfiler class that computes per-column statistics incrementally and stores them in a metadata table"
+
+
+    def __init__(self, table_name: str, top_k: int = 10, bins: int = 20):
+        self.table_name = table_name
+        self.top_k = top_k
+        self.bins = bins
+        self.columns = {}
+        self.metadata_table = Table(
+            "_table_profiles", MetaData(),
+            Column("table_name", String(255), primary_key=True),
+            Column("column_name", String(255), primary_key=True),
+            Column("rows", Integer),
+            Column("null_fraction", Float),
+            Column("distinct_estimate", Integer),
+            Column("min_value", Text),
+            Column("max_value", Text),
+            Column("top_k", Text),
+            Column("histogram", Text),
+            Column("profiled_at", Float),
+        )
+
+
+    def update(self, dataframe: pd.DataFrame) -> None:
+        """Add a chunk of rows, e.g. each batch written during ingestion."""
+        for column in dataframe.columns:
+            if column not in self.columns:
+                self.columns[column] = ColumnProfile(str(column), top_k=self.top_k, bins=self.bins)
+            self.columns[column].update(dataframe[column])
+
+
+    def profile(self) -> List[Dict]:
+        """Get the statistics of every column."""
+        return [column.to_dict() for column in self.columns.values()]
+
+
+    def persist(self, engine) -> List[Dict]:
+        """Replace the stored profile of the table in the `_table_profiles` sidecar table.
+
+        Args:
+            engine: The SQLAlchemy engine of the profiled database.
+
+        Returns:
+            List[Dict]: The stored profile.
+        """
+        profile = self.profile()
+        profiled_at = time.time()
+        self.metadata_table.create(bind=engine, checkfirst=True)
+        with engine.begin() as connection:
+            connection.execute(self.metadata_table.delete().where(self.metadata_table.c.table_name == self.table_name))
+            if profile:
+                connection.execute(self.metadata_table.insert(), [
+                    {**column, "table_name": self.table_name, "top_k": json.dumps(column["top_k"]),
+                     "histogram": json.dumps(column["histogram"]), "profiled_at": profiled_at}
+                    for column in profile
+                ])
+        return profile
+
+
+    def load(self, engine) -> List[Dict]:
+        """Read the stored profile of the table, or an empty list if it was never profiled."""
+        if not inspect(engine).has_table(self.metadata_table.name):
+            return []
+        with engine.connect() as connection:
+            rows = connection.execute(self.metadata_table.select().where(self.metadata_table.c.table_name == self.table_name)).mappings().fetchall()
+        return [{**row, "top_k": json.loads(row["top_k"]), "histogram": json.loads(row["histogram"])} for row in rows]
@@ -0,0 +1,136 @@
+"""Module for shrinking DataFrames before they are written to the database."""
+from typing import Dict, List, Tuple, Union
+import numpy as np
+import pandas as pd
+from sqlalchemy import BigInteger, Float, Integer, SmallInteger
+
+
+class DataFrameOptimizer():
+    """Downcasts numeric columns, turns low-cardinality strings into categoricals and parses date columns once."""
+    def __repr__(self):
+        return f"DataFrameOptimizer(category_threshold={self.category_threshold}, parse_dates={self.parse_dates})"
+
+
+    def __str__(self):
+        return "DataFrameOptimizer class that reduces the memory footprint of DataFrames before insertion"
+
+
+    def __init__(self, category_threshold: float = 0.5, max_categories: int = 10000, parse_dates: Union[str, List[str], None] = "auto",
+                 date_sample_size: int = 100):
+        """
+        Args:
+            category_threshold (float, optional): Convert string columns whose distinct/total ratio is below this. Defaults to 0.5.
+            max_categories (int, optional): Never convert columns with more distinct values than this. Defaults to 10000.
+            parse_dates (str or list, optional): "auto" to detect date columns from a sample, a list of column names, or None.
+                A column is converted only when all its values parse as dates. Defaults to "auto".
+            date_sample_size (int, optional): Number of non-null values sampled when detecting date columns. Defaults to 100.
+        """
+        self.category_threshold = category_threshold
+        self.max_categories = max_categories
+        self.parse_dates = parse_dates
+        self.date_sample_size = date_sample_size
+
+
+    def downcast_numeric(self, series: pd.Series) -> pd.Series:
+        """Downcast an integer or float column to the smallest dtype that holds its values without loss.
+
+        Args:
+            series (pd.Series): The numeric column.
+
+        Returns:
+            pd.Series: The downcast column, or the original one if nothing smaller fits.
+        """
+        if pd.api.types.is_bool_dtype(series):
+            return series
+        if pd.api.types.is_integer_dtype(series):
+            # Unsigned only up to uint32: databases have no unsigned 64-bit type and to_sql rejects uint64.
+            unsigned = len(series) and series.min() >= 0 and series.max() <= np.iinfo(np.uint32).max
+            return pd.to_numeric(series, downcast="unsigned" if unsigned else "integer")
+        if pd.api.types.is_float_dtype(series):
+            values = series.to_numpy()
+            candidate = values.astype(np.float32)
+            if np.array_equal(candidate.astype(values.dtype), values, equal_nan=True):
+                return pd.Series(candidate, index=series.index, name=series.name)
+        return series
+
+
+    def column_types(self, conversions: Dict) -> Dict:
+        """Get the SQL types of the original dtypes of downcast numeric columns, for the `dtype` of `to_sql`.
+
+        The table is then created as wide as the source data, so later appends of larger or more precise values fit
+        even though this batch was written from the smaller dtypes.
+
+        Args:
+            conversions (Dict): The 'conversions' of an `optimize` report.
+
+        Returns:
+            Dict: Column name to SQLAlchemy type.
+        """
+        types = {}
+        for column, (before, _) in conversions.items():
+            if before in ("int8", "uint8", "int16"):
+                types[column] = SmallInteger()
+            elif before in ("int32", "uint16"):
+                types[column] = Integer()
+            elif before.lower().startswith(("int", "uint")):
+                types[column] = BigInteger()
+            elif before.startswith("float"):
+                types[column] = Float(precision=53) if before == "float64" else Float()
+        return types
+
+
+    def looks_like_dates(self, series: pd.Series) -> bool:
+        """Check whether a sample of a string column parses as dates.
+
+        Args:
+            series (pd.Series): The object column.
+
+        Returns:
+            bool: True if every sampled value parses as a date.
+        """
+        sample = series.dropna().head(self.date_sample_size)
+        if sample.empty or not all(isinstance(value, str) for value in sample):
+            return False
+        if sample.str.fullmatch(r"[-+]?\d+(\.\d+)?").any():
+            return False
+        return pd.to_datetime(sample, errors="coerce", format="mixed").notna().all()
+
+
+    def optimize(self, dataframe: pd.DataFrame) -> Tuple[pd.DataFrame, Dict]:
+        """Shrink the DataFrame's dtypes.
+
+        Args:
+            dataframe (pd.DataFrame): The DataFrame to optimize. It is not modified.
+
+        Returns:
+            Tuple[pd.DataFrame, Dict]: The optimized copy and a report with the memory in bytes before and after and the
+                dtype change of every converted column.
+        """
+        memory_before = int(dataframe.memory_usage(deep=True).sum())
+        optimized = dataframe.copy()
+        date_columns = self.parse_dates if isinstance(self.parse_dates, list) else []
+        conversions = {}
+        for column in optimized.columns:
+            series = optimized[column]
+            before = str(series.dtype)
+            if column in date_columns or (self.parse_dates == "auto" and series.dtype == object and self.looks_like_dates(series)):
+                dates = pd.to_datetime(series, errors="coerce", format="mixed")
+                # Only the sample may have looked like dates: a column with any value that doesn't parse stays object.
+                if dates.notna().sum() == series.notna().sum():
+                    optimized[column] = dates
+            elif pd.api.types.is_numeric_dtype(series):
+                optimized[column] = self.downcast_numeric(series)
+            elif series.dtype == object and len(series):
+                distinct = series.nunique(dropna=True)
+                if distinct <= self.max_categories and distinct / len(series) < self.category_threshold:
+                    optimized[column] = series.astype("category")
+            if str(optimized[column].dtype) != before:
+                conversions[column] = (before, str(optimized[column].dtype))
+        memory_after = int(optimized.memory_usage(deep=True).sum())
+        report = {
+            "memory_before": memory_before,
+            "memory_after": memory_after,
+            "reduction": 1 - memory_after / memory_before if memory_before else 0.0,
+            "conversions": conversions,
+        }
+        return optimized, report
@@ -0,0 +1,235 @@
+"""Module for planning bulk dataset downloads within a byte budget and the free space of the download disk."""
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Callable, Dict, List
+from log_handler import Logger
+from size_utils import parse_size
+
+
+class DownloadPlanner():
+    """Decides which datasets to download, in which order, and which extracted datasets to evict to make room.
+
+    Downloads are tracked in the `.download_planner.json` index of the download folder with their size on disk, the
+    download time and the last time they were ingested. When space is needed, the least recently ingested datasets
+    (LRU) are evicted first; datasets that were never ingested count from their download time.
+
+    Kaggle reports the zipped size, while the budget and the index count extracted bytes. A dataset is planned at
+    its zip size times the expansion ratio (the largest ratio measured on earlier downloads, `expansion_estimate`
+    until one was measured), and its disk check also counts the zip, which sits next to the extracted files until
+    the download finishes.
+    """
+    def __repr__(self):
+        return f"DownloadPlanner(download_folder='{self.download_folder}', byte_budget={self.byte_budget}, min_free_bytes={self.min_free_bytes})"
+
+
+    def __str__(self):
+        return "DownloadPlanner class that orders downloads by size or priority and evicts least-recently-ingested datasets"
+
+
+    def __init__(self, download_folder: str, byte_budget: int = None, min_free_bytes: int = 1024 ** 3, order_by: str = "size",
+                 evict: bool = True, expansion_estimate: float = 4.0, logger: Logger = None):
+        if order_by not in ("size", "priority", "downloads"):
+            raise ValueError(f"Unsupported download order: {order_by}")
+        self.download_folder = download_folder
+        self.byte_budget = byte_budget
+        self.min_free_bytes = min_free_bytes
+        self.order_by = order_by
+        self.evict_datasets = evict
+        self.expansion_estimate = expansion_estimate
+        self.logger = logger or Logger(name="download_planner")
+        self.lock = threading.Lock()
+        self.index_path = os.path.join(download_folder, ".download_planner.json")
+        os.makedirs(download_folder, exist_ok=True)
+        self.index = self.load_index()
+
+
+    def load_index(self) -> Dict[str, Dict]:
+        """Read the index of tracked datasets, dropping the ones deleted from disk."""
+        if not os.path.isfile(self.index_path):
+            return {}
+        with open(self.index_path, "r") as file:
+            index = json.load(file)
+        return {ref: entry for ref, entry in index.items() if os.path.exists(entry["path"])}
+
+
+    def save_index(self) -> None:
+        """Write the index atomically."""
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.index, file, indent=2)
+        os.replace(temporary_path, self.index_path)
+
+
+    def dataset_path(self, ref: str) -> str:
+        """Get the folder a dataset is extracted to."""
+        return os.path.join(self.download_folder, ref)
+
+
+    def directory_size(self, path: str) -> int:
+        """Get the number of bytes of the files under a folder."""
+        return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+
+    def free_bytes(self) -> int:
+        """Get the free bytes of the disk holding the download folder."""
+        return shutil.disk_usage(self.download_folder).free
+
+
+    def used_bytes(self) -> int:
+        """Get the bytes used by the tracked datasets."""
+        return sum(entry["bytes"] for entry in self.index.values())
+
+
+    def expansion_ratio(self) -> float:
+        """Get the ratio of extracted to zipped bytes: the largest one measured so far, or `expansion_estimate`."""
+        ratios = [entry["bytes"] / entry["compressed_bytes"] for entry in self.index.values() if entry.get("compressed_bytes")]
+        return max(ratios) if ratios else self.expansion_estimate
+
+
+    def required_bytes(self, size: int) -> tuple:
+        """Get the (extracted, peak) bytes of a dataset whose zip has `size` bytes. The peak holds the zip and its files."""
+        extracted = int(size * self.expansion_ratio())
+        return extracted, extracted + size
+
+
+    def eviction_candidates(self, keep: List[str] = ()) -> List[str]:
+        """Get the tracked datasets from least to most recently ingested, excluding the ones to keep."""
+        entries = [(entry.get("last_ingested") or entry["downloaded_at"], ref) for ref, entry in self.index.items() if ref not in keep]
+        return [ref for _, ref in sorted(entries)]
+
+
+    def order(self, records: List[Dict], priority: Callable[[Dict], float] = None) -> List[Dict]:
+        """Sort the datasets: smallest first, highest priority first, or most downloaded first."""
+        if self.order_by == "priority":
+            if priority is None:
+                raise ValueError('order_by="priority" needs a priority callable.')
+            return sorted(records, key=priority, reverse=True)
+        if self.order_by == "downloads":
+            return sorted(records, key=lambda record: record.get("downloadCount") or 0, reverse=True)
+        return sorted(records, key=lambda record: parse_size(record.get("size")) or 0)
+
+
+    def plan(self, records: List[Dict], priority: Callable[[Dict], float] = None) -> Dict:
+        """Plan the download of search results.
+
+        The byte budget is checked against the extracted size and the free space against the peak size (zip plus
+        extracted files) of every dataset, see `required_bytes`.
+
+        Args:
+            records (List[Dict]): Datasets in the format of `KaggleHandler.search_kaggle_datasets`, with 'ref' and 'size'.
+            priority (Callable, optional): Scores a record, highest first. Required when order_by is "priority". Defaults to None.
+
+        Returns:
+            dict: 'download' (the records to download, in order), 'evict' (the refs to delete first), 'skipped'
+                (records with a 'reason'), 'planned_bytes' (extracted) and 'evicted_bytes'.
+        """
+        plan = {"download": [], "evict": [], "skipped": [], "planned_bytes": 0, "evicted_bytes": 0}
+        available = self.free_bytes() - self.min_free_bytes
+        used = self.used_bytes()
+        wanted = [record["ref"] for record in records]
+        candidates = self.eviction_candidates(keep=wanted) if self.evict_datasets else []
+        for record in self.order(records, priority):
+            size = parse_size(record.get("size"))
+            if os.path.exists(self.dataset_path(record["ref"])):
+                plan["skipped"].append({**record, "reason": "already downloaded"})
+                continue
+            if size is None:
+                plan["skipped"].append({**record, "reason": "unknown size"})
+                continue
+            extracted, peak = self.required_bytes(size)
+            if self.byte_budget is not None and extracted > self.byte_budget:
+                plan["skipped"].append({**record, "reason": "larger than the byte budget"})
+                continue
+            # Evict until the dataset fits both the free-space threshold and the budget.
+            evicted = []
+            while candidates and (peak > available or (self.byte_budget is not None and used + extracted > self.byte_budget)):
+                ref = candidates.pop(0)
+                evicted.append(ref)
+                available += self.index[ref]["bytes"]
+                used -= self.index[ref]["bytes"]
+            if peak > available or (self.byte_budget is not None and used + extracted > self.byte_budget):
+                # Nothing left to evict: give the evicted datasets back, a smaller one later in the order may still fit.
+                for ref in reversed(evicted):
+                    candidates.insert(0, ref)
+                    available -= self.index[ref]["bytes"]
+                    used += self.index[ref]["bytes"]
+                plan["skipped"].append({**record, "reason": "not enough disk space" if peak > available else "over the byte budget"})
+                continue
+            plan["evict"] += evicted
+            plan["evicted_bytes"] += sum(self.index[ref]["bytes"] for ref in evicted)
+            plan["download"].append(record)
+            plan["planned_bytes"] += extracted
+            available -= extracted
+            used += extracted
+        self.logger.log(f"Planned {len(plan['download'])} downloads ({plan['planned_bytes']} bytes), {len(plan['evict'])} evictions, "
+                        f"{len(plan['skipped'])} skipped.")
+        return plan
+
+
+    def evict(self, ref: str) -> int:
+        """Delete an extracted dataset and stop tracking it. Returns the bytes freed."""
+        with self.lock:
+            entry = self.index.pop(ref, None)
+            if entry is None:
+                return 0
+            shutil.rmtree(entry["path"], ignore_errors=True)
+            self.save_index()
+        self.logger.log(f"Evicted '{ref}' ({entry['bytes']} bytes) from {self.download_folder}.")
+        return entry["bytes"]
+
+
+    def record_download(self, ref: str, compressed_bytes: int = None) -> int:
+        """Start tracking a downloaded dataset, with its zip size to measure the expansion ratio. Returns its size on disk."""
+        path = self.dataset_path(ref)
+        size = self.directory_size(path)
+        with self.lock:
+            self.index[ref] = {"path": path, "bytes": size, "compressed_bytes": compressed_bytes, "downloaded_at": time.time(), "last_ingested": None}
+            self.save_index()
+        return size
+
+
+    def mark_ingested(self, ref: str) -> None:
+        """Record that a dataset was just ingested, making it the last candidate for eviction."""
+        with self.lock:
+            if ref in self.index:
+                self.index[ref]["last_ingested"] = time.time()
+                self.save_index()
+
+
+    def execute(self, plan: Dict, download: Callable[[str, str], None]) -> Dict:
+        """Carry out a plan: evict, then download in order while re-checking the free space before every download.
+
+        Args:
+            plan (dict): The result of `plan`.
+            download (Callable): Downloads and extracts a dataset, called as download(ref, path).
+
+        Returns:
+            dict: The 'downloaded' refs, the 'evicted' refs, the 'failed' refs with their error, 'bytes' written and 'wall_time'.
+        """
+        start = time.perf_counter()
+        report = {"downloaded": [], "evicted": [], "failed": {}, "bytes": 0}
+        for ref in plan["evict"]:
+            self.evict(ref)
+            report["evicted"].append(ref)
+        for record in plan["download"]:
+            ref = record["ref"]
+            size = parse_size(record.get("size"))
+            if self.required_bytes(size)[1] > self.free_bytes() - self.min_free_bytes:
+                report["failed"][ref] = "not enough disk space"
+                continue
+            try:
+                download(ref, self.dataset_path(ref))
+                report["bytes"] += self.record_download(ref, compressed_bytes=size)
+                report["downloaded"].append(ref)
+            except Exception as error:
+                self.logger.log(f"Download of '{ref}' failed: {error}", level='error')
+                report["failed"][ref] = str(error)
+                # A partly extracted folder would be taken for a finished download by the next plan.
+                shutil.rmtree(self.dataset_path(ref), ignore_errors=True)
+        report["wall_time"] = time.perf_counter() - start
+        self.logger.log(f"Downloaded {len(report['downloaded'])} datasets ({report['bytes']} bytes) in {report['wall_time']:.4f}s, "
+                        f"{len(report['failed'])} failed.")
+        return report
@@ -0,0 +1,132 @@
+"""Module for caching table features on disk as memory-mapped NumPy arrays."""
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Tuple
+import numpy as np
+from sqlalchemy import text
+from log_handler import Logger
+from data_loader import DatabaseBatchLoader
+
+
+class FeatureCache():
+    """On-disk cache of table columns as .npy files, opened as memory maps so repeated runs and processes share pages.
+
+    Entries are keyed by database (the engine URL without its password), table name and column selection, and
+    versioned by the row count plus a checksum of the column sums (and the maximum of `version_column` when given).
+    A changed source table gets a new version and the old one is deleted.
+    """
+    def __repr__(self):
+        return f"FeatureCache(cache_directory='{self.cache_directory}')"
+
+
+    def __str__(self):
+        return "FeatureCache class that materializes database tables into memory-mapped .npy files"
+
+
+    def __init__(self, cache_directory: str = None, batch_size: int = 50000, logger: Logger = None):
+        self.cache_directory = cache_directory or os.path.join(os.path.expanduser('~'), ".feature_cache")
+        self.batch_size = batch_size
+        self.logger = logger or Logger(name="feature_cache")
+
+
+    def cache_key(self, engine, table_name: str, feature_columns: List[str], target_column: str = None) -> str:
+        """Build the cache key of a table and column selection. The engine URL is part of it, so same-named tables of
+        different databases get their own entries."""
+        database = engine.url.render_as_string(hide_password=True)
+        selection = hashlib.sha1(json.dumps([database, feature_columns, target_column]).encode()).hexdigest()[:10]
+        return f"{table_name}-{selection}"
+
+
+    def data_version(self, engine, table_name: str, columns: List[str], version_column: str = None) -> Tuple[str, int]:
+        """Compute the data version of a table with a single aggregate query, without transferring any rows.
+
+        Args:
+            engine: The SQLAlchemy engine.
+            table_name (str): The name of the table.
+            columns (List[str]): The cached columns, whose sums form the checksum.
+            version_column (str, optional): A monotonic column, e.g. an id or updated_at, whose maximum is included. Defaults to None.
+
+        Returns:
+            Tuple[str, int]: The version hash and the row count.
+        """
+        aggregates = ["COUNT(*)"] + [f"SUM({column})" for column in columns]
+        if version_column:
+            aggregates.append(f"MAX({version_column})")
+        with engine.connect() as connection:
+            row = connection.execute(text(f"SELECT {', '.join(aggregates)} FROM {table_name}")).fetchone()
+        values = [str(value) for value in row]
+        return hashlib.sha1("|".join(values).encode()).hexdigest()[:16], int(row[0])
+
+
+    def materialize(self, engine, table_name: str, feature_columns: List[str], target_column: str, directory: str, rows: int) -> None:
+        """Stream a table into preallocated .npy files, one batch at a time.
+
+        Args:
+            engine: The SQLAlchemy engine.
+            table_name (str): The name of the table.
+            feature_columns (List[str]): The feature columns.
+            target_column (str): The target column, or None.
+            directory (str): The version directory to write to.
+            rows (int): The row count, used to preallocate the files.
+        """
+        os.makedirs(directory, exist_ok=True)
+        features = np.lib.format.open_memmap(os.path.join(directory, "features.npy"), mode="w+", dtype=np.float64, shape=(rows, len(feature_columns)))
+        target = np.lib.format.open_memmap(os.path.join(directory, "target.npy"), mode="w+", dtype=np.float64, shape=(rows,)) if target_column else None
+        position = 0
+        loader = DatabaseBatchLoader(engine, table_name, feature_columns, target_column=target_column, batch_size=self.batch_size, logger=self.logger)
+        for batch_features, batch_target in loader:
+            end = min(position + len(batch_features), rows)
+            features[position:end] = batch_features[:end - position]
+            if target is not None:
+                target[position:end] = batch_target[:end - position]
+            position = end
+        features.flush()
+        if target is not None:
+            target.flush()
+
+
+    def load(self, engine, table_name: str, feature_columns: List[str], target_column: str = None, version_column: str = None) -> Tuple[np.ndarray, np.ndarray, Dict]:
+        """Get the cached arrays of a table, materializing them first if the cache is missing or stale.
+
+        Args:
+            engine: The SQLAlchemy engine.
+            table_name (str): The name of the table.
+            feature_columns (List[str]): The feature columns.
+            target_column (str, optional): The target column. Defaults to None.
+            version_column (str, optional): A monotonic column included in the data version. Defaults to None.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, Dict]: Read-only memory-mapped features and target (None without a target column),
+                and {"hit": bool, "version": str, "rows": int, "load_time": float}.
+        """
+        start = time.perf_counter()
+        columns = list(feature_columns) + ([target_column] if target_column else [])
+        version, rows = self.data_version(engine, table_name, columns, version_column=version_column)
+        entry_directory = os.path.join(self.cache_directory, self.cache_key(engine, table_name, list(feature_columns), target_column))
+        directory = os.path.join(entry_directory, version)
+        hit = os.path.exists(os.path.join(directory, "meta.json"))
+        if not hit:
+            if os.path.isdir(entry_directory):
+                shutil.rmtree(entry_directory)
+                self.logger.log(f"Feature cache for '{table_name}' is stale, rebuilding version {version}.")
+            self.materialize(engine, table_name, list(feature_columns), target_column, directory, rows)
+            with open(os.path.join(directory, "meta.json"), "w") as file:
+                json.dump({"table_name": table_name, "feature_columns": list(feature_columns), "target_column": target_column,
+                           "version": version, "rows": rows, "created": time.time()}, file)
+        features = np.load(os.path.join(directory, "features.npy"), mmap_mode="r")
+        target = np.load(os.path.join(directory, "target.npy"), mmap_mode="r") if target_column else None
+        info = {"hit": hit, "version": version, "rows": rows, "load_time": time.perf_counter() - start}
+        self.logger.log(f"Feature cache {'hit' if hit else 'miss'} for '{table_name}' ({rows} rows) in {info['load_time']:.4f}s.")
+        return features, target, info
+
+
+    def invalidate(self, table_name: str = None) -> None:
+        """Delete the cached entries of a table, or the whole cache when no table is given."""
+        if not os.path.isdir(self.cache_directory):
+            return
+        for entry in os.listdir(self.cache_directory):
+            if table_name is None or entry.rsplit("-", 1)[0] == table_name:
+                shutil.rmtree(os.path.join(self.cache_directory, entry), ignore_errors=True)
@@ -0,0 +1,221 @@
+"""Module for reading the delimited, JSON-lines and Parquet files found in dataset downloads."""
+import codecs
+import csv
+import os
+import time
+from typing import Dict, Iterator, Tuple
+import pandas as pd
+from log_handler import Logger
+
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+DELIMITED_EXTENSIONS = (".csv", ".tsv", ".tab", ".txt")
+JSON_LINES_EXTENSIONS = (".jsonl", ".ndjson", ".json")
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+SUPPORTED_EXTENSIONS = DELIMITED_EXTENSIONS + JSON_LINES_EXTENSIONS + PARQUET_EXTENSIONS
+
+
+class FileReader():
+    """Reads data files into DataFrames after sniffing their format, encoding, delimiter and header from the first block.
+
+    Delimited files are parsed with the multithreaded pyarrow engine when it is installed and the options allow it,
+    otherwise with the C engine. Every read produces a report with the sniffed settings and the parse throughput.
+    """
+    def __repr__(self):
+        return f"FileReader(sample_size={self.sample_size}, engine='{self.engine}')"
+
+
+    def __str__(self):
+        return "FileReader class that sniffs file formats and parses them with the fastest available engine"
+
+
+    def __init__(self, sample_size: int = 65536, engine: str = "auto", encodings: Tuple[str, ...] = ("utf-8", "cp1252", "latin-1"),
+                 logger: Logger = None):
+        self.sample_size = sample_size
+        self.engine = engine
+        self.encodings = encodings
+        self.logger = logger or Logger(name="file_reader")
+
+
+    def file_format(self, path: str) -> str:
+        """Get the format of a file from its extension: 'delimited', 'json_lines' or 'parquet'."""
+        extension = os.path.splitext(path)[1].lower()
+        if extension in PARQUET_EXTENSIONS:
+            return "parquet"
+        if extension in JSON_LINES_EXTENSIONS:
+            return "json_lines"
+        if extension in DELIMITED_EXTENSIONS:
+            return "delimited"
+        raise ValueError(f"Unsupported file type: {path}")
+
+
+    def sniff_encoding(self, block: bytes) -> str:
+        """Detect the encoding of the first block from its byte order mark, or the first candidate that decodes it."""
+        if block.startswith(codecs.BOM_UTF8):
+            return "utf-8-sig"
+        if block.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return "utf-16"
+        for encoding in self.encodings:
+            try:
+                # A multi-byte character cut at the end of the block isn't a decoding failure.
+                codecs.getincrementaldecoder(encoding)().decode(block, final=False)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+        return "latin-1"
+
+
+    def sniff(self, path: str) -> Dict:
+        """Sniff the format, encoding, delimiter and header of a file from its first block.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            dict: 'format', 'encoding', 'delimiter' and 'header' (None for formats where they don't apply).
+        """
+        file_format = self.file_format(path)
+        settings = {"format": file_format, "encoding": None, "delimiter": None, "header": None}
+        if file_format == "parquet":
+            return settings
+        with open(path, "rb") as file:
+            block = file.read(self.sample_size)
+        settings["encoding"] = self.sniff_encoding(block)
+        if file_format == "json_lines":
+            # A .json file holding one document rather than one record per line is read as a regular JSON array.
+            settings["format"] = "json_lines" if not block.lstrip().startswith(b"[") else "json"
+            return settings
+        text = block.decode(settings["encoding"], errors="ignore")
+        # Drop the last, possibly truncated, line so it doesn't confuse the sniffer.
+        sample = text[:text.rfind("\n")] if "\n" in text else text
+        default_delimiter = "\t" if path.lower().endswith((".tsv", ".tab")) else ","
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",\t;|")
+            settings["delimiter"] = dialect.delimiter
+        except csv.Error:
+            settings["delimiter"] = default_delimiter
+        settings["header"] = self.sniff_header(sample, settings["delimiter"])
+        return settings
+
+
+    def sniff_header(self, sample: str, delimiter: str):
+        """Tell whether the first line is a header: 0 unless it has evidence of being a data row.
+
+        The first line is taken for data only when each of its fields has the kind (number, date or text) of the
+        values below it and at least one column holds numbers or dates. Files whose columns are all text always keep
+        their first line as the header.
+
+        Returns:
+            int or None: 0 for a header row, None for none.
+        """
+        rows = [row for row in csv.reader(sample.splitlines()[:50], delimiter=delimiter) if row]
+        if len(rows) < 2 or any(len(row) != len(rows[0]) for row in rows):
+            return 0
+
+        def kind(value: str) -> str:
+            value = value.strip()
+            if value == "":
+                return "empty"
+            try:
+                float(value)
+                return "number"
+            except ValueError:
+                pass
+            return "date" if pd.notna(pd.to_datetime(value, errors="coerce", format="mixed")) else "text"
+
+        typed_column = False
+        for index, field in enumerate(rows[0]):
+            kinds = {kind(row[index]) for row in rows[1:]} - {"empty"}
+            if len(kinds) != 1:
+                return 0
+            column_kind = kinds.pop()
+            if kind(field) != column_kind:
+                return 0
+            typed_column = typed_column or column_kind != "text"
+        return None if typed_column else 0
+
+
+    def choose_engine(self, settings: Dict, chunksize: int = None) -> str:
+        """Pick the parser engine of a delimited file: pyarrow when available and supported, else the C engine."""
+        if self.engine != "auto":
+            return self.engine
+        # The pyarrow engine has no chunked reads and only decodes UTF-8 reliably.
+        if PYARROW_AVAILABLE and chunksize is None and settings["encoding"] in ("utf-8", "utf-8-sig"):
+            return "pyarrow"
+        return "c"
+
+
+    def read(self, path: str, **kwargs) -> Tuple[pd.DataFrame, Dict]:
+        """Read a file into a DataFrame.
+
+        Args:
+            path (str): The path of the file.
+            **kwargs: Extra arguments for the pandas reader, overriding the sniffed ones.
+
+        Returns:
+            Tuple[pd.DataFrame, dict]: The DataFrame and the read report with the sniffed settings, the 'engine', 'rows',
+                'bytes', 'seconds', 'rows_per_second' and 'megabytes_per_second'.
+        """
+        start = time.perf_counter()
+        settings = self.sniff(path)
+        engine = None
+        if settings["format"] == "parquet":
+            dataframe = pd.read_parquet(path, **kwargs)
+        else:
+            # The encoding was sniffed from the first block: a byte further on that doesn't decode moves to the next candidate.
+            candidates = [settings["encoding"]] + [encoding for encoding in self.encodings if encoding != settings["encoding"]] + ["latin-1"]
+            for encoding in dict.fromkeys(candidates):
+                settings["encoding"] = encoding
+                try:
+                    if settings["format"] == "json_lines":
+                        dataframe = pd.read_json(path, lines=True, encoding=encoding, **kwargs)
+                    elif settings["format"] == "json":
+                        dataframe = pd.read_json(path, encoding=encoding, **kwargs)
+                    else:
+                        engine = self.choose_engine(settings)
+                        options = {"sep": settings["delimiter"], "header": settings["header"], "encoding": encoding, "engine": engine, **kwargs}
+                        dataframe = pd.read_csv(path, **options)
+                    break
+                except UnicodeDecodeError as error:
+                    self.logger.log(f"'{os.path.basename(path)}' is not {encoding} past the sniffed block ({error}), retrying.", level='warning')
+        report = self.report(path, settings, engine, len(dataframe), time.perf_counter() - start)
+        return dataframe, report
+
+
+    def read_chunks(self, path: str, chunksize: int = 50000, **kwargs) -> Iterator[pd.DataFrame]:
+        """Read a file in chunks of rows. Parquet files are read in one piece.
+
+        Chunks already handed out can't be read again with another encoding, so bytes that don't decode with the
+        sniffed encoding are replaced with U+FFFD.
+
+        Args:
+            path (str): The path of the file.
+            chunksize (int, optional): Rows per chunk. Defaults to 50000.
+            **kwargs: Extra arguments for the pandas reader, overriding the sniffed ones.
+        """
+        settings = self.sniff(path)
+        if settings["format"] == "delimited":
+            options = {"sep": settings["delimiter"], "header": settings["header"], "encoding": settings["encoding"], "encoding_errors": "replace",
+                       "engine": self.choose_engine(settings, chunksize), **kwargs}
+            yield from pd.read_csv(path, chunksize=chunksize, **options)
+        elif settings["format"] == "json_lines":
+            yield from pd.read_json(path, lines=True, encoding=settings["encoding"], encoding_errors="replace", chunksize=chunksize, **kwargs)
+        else:
+            dataframe, _ = self.read(path, **kwargs)
+            for start in range(0, len(dataframe), chunksize):
+                yield dataframe.iloc[start:start + chunksize]
+
+
+    def report(self, path: str, settings: Dict, engine: str, rows: int, seconds: float) -> Dict:
+        """Build the read report and log the parse throughput."""
+        size = os.path.getsize(path)
+        report = {"path": path, **settings, "engine": engine, "rows": rows, "bytes": size, "seconds": seconds,
+                  "rows_per_second": rows / seconds if seconds else 0.0,
+                  "megabytes_per_second": size / 1e6 / seconds if seconds else 0.0}
+        self.logger.log(f"Read {rows} rows from '{os.path.basename(path)}' ({settings['format']}, {settings['encoding']}, engine {engine}) "
+                        f"in {seconds:.4f}s ({report['megabytes_per_second']:.1f} MB/s).")
+        return report
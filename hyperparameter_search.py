@@ -0,0 +1,165 @@
+"""Module for parallel hyperparameter search over scikit-learn linear models."""
+import itertools
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+import numpy as np
+from sklearn.linear_model import ElasticNet, Lasso, Ridge, SGDRegressor
+from log_handler import Logger
+
+
+MODEL_TYPES = {
+    "ridge": Ridge,
+    "lasso": Lasso,
+    "elastic_net": ElasticNet,
+    "sgd": lambda **params: SGDRegressor(learning_rate="invscaling", **params),
+}
+
+DEFAULT_SEARCH_SPACE = {
+    "ridge": {"alpha": [0.01, 0.1, 1.0, 10.0]},
+    "lasso": {"alpha": [0.0001, 0.001, 0.01, 0.1]},
+    "sgd": {"alpha": [0.00001, 0.0001, 0.001], "eta0": [0.001, 0.01, 0.1]},
+}
+
+
+def evaluate_candidate(candidate: Dict, data_directory: str, train_rows: int, validation_rows: int) -> float:
+    """Fit one candidate on the first `train_rows` rows and score it on the validation rows.
+
+    Runs in a worker process. The data is opened as read-only memory maps, so every worker shares the same pages
+    instead of receiving a pickled copy.
+
+    Args:
+        candidate (Dict): {"model": <model type>, **params}.
+        data_directory (str): Directory holding features.npy and target.npy.
+        train_rows (int): Number of leading rows to train on.
+        validation_rows (int): Number of trailing rows to score on.
+
+    Returns:
+        float: The R^2 score on the validation rows.
+    """
+    features = np.load(os.path.join(data_directory, "features.npy"), mmap_mode="r")
+    target = np.load(os.path.join(data_directory, "target.npy"), mmap_mode="r")
+    params = {key: value for key, value in candidate.items() if key != "model"}
+    model = MODEL_TYPES[candidate["model"]](**params)
+    model.fit(features[:train_rows], target[:train_rows])
+    return float(model.score(features[-validation_rows:], target[-validation_rows:]))
+
+
+class HyperparameterSearch():
+    """Grid or random search evaluated on a process pool with successive halving of bad candidates.
+
+    Every candidate is first trained on a small slice of the data. Only the best 1/`reduction_factor` of each round
+    moves on to a round with `reduction_factor` times more rows, so weak candidates stop early.
+    """
+    def __repr__(self):
+        return f"HyperparameterSearch(search='{self.search}', max_workers={self.max_workers})"
+
+
+    def __str__(self):
+        return "HyperparameterSearch class that evaluates model candidates in parallel with successive halving"
+
+
+    def __init__(self, search_space: Dict[str, Dict[str, List]] = None, search: str = "grid", n_iter: int = 20, max_workers: int = None,
+                 validation_fraction: float = 0.2, reduction_factor: int = 3, min_train_rows: int = 1000, seed: int = 0, logger: Logger = None):
+        self.search_space = search_space or DEFAULT_SEARCH_SPACE
+        self.search = search
+        self.n_iter = n_iter
+        self.max_workers = max_workers or os.cpu_count()
+        self.validation_fraction = validation_fraction
+        self.reduction_factor = reduction_factor
+        self.min_train_rows = min_train_rows
+        self.rng = np.random.default_rng(seed)
+        self.logger = logger or Logger(name="hyperparameter_search")
+
+
+    def candidates(self) -> List[Dict]:
+        """Expand the search space into candidates.
+
+        Grid search takes every combination. Random search draws `n_iter` candidates, picking values from lists and
+        log-uniformly from (low, high) tuples.
+
+        Returns:
+            List[Dict]: Candidates of the form {"model": <model type>, **params}.
+        """
+        for model_type in self.search_space:
+            if model_type not in MODEL_TYPES:
+                raise ValueError(f"Unsupported model type: {model_type}")
+        if self.search == "grid":
+            candidates = []
+            for model_type, space in self.search_space.items():
+                names = list(space)
+                for values in itertools.product(*[space[name] for name in names]):
+                    candidates.append({"model": model_type, **dict(zip(names, values))})
+            return candidates
+        if self.search == "random":
+            candidates = []
+            model_types = list(self.search_space)
+            for _ in range(self.n_iter):
+                model_type = model_types[self.rng.integers(len(model_types))]
+                candidate = {"model": model_type}
+                for name, values in self.search_space[model_type].items():
+                    if isinstance(values, tuple):
+                        candidate[name] = float(np.exp(self.rng.uniform(np.log(values[0]), np.log(values[1]))))
+                    else:
+                        candidate[name] = values[self.rng.integers(len(values))]
+                candidates.append(candidate)
+            return candidates
+        raise ValueError(f"Unsupported search: {self.search}")
+
+
+    def run(self, features: np.ndarray, target: np.ndarray) -> Dict:
+        """Search for the best candidate.
+
+        Args:
+            features (np.ndarray): Feature matrix of shape (rows, features).
+            target (np.ndarray): Target vector.
+
+        Returns:
+            Dict: The 'best' candidate and its 'best_score' (validation R^2), 'results' with the last score and the round
+                each candidate reached, 'rounds' and 'wall_time' in seconds.
+        """
+        start = time.perf_counter()
+        features = np.asarray(features, dtype=np.float64)
+        features = features.reshape(-1, 1) if features.ndim == 1 else features
+        target = np.asarray(target, dtype=np.float64).ravel()
+        validation_rows = max(int(len(target) * self.validation_fraction), 1)
+        total_train_rows = len(target) - validation_rows
+        candidates = self.candidates()
+        results = [{"candidate": candidate, "score": None, "round": 0} for candidate in candidates]
+        data_directory = tempfile.mkdtemp(prefix="hyperparameter_search_")
+        try:
+            # Shuffle once while writing so contiguous slices are random samples and workers never need index arrays.
+            order = self.rng.permutation(len(target))
+            np.save(os.path.join(data_directory, "features.npy"), features[order])
+            np.save(os.path.join(data_directory, "target.npy"), target[order])
+            alive = list(range(len(candidates)))
+            # Start small enough that the survivors reach the full training set once the field is narrowed down.
+            train_rows, remaining = total_train_rows, len(alive)
+            while remaining > self.reduction_factor and train_rows // self.reduction_factor >= self.min_train_rows:
+                train_rows //= self.reduction_factor
+                remaining //= self.reduction_factor
+            train_rows = min(max(train_rows, 1), total_train_rows)
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                round_number = 0
+                while True:
+                    round_number += 1
+                    scores = list(executor.map(evaluate_candidate, [candidates[index] for index in alive], itertools.repeat(data_directory),
+                                               itertools.repeat(train_rows), itertools.repeat(validation_rows)))
+                    for index, score in zip(alive, scores):
+                        results[index]["score"] = score
+                        results[index]["round"] = round_number
+                    self.logger.log(f"Round {round_number}: {len(alive)} candidates on {train_rows} rows, best R^2 {max(scores):.6f}.")
+                    if train_rows >= total_train_rows or len(alive) == 1:
+                        break
+                    ranked = sorted(alive, key=lambda index: results[index]["score"], reverse=True)
+                    alive = ranked[:max(len(alive) // self.reduction_factor, 1)]
+                    train_rows = min(train_rows * self.reduction_factor, total_train_rows)
+        finally:
+            shutil.rmtree(data_directory, ignore_errors=True)
+        best = max((result for result in results if result["round"] == round_number), key=lambda result: result["score"])
+        wall_time = time.perf_counter() - start
+        self.logger.log(f"Hyperparameter search over {len(candidates)} candidates finished in {wall_time:.4f}s. Best: {best['candidate']}")
+        return {"best": best["candidate"], "best_score": best["score"], "results": results, "rounds": round_number, "wall_time": wall_time}
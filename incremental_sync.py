@@ -0,0 +1,249 @@
+"""Module for incremental table refreshes driven by a high-water-mark column."""
+import os
+import time
+from typing import Dict, Iterator, Optional, Sequence, Union
+import pandas as pd
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, Text, bindparam, inspect, text
+from log_handler import Logger
+from file_reader import FileReader
+
+
+class IncrementalSync():
+    """Moves only the rows newer than the stored high-water mark from a source into a target table.
+
+    The watermark is kept per target table in the `_sync_watermarks` metadata table and updated in the same
+    transaction as each chunk of rows. Rows are committed in watermark order (table sources are read with ORDER BY,
+    file and DataFrame sources are sorted as a whole) and a chunk never ends inside a run of equal watermarks, so an
+    interrupted sync resumes after the last committed chunk. With `key_columns` the rows sharing the stored
+    watermark are read again and the ones already in the target skipped, which also picks up rows that arrived with
+    that same watermark after the last sync.
+
+    How watermark values compare (as stored, as timestamps for text dates, or as strings) is decided once per sync,
+    from the stored watermark or else the first rows seen. A run of equal watermarks is held in memory until it ends;
+    with `key_columns` runs longer than `chunk_size` are committed in pieces instead, without them a run longer than
+    `max_held_rows` raises a ValueError.
+    """
+    def __repr__(self):
+        return f"IncrementalSync(table_name='{self.table_name}', watermark_column='{self.watermark_column}')"
+
+
+    def __str__(self):
+        return "IncrementalSync class that appends rows newer than a stored high-water mark"
+
+
+    def __init__(self, engine, table_name: str, watermark_column: str, chunk_size: int = 50000, key_columns: Sequence[str] = None,
+                 max_held_rows: int = None, logger: Logger = None):
+        self.engine = engine
+        self.table_name = table_name
+        self.watermark_column = watermark_column
+        self.chunk_size = chunk_size
+        self.key_columns = [key_columns] if isinstance(key_columns, str) else list(key_columns or [])
+        self.max_held_rows = max_held_rows or 10 * chunk_size
+        self.watermark_kind = None
+        self.logger = logger or Logger(name="incremental_sync")
+        self.metadata_table = Table(
+            "_sync_watermarks", MetaData(),
+            Column("table_name", String(255), primary_key=True),
+            Column("watermark_column", String(255)),
+            Column("watermark", Text),
+            Column("watermark_type", String(16)),
+            Column("rows_synced", Integer),
+            Column("synced_at", Float),
+        )
+
+
+    def get_watermark(self) -> Optional[Union[int, float, str, pd.Timestamp]]:
+        """Read the stored watermark of the table, or None if it was never synced."""
+        if not inspect(self.engine).has_table(self.metadata_table.name):
+            return None
+        with self.engine.connect() as connection:
+            row = connection.execute(self.metadata_table.select().where(self.metadata_table.c.table_name == self.table_name)).mappings().fetchone()
+        if row is None or row["watermark"] is None:
+            return None
+        parsers = {"int": int, "float": float, "datetime": pd.Timestamp, "str": str}
+        return parsers[row["watermark_type"]](row["watermark"])
+
+
+    def stored_kind(self) -> str:
+        """Get how the stored watermark compares: 'datetime', 'str' or 'native' (int and float)."""
+        with self.engine.connect() as connection:
+            watermark_type = connection.execute(self.metadata_table.select().with_only_columns([self.metadata_table.c.watermark_type]).where(
+                self.metadata_table.c.table_name == self.table_name)).scalar()
+        return watermark_type if watermark_type in ("datetime", "str") else "native"
+
+
+    def comparable(self, values: pd.Series) -> pd.Series:
+        """Get the watermark values in the form they are compared in. Text columns holding dates become timestamps.
+
+        The form ('native', 'datetime' or 'str') is kept in `watermark_kind` the first time it is needed, so every chunk
+        of a sync compares the same way.
+        """
+        if self.watermark_kind is None:
+            if pd.api.types.is_datetime64_any_dtype(values) or pd.api.types.is_numeric_dtype(values):
+                self.watermark_kind = "native"
+            else:
+                self.watermark_kind = "datetime" if pd.to_datetime(values, errors="coerce").notna().all() else "str"
+        if self.watermark_kind == "datetime":
+            dates = pd.to_datetime(values, errors="coerce")
+            if (dates.isna() & values.notna()).any():
+                raise ValueError(f"The '{self.watermark_column}' values {values[dates.isna() & values.notna()].head(3).tolist()} are not dates, "
+                                 f"unlike the earlier watermarks.")
+            return dates
+        if self.watermark_kind == "str":
+            return values.astype(str)
+        return values
+
+
+    def chunk_watermark(self, values: pd.Series):
+        """Get the highest watermark of a chunk."""
+        highest = self.comparable(values).max()
+        return highest.item() if hasattr(highest, "item") and not isinstance(highest, pd.Timestamp) else highest
+
+
+    def lower_bound(self, watermark):
+        """Get the value to filter on in SQL for a watermark. Timestamps get a day of margin, since a date stored as
+        text ('2024-01-01') sorts before its DATETIME literal; the rows are then filtered exactly with `new_rows`."""
+        return (watermark - pd.Timedelta(days=1)).to_pydatetime() if isinstance(watermark, pd.Timestamp) else watermark
+
+
+    def existing_keys(self, watermark) -> set:
+        """Get the keys of the target rows that have exactly the stored watermark."""
+        if not self.key_columns or watermark is None or not inspect(self.engine).has_table(self.table_name):
+            return set()
+        statement = text(f"SELECT {', '.join(self.key_columns)}, {self.watermark_column} FROM {self.table_name} "
+                         f"WHERE {self.watermark_column} >= :watermark")
+        params = {"watermark": self.lower_bound(watermark)}
+        if isinstance(watermark, pd.Timestamp):
+            statement = statement.bindparams(bindparam("watermark", type_=DateTime))
+        rows = pd.read_sql(statement, con=self.engine, params=params)
+        rows = rows[self.comparable(rows[self.watermark_column]) == watermark]
+        return set(rows[self.key_columns].itertuples(index=False, name=None))
+
+
+    def new_rows(self, chunk: pd.DataFrame, watermark, existing: set) -> pd.DataFrame:
+        """Keep the rows of a chunk after the watermark, plus, with key columns, the rows at it that aren't in the target yet."""
+        if watermark is None:
+            return chunk
+        values = self.comparable(chunk[self.watermark_column])
+        if not self.key_columns:
+            return chunk[values > watermark]
+        seen = pd.Series([key in existing for key in chunk[self.key_columns].itertuples(index=False, name=None)], index=chunk.index, dtype=bool)
+        return chunk[(values > watermark) | ((values == watermark) & ~seen)]
+
+
+    def whole_watermarks(self, chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """Re-cut chunks sorted by the watermark so each ends at a change of watermark, holding the last run of equal
+        values back for the next chunk. A committed watermark then covers every row that has it.
+
+        With key columns a run reaching `chunk_size` rows is committed as it is: the rows at the stored watermark are
+        read again and deduplicated by key on resume. Without them a run over `max_held_rows` raises a ValueError.
+        """
+        carry = None
+        for chunk in chunks:
+            if carry is not None:
+                chunk = pd.concat([carry, chunk])
+            if chunk.empty:
+                continue
+            values = self.comparable(chunk[self.watermark_column])
+            held = (values == values.iloc[-1]).to_numpy()
+            carry = chunk[held]
+            if self.key_columns and len(carry) >= self.chunk_size:
+                carry = None
+                yield chunk
+                continue
+            if len(carry) > self.max_held_rows:
+                raise ValueError(f"More than {self.max_held_rows} rows share the watermark {values.iloc[-1]}: pass key_columns so they can be "
+                                 f"synced in pieces, or raise max_held_rows.")
+            if not held.all():
+                yield chunk[~held]
+        if carry is not None and not carry.empty:
+            yield carry
+
+
+    def store_watermark(self, connection, watermark, rows: int) -> None:
+        """Upsert the watermark of the table on the given connection."""
+        if isinstance(watermark, pd.Timestamp):
+            watermark_type, value = "datetime", watermark.isoformat(sep=" ")
+        elif isinstance(watermark, int):
+            watermark_type, value = "int", str(watermark)
+        elif isinstance(watermark, float):
+            watermark_type, value = "float", repr(watermark)
+        else:
+            watermark_type, value = "str", str(watermark)
+        table = self.metadata_table
+        updated = connection.execute(table.update().where(table.c.table_name == self.table_name).values(
+            watermark_column=self.watermark_column, watermark=value, watermark_type=watermark_type,
+            rows_synced=table.c.rows_synced + rows, synced_at=time.time())).rowcount
+        if not updated:
+            connection.execute(table.insert().values(table_name=self.table_name, watermark_column=self.watermark_column, watermark=value,
+                                                     watermark_type=watermark_type, rows_synced=rows, synced_at=time.time()))
+
+
+    def source_chunks(self, source, watermark, source_engine=None) -> Iterator[pd.DataFrame]:
+        """Yield the source rows to sync in chunks ordered by the watermark (and key) columns.
+
+        File and DataFrame sources are filtered chunk by chunk, then the new rows are sorted together, so memory holds
+        the new rows rather than the whole source.
+
+        Args:
+            source (str or pd.DataFrame): A table name on `source_engine`, a data file path, or a DataFrame.
+            watermark: The current watermark, None for a full first load.
+            source_engine (optional): The engine of the source table. Defaults to None.
+        """
+        existing = self.existing_keys(watermark)
+        order = [self.watermark_column] + self.key_columns
+        if isinstance(source, str) and source_engine is not None:
+            statement = f"SELECT * FROM {source}"
+            params = {}
+            if watermark is not None:
+                statement += f" WHERE {self.watermark_column} >= :watermark"
+                params["watermark"] = self.lower_bound(watermark)
+            statement = text(statement + f" ORDER BY {', '.join(order)}")
+            if isinstance(watermark, pd.Timestamp):
+                # Bound as DATETIME so the literal matches the stored format, e.g. microseconds on SQLite.
+                statement = statement.bindparams(bindparam("watermark", type_=DateTime))
+            chunks = pd.read_sql(statement, con=source_engine, params=params, chunksize=self.chunk_size)
+            yield from self.whole_watermarks(self.new_rows(chunk, watermark, existing) for chunk in chunks)
+            return
+        if isinstance(source, str) and os.path.isfile(source):
+            chunks = FileReader(logger=self.logger).read_chunks(source, chunksize=self.chunk_size)
+        elif isinstance(source, pd.DataFrame):
+            chunks = (source.iloc[start:start + self.chunk_size] for start in range(0, len(source), self.chunk_size))
+        else:
+            raise ValueError(f"Unsupported sync source: {source}")
+        rows = [self.new_rows(chunk, watermark, existing) for chunk in chunks]
+        rows = pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
+        if rows.empty:
+            return
+        rows = rows.sort_values(order, kind="mergesort", key=lambda values: self.comparable(values) if values.name == self.watermark_column else values)
+        yield from self.whole_watermarks(rows.iloc[start:start + self.chunk_size] for start in range(0, len(rows), self.chunk_size))
+
+
+    def run(self, source, source_engine=None) -> Dict:
+        """Append the rows newer than the watermark to the target table and advance the watermark.
+
+        Args:
+            source (str or pd.DataFrame): A table name on `source_engine`, a data file path, or a DataFrame.
+            source_engine (optional): The engine of the source table. Defaults to None.
+
+        Returns:
+            dict: 'rows' appended, 'chunks', 'previous_watermark', 'watermark' and 'wall_time' in seconds.
+        """
+        start = time.perf_counter()
+        self.metadata_table.create(bind=self.engine, checkfirst=True)
+        previous = watermark = self.get_watermark()
+        self.watermark_kind = None if watermark is None else self.stored_kind()
+        rows = chunks = 0
+        for chunk in self.source_chunks(source, watermark, source_engine=source_engine):
+            if chunk.empty:
+                continue
+            chunk_watermark = self.chunk_watermark(chunk[self.watermark_column])
+            with self.engine.begin() as connection:
+                chunk.to_sql(name=self.table_name, con=connection, if_exists="append", index=False)
+                watermark = chunk_watermark if watermark is None else max(watermark, chunk_watermark)
+                self.store_watermark(connection, watermark, len(chunk))
+            rows += len(chunk)
+            chunks += 1
+        report = {"rows": rows, "chunks": chunks, "previous_watermark": previous, "watermark": watermark, "wall_time": time.perf_counter() - start}
+        self.logger.log(f"Synced {rows} new rows into '{self.table_name}' (watermark {previous} -> {watermark}) in {report['wall_time']:.4f}s.")
+        return report
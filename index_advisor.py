@@ -0,0 +1,109 @@
+"""Module for suggesting secondary indexes from the statements recorded by the QueryProfiler."""
+import re
+from typing import Dict, List
+from query_profiler import QueryProfiler
+
+
+class IndexAdvisor():
+    """Suggests indexes from the filter predicates and GROUP BY columns of recorded statements."""
+    def __repr__(self):
+        return "IndexAdvisor(profiler=<QueryProfiler>)"
+
+
+    def __str__(self):
+        return "IndexAdvisor class that suggests indexes from the query history recorded by the QueryProfiler"
+
+
+    def __init__(self, profiler: QueryProfiler):
+        self.profiler = profiler
+        self.clause_end = r"(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bHAVING\b|\bLIMIT\b|\bUNION\b|$)"
+        self.equality_pattern = re.compile(r"`?(\w+)`?\s*(?:=|\bIN\b|\bIS\b)", re.IGNORECASE)
+        self.range_pattern = re.compile(r"`?(\w+)`?\s*(?:<=|>=|<>|!=|<|>|\bBETWEEN\b|\bLIKE\b)", re.IGNORECASE)
+
+
+    def parse_statement(self, statement: str) -> Dict:
+        """Extract the table, filter columns and GROUP BY columns of a single-table SELECT statement.
+
+        Args:
+            statement (str): The SQL statement.
+
+        Returns:
+            dict: {"table": str, "equality": [...], "range": [...], "group_by": [...]}, or None if the
+                statement is not a SELECT on a single table.
+        """
+        statement = re.sub(r"'(?:[^']|'')*'", "?", str(statement))
+        table_match = re.search(r"\bFROM\s+`?(?:\w+`?\.`?)?(\w+)`?", statement, re.IGNORECASE)
+        if not statement.lstrip().upper().startswith("SELECT") or not table_match or re.search(r"\bJOIN\b", statement, re.IGNORECASE):
+            return None
+        where_match = re.search(r"\bWHERE\b(.*?)" + self.clause_end, statement, re.IGNORECASE | re.DOTALL)
+        group_match = re.search(r"\bGROUP\s+BY\b(.*?)(?=\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|$)", statement, re.IGNORECASE | re.DOTALL)
+        where_clause = where_match.group(1) if where_match else ""
+        equality = []
+        for column in self.equality_pattern.findall(where_clause):
+            if column not in equality:
+                equality.append(column)
+        range_columns = [column for column in self.range_pattern.findall(where_clause) if column not in equality]
+        group_by = [column.strip().strip("`") for column in group_match.group(1).split(",")] if group_match else []
+        return {
+            "table": table_match.group(1),
+            "equality": equality,
+            "range": list(dict.fromkeys(range_columns)),
+            "group_by": [column for column in group_by if re.fullmatch(r"\w+", column)],
+        }
+
+
+    def suggest(self, database: str = None, table_columns: Dict[str, List[str]] = None, existing_indexes: Dict[str, List[List[str]]] = None,
+                min_calls: int = 1, top_n: int = 5) -> List[Dict]:
+        """Suggest composite indexes ranked by the total time spent in the statements they would serve.
+
+        Equality columns lead the index, followed by at most one range column. Statements without filters but with a
+        GROUP BY get an index on the grouped columns.
+
+        Args:
+            database (str, optional): Only consider statements recorded for this database. Defaults to None.
+            table_columns (dict, optional): Known columns per table, used to drop anything that isn't a column. Defaults to None.
+            existing_indexes (dict, optional): Column lists of existing indexes per table. Candidates that are a prefix
+                of an existing index are skipped. Defaults to None.
+            min_calls (int, optional): Minimum number of statements a candidate must serve. Defaults to 1.
+            top_n (int, optional): Number of suggestions to return. Defaults to 5.
+
+        Returns:
+            List[Dict]: Suggestions with the table, columns, calls, total time and a sample statement.
+        """
+        with self.profiler.lock:
+            records = [record for record in self.profiler.records if database is None or record["database"] == database]
+        candidates = {}
+        for record in records:
+            parsed = self.parse_statement(record["statement"])
+            if parsed is None:
+                continue
+            table = parsed["table"]
+            known = table_columns.get(table) if table_columns else None
+            keep = (lambda column: column in known) if known is not None else (lambda column: True)
+            columns = [column for column in parsed["equality"] if keep(column)]
+            columns += [column for column in parsed["range"] if keep(column)][:1]
+            reason = "filter"
+            if not columns:
+                columns = [column for column in parsed["group_by"] if keep(column)]
+                reason = "group_by"
+            if not columns:
+                continue
+            candidate = candidates.setdefault((table, tuple(columns)), {
+                "table": table,
+                "columns": columns,
+                "reason": reason,
+                "calls": 0,
+                "total_time": 0.0,
+                "sample": record["statement"],
+            })
+            candidate["calls"] += 1
+            candidate["total_time"] += record["duration"]
+        suggestions = []
+        for candidate in sorted(candidates.values(), key=lambda candidate: candidate["total_time"], reverse=True):
+            indexed = (existing_indexes or {}).get(candidate["table"], [])
+            if candidate["calls"] < min_calls:
+                continue
+            if any(list(index[:len(candidate["columns"])]) == candidate["columns"] for index in indexed):
+                continue
+            suggestions.append(candidate)
+        return suggestions[:top_n]
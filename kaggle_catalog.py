@@ -0,0 +1,252 @@
+"""Module for keeping a local, searchable catalog of Kaggle dataset metadata."""
+import json
+import re
+import time
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import BigInteger, Column, Float, Integer, MetaData, String, Table, Text, func, select, text
+from log_handler import Logger
+from size_utils import parse_size
+
+
+class KaggleCatalog():
+    """Stores Kaggle dataset metadata in the `kaggle_datasets` table so searches run locally.
+
+    On SQLite the titles, subtitles and file names are indexed in the `kaggle_datasets_fts` FTS5 table and searches are
+    ranked with bm25. Other dialects, or SQLite builds without FTS5, fall back to LIKE matching.
+    """
+    def __repr__(self):
+        return f"KaggleCatalog(full_text={self.full_text})"
+
+
+    def __str__(self):
+        return "KaggleCatalog class that caches Kaggle dataset metadata in a database with a full-text index"
+
+
+    def __init__(self, engine, logger: Logger = None):
+        self.engine = engine
+        self.logger = logger or Logger(name="kaggle_catalog")
+        self.datasets = Table(
+            "kaggle_datasets", MetaData(),
+            Column("ref", String(255), primary_key=True),
+            Column("title", Text),
+            Column("subtitle", Text),
+            Column("owner_name", String(255)),
+            Column("url", Text),
+            # Sizes over 2 GB overflow a 32-bit INTEGER on MySQL and PostgreSQL.
+            Column("size", BigInteger, index=True),
+            Column("download_count", Integer),
+            Column("last_updated", String(32), index=True),
+            Column("files", Text),
+            Column("refreshed_at", Float),
+        )
+        self.state = Table(
+            "kaggle_catalog_state", MetaData(),
+            Column("name", String(64), primary_key=True),
+            Column("value", String(255)),
+        )
+        self.datasets.create(bind=engine, checkfirst=True)
+        self.state.create(bind=engine, checkfirst=True)
+        self.full_text = engine.dialect.name == "sqlite" and self.create_full_text_index()
+
+
+    def create_full_text_index(self) -> bool:
+        """Create the FTS5 table if needed. Returns False when the SQLite build has no FTS5."""
+        try:
+            with self.engine.begin() as connection:
+                connection.exec_driver_sql("CREATE VIRTUAL TABLE IF NOT EXISTS kaggle_datasets_fts USING fts5(ref UNINDEXED, title, subtitle, files)")
+            return True
+        except Exception as error:
+            self.logger.log(f"FTS5 is not available, searches will use LIKE: {error}", level='warning')
+            return False
+
+
+    parse_size = staticmethod(parse_size)
+
+
+    def format_timestamp(self, value) -> Optional[str]:
+        """Normalize a datetime or a timestamp string into 'YYYY-MM-DD HH:MM:SS', which sorts chronologically."""
+        if value is None:
+            return None
+        if hasattr(value, "strftime"):
+            return value.strftime("%Y-%m-%d %H:%M:%S")
+        return str(value).replace("T", " ")[:19]
+
+
+    def upsert(self, records: List[Dict]) -> Dict[str, int]:
+        """Insert new datasets and update the ones whose lastUpdated changed.
+
+        Args:
+            records (List[Dict]): Datasets in the format of `KaggleHandler.search_kaggle_datasets`, i.e. with the
+                'ref', 'title', 'subtitle', 'ownerName', 'url', 'size', 'downloadCount', 'lastUpdated' and optional 'files' keys.
+
+        Returns:
+            dict: The number of 'inserted', 'updated' and 'unchanged' datasets.
+        """
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        refreshed_at = time.time()
+        rows = [{
+            "ref": record["ref"],
+            "title": record.get("title"),
+            "subtitle": record.get("subtitle"),
+            "owner_name": record.get("ownerName"),
+            "url": record.get("url"),
+            "size": self.parse_size(record.get("size")),
+            "download_count": record.get("downloadCount"),
+            "last_updated": self.format_timestamp(record.get("lastUpdated")),
+            "files": json.dumps(record["files"]) if record.get("files") is not None else None,
+            "refreshed_at": refreshed_at,
+        } for record in records]
+        with self.engine.begin() as connection:
+            stored = {}
+            refs = [row["ref"] for row in rows]
+            for start in range(0, len(refs), 500):
+                statement = select([self.datasets.c.ref, self.datasets.c.last_updated, self.datasets.c.files]).where(
+                    self.datasets.c.ref.in_(refs[start:start + 500]))
+                stored.update({row[0]: row for row in connection.execute(statement)})
+            for row in rows:
+                existing = stored.get(row["ref"])
+                if existing is None:
+                    connection.execute(self.datasets.insert(), row)
+                    counts["inserted"] += 1
+                elif existing[1] != row["last_updated"] or (row["files"] is not None and existing[2] != row["files"]):
+                    if row["files"] is None:
+                        row["files"] = existing[2]
+                    connection.execute(self.datasets.update().where(self.datasets.c.ref == row["ref"]).values(**row))
+                    counts["updated"] += 1
+                    if self.full_text:
+                        connection.execute(text("DELETE FROM kaggle_datasets_fts WHERE ref = :ref"), {"ref": row["ref"]})
+                else:
+                    counts["unchanged"] += 1
+                    continue
+                if self.full_text:
+                    files = " ".join(json.loads(row["files"])) if row["files"] else ""
+                    connection.execute(text("INSERT INTO kaggle_datasets_fts (ref, title, subtitle, files) VALUES (:ref, :title, :subtitle, :files)"),
+                                       {"ref": row["ref"], "title": row["title"] or "", "subtitle": row["subtitle"] or "", "files": files})
+        return counts
+
+
+    def latest_update(self) -> Optional[str]:
+        """Get the most recent lastUpdated stored in the catalog."""
+        with self.engine.connect() as connection:
+            return connection.execute(select([func.max(self.datasets.c.last_updated)])).scalar()
+
+
+    def watermark(self) -> Optional[str]:
+        """Get the newest lastUpdated of the last refresh that paged down to the previous watermark, or None."""
+        with self.engine.connect() as connection:
+            return connection.execute(select([self.state.c.value]).where(self.state.c.name == "refreshed_through")).scalar()
+
+
+    def save_watermark(self, value: str) -> None:
+        """Store the watermark of a completed refresh."""
+        with self.engine.begin() as connection:
+            connection.execute(self.state.delete().where(self.state.c.name == "refreshed_through"))
+            connection.execute(self.state.insert(), {"name": "refreshed_through", "value": value})
+
+
+    def refresh(self, fetch_page: Callable[[int], List[Dict]], max_pages: int = 100) -> Dict:
+        """Refresh the catalog from pages of datasets sorted by lastUpdated, newest first.
+
+        Paging stops at the first page that only holds datasets not newer than the watermark, so a refresh only fetches
+        what changed since the previous one. Pages are stored as they arrive, but the watermark only moves once paging
+        reached the old watermark or the last page: a refresh interrupted or cut off by `max_pages` leaves it in place,
+        and the next refresh pages down to it again instead of skipping the range that wasn't fetched.
+
+        Args:
+            fetch_page (Callable): Returns the records of a 1-based page, e.g. from `KaggleApi.dataset_list(sort_by="updated")`.
+            max_pages (int, optional): Maximum number of pages to fetch. Defaults to 100.
+
+        Returns:
+            dict: The 'inserted', 'updated' and 'unchanged' counts, the 'pages' fetched, whether the refresh 'completed'
+                and the 'wall_time' in seconds.
+        """
+        start = time.perf_counter()
+        high_water_mark = self.watermark()
+        newest = high_water_mark
+        report = {"inserted": 0, "updated": 0, "unchanged": 0, "pages": 0, "completed": False}
+        for page in range(1, max_pages + 1):
+            records = fetch_page(page)
+            report["pages"] += 1
+            if not records:
+                report["completed"] = True
+                break
+            for key, value in self.upsert(records).items():
+                report[key] += value
+            updates = [self.format_timestamp(record.get("lastUpdated")) or "" for record in records]
+            newest = max([newest or ""] + updates) or None
+            if high_water_mark is not None and all(update <= high_water_mark for update in updates):
+                report["completed"] = True
+                break
+        if report["completed"] and newest:
+            self.save_watermark(newest)
+        elif not report["completed"]:
+            self.logger.log(f"The catalog refresh stopped after {max_pages} pages before reaching the previous watermark "
+                            f"({high_water_mark}), the next refresh resumes from it.", level='warning')
+        report["wall_time"] = time.perf_counter() - start
+        self.logger.log(f"Refreshed the Kaggle catalog: {report['inserted']} new, {report['updated']} updated datasets "
+                        f"from {report['pages']} pages in {report['wall_time']:.4f}s.")
+        return report
+
+
+    def rows_to_records(self, rows) -> List[Dict]:
+        """Convert catalog rows back into the record format of `KaggleHandler.search_kaggle_datasets`."""
+        return [{
+            "ref": row["ref"],
+            "title": row["title"],
+            "subtitle": row["subtitle"],
+            "ownerName": row["owner_name"],
+            "url": row["url"],
+            "size": row["size"],
+            "downloadCount": row["download_count"],
+            "lastUpdated": row["last_updated"],
+            "files": json.loads(row["files"]) if row["files"] else None,
+        } for row in rows]
+
+
+    def search(self, query: str = None, min_size: int = None, max_size: int = None, max_results: int = 50) -> List[Dict]:
+        """Search the catalog.
+
+        Args:
+            query (str, optional): Words to look for in titles, subtitles and file names. Defaults to None for all datasets.
+            min_size (int, optional): Minimum size in bytes. Defaults to None.
+            max_size (int, optional): Maximum size in bytes. Defaults to None.
+            max_results (int, optional): Maximum number of results. Defaults to 50.
+
+        Returns:
+            List[Dict]: The matching datasets, best matches first, or most downloaded first without a query.
+        """
+        conditions, params = [], {"limit": max_results}
+        if min_size is not None:
+            conditions.append("d.size >= :min_size")
+            params["min_size"] = min_size
+        if max_size is not None:
+            conditions.append("d.size <= :max_size")
+            params["max_size"] = max_size
+        words = re.findall(r"\w+", query or "")
+        if words and self.full_text:
+            # Each word is quoted so FTS5 operators in the query are matched literally; the last one also matches as a prefix.
+            params["query"] = " ".join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+            statement = (f"SELECT d.* FROM kaggle_datasets_fts f JOIN kaggle_datasets d ON d.ref = f.ref WHERE kaggle_datasets_fts MATCH :query "
+                         f"{''.join(' AND ' + condition for condition in conditions)} ORDER BY bm25(kaggle_datasets_fts) LIMIT :limit")
+        else:
+            for index, word in enumerate(words):
+                conditions.append(f"(d.title LIKE :word{index} OR d.subtitle LIKE :word{index} OR d.files LIKE :word{index})")
+                params[f"word{index}"] = f"%{word}%"
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            statement = f"SELECT d.* FROM kaggle_datasets d {where} ORDER BY d.download_count DESC LIMIT :limit"
+        with self.engine.connect() as connection:
+            return self.rows_to_records(connection.execute(text(statement), params).mappings().fetchall())
+
+
+    def changed_since(self, since, max_results: int = 1000) -> List[Dict]:
+        """Get the datasets updated after a datetime or a 'YYYY-MM-DD[ HH:MM:SS]' string, most recent first."""
+        statement = (select([self.datasets]).where(self.datasets.c.last_updated > self.format_timestamp(since))
+                     .order_by(self.datasets.c.last_updated.desc()).limit(max_results))
+        with self.engine.connect() as connection:
+            return self.rows_to_records(connection.execute(statement).mappings().fetchall())
+
+
+    def count(self) -> int:
+        """Get the number of datasets in the catalog."""
+        with self.engine.connect() as connection:
+            return connection.execute(select([func.count()]).select_from(self.datasets)).scalar()
@@ -4,11 +4,14 @@ import sys
 import boto3
 import yaml
 import argparse
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
 from configparser import ConfigParser
 from kaggle.api.kaggle_api_extended import KaggleApi
 from pprint import pprint
 from log_handler import Logger
+from kaggle_catalog import KaggleCatalog
+from download_planner import DownloadPlanner
+from resilience import Resilience
 
 
 class KaggleHandler():
@@ -22,12 +25,13 @@ class KaggleHandler():
 
 
     def __init__(self, username: str = None):
-        self.logger = Logger(name="kaggle_handler", filename="database_handler.log")
         self.HOME = os.path.expanduser('~')
         self.USERNAME = username.lower().replace(" ", "_") or input("Enter your username: ").replace(" ", "_").lower()
-        self.logger = Logger(name="database_handler", filename=os.path.join(self.HOME, "database_handler.log"))
-        self.logger.log("Logger initialized for database_handler")
+        self.logger = Logger(name="kaggle_handler", filename=os.path.join(self.HOME, "database_handler.log"), async_mode=True)
+        self.logger.log("Logger initialized for kaggle_handler")
         self.args = self.get_args()
+        self.catalog = None
+        self.resilience = Resilience(logger=self.logger)
         if os.path.exists(os.path.join(self.HOME, ".aws/credentials")):
             self.CONFIG_PATH = os.path.join(self.HOME, ".aws/credentials")
             self.SESSION = boto3.Session(profile_name=self.USERNAME)
@@ -90,6 +94,19 @@ class KaggleHandler():
         return api
 
 
+    def api_call(self, operation: str, function, *args, **kwargs):
+        """Call the Kaggle API, retrying rate limits (429), server errors and dropped connections with backoff.
+
+        Args:
+            operation (str): The name the attempts are counted and logged under, e.g. "dataset_list".
+            function (Callable): The KaggleApi method to call with *args and **kwargs.
+
+        Returns:
+            The API's result. Raises CircuitOpenError while Kaggle keeps failing.
+        """
+        return self.resilience.call(operation, function, *args, endpoint="kaggle", **kwargs)
+
+
     def list_dataset_files(self, dataset: str) -> List:
         """List files in a Kaggle dataset.
 
@@ -100,10 +117,35 @@ class KaggleHandler():
             List: A list of files in the dataset.
         """
         api = self.ensure_api()
-        files = api.dataset_list_files(dataset=dataset)
+        files = self.api_call("dataset_list_files", api.dataset_list_files, dataset=dataset)
         return files.dataset_files
 
 
+    def dataset_record(self, d, list_files: bool = False) -> Dict:
+        """Convert a dataset returned by the Kaggle API into a lightweight dict.
+
+        Args:
+            d: A dataset from `KaggleApi.dataset_list`.
+            list_files (bool, optional): Also list the dataset's files, one extra API call. Defaults to False.
+
+        Returns:
+            Dict: {"ref", "title", "size", "downloadCount", "lastUpdated", "ownerName", "subtitle", "url"} and "files" with list_files.
+        """
+        record = {
+            "ref": d.ref,
+            "title": d.title,
+            "size": getattr(d, "size", None),
+            "downloadCount": d.download_count,
+            "lastUpdated": d.last_updated,
+            "ownerName": d.creator_name,
+            "subtitle": d.subtitle,
+            "url": d.url,
+        }
+        if list_files:
+            record["files"] = [file.name for file in self.list_dataset_files(dataset=d.url.split("/datasets/")[-1])]
+        return record
+
+
     def search_kaggle_datasets(self, dataset: str, user: Optional[str] = None, max_results: int = 50, list_files: bool = False) -> List[Dict]:
         """
         Search Kaggle datasets.
@@ -112,35 +154,12 @@ class KaggleHandler():
         {"ref": "owner/dataset", "title": "...", "size": ..., "downloadCount": ..., "lastUpdated": "..."}
         """
         api = self.ensure_api()
-        results = api.dataset_list(search=dataset, user=user, max_size=None)
+        results = self.api_call("dataset_list", api.dataset_list, search=dataset, user=user, max_size=None)
         out = {}
         count = 1
         for d in results[:max_results]:
-            if list_files:
-                out[count] = {
-                    "ref": d.ref,
-                    "title": d.title,
-                    "size": getattr(d, "size", None),
-                    "downloadCount": d.download_count,
-                    "lastUpdated": d.last_updated,
-                    "ownerName": d.creator_name,
-                    "subtitle": d.subtitle,
-                    "url": d.url,
-                    "files": [file.name for file in self.list_dataset_files(dataset=d.url.split("/datasets/")[-1])]
-                }
-                count += 1
-            else:
-                out[count] = {
-                    "ref": d.ref,
-                    "title": d.title,
-                    "size": getattr(d, "size", None),
-                    "downloadCount": d.download_count,
-                    "lastUpdated": d.last_updated,
-                    "ownerName": d.creator_name,
-                    "subtitle": d.subtitle,
-                    "url": d.url,
-                }
-                count += 1
+            out[count] = self.dataset_record(d, list_files=list_files)
+            count += 1
         return out
 
 
@@ -157,34 +176,114 @@ class KaggleHandler():
         """
         api = self.ensure_api()
 
-        results = api.dataset_list(search=keyword, max_size = max_size)
+        results = self.api_call("dataset_list", api.dataset_list, search=keyword, max_size=max_size)
 
         datasets = []
         for d in results[:max_results]:
-            datasets.append({
-                "ref": d.ref,
-                "title": d.title,
-                "size": getattr(d, "size", None),
-                "downloadCount": d.download_count,
-                "lastUpdated": d.last_updated,
-                "ownerName": d.creator_name,
-                "subtitle": d.subtitle,
-                "url": d.url,
-            })
+            datasets.append(self.dataset_record(d))
         return datasets
 
 
-    def download_kaggle_dataset(self, dataset: str = None, dataset_path: str = None, dataset_link: str = None) -> dict:
+    def open_catalog(self, database_handler, database: str = "kaggle_catalog") -> KaggleCatalog:
+        """Open the local catalog of Kaggle dataset metadata, creating its tables if needed.
+
+        Args:
+            database_handler (DatabaseHandler): The handler of the database holding the catalog, typically configured for SQLite.
+            database (str, optional): The name of the catalog database. Defaults to "kaggle_catalog".
+
+        Returns:
+            KaggleCatalog: The catalog, also kept in `self.catalog`.
+        """
+        self.catalog = KaggleCatalog(database_handler.get_engine(database), logger=self.logger)
+        return self.catalog
+
+
+    def refresh_catalog(self, search: str = None, user: Optional[str] = None, max_pages: int = 100, list_files: bool = False) -> Dict:
+        """Fetch the datasets updated since the last refresh into the local catalog. Only refreshes touch the network.
+
+        Args:
+            search (str, optional): Only catalog datasets matching this search. Defaults to None for all datasets.
+            user (str, optional): Only catalog datasets of this user. Defaults to None.
+            max_pages (int, optional): Maximum number of result pages to fetch. Defaults to 100.
+            list_files (bool, optional): Also store the file list of every new or updated dataset. Defaults to False.
+
+        Returns:
+            Dict: The refresh report with the number of inserted, updated and unchanged datasets.
+        """
+        if self.catalog is None:
+            raise ValueError("Open the catalog with open_catalog first.")
+        api = self.ensure_api()
+
+        def fetch_page(page: int) -> List[Dict]:
+            results = self.api_call("dataset_list", api.dataset_list, search=search, user=user, sort_by="updated", page=page)
+            return [self.dataset_record(d, list_files=list_files) for d in results]
+
+        return self.catalog.refresh(fetch_page, max_pages=max_pages)
+
+
+    def search_catalog(self, keyword: str = None, min_size: int = None, max_size: int = None, max_results: int = 50) -> List[Dict]:
+        """Search the local catalog by keyword and size without calling the Kaggle API.
+
+        Args:
+            keyword (str, optional): Words to look for in titles, subtitles and file names. Defaults to None.
+            min_size (int, optional): Min size of the dataset in bytes. Defaults to None.
+            max_size (int, optional): Max size of the dataset in bytes. Defaults to None.
+            max_results (int, optional): The max number of results to return. Defaults to 50.
+
+        Returns:
+            List[Dict]: The matching datasets.
+        """
+        if self.catalog is None:
+            raise ValueError("Open the catalog with open_catalog first.")
+        return self.catalog.search(keyword, min_size=min_size, max_size=max_size, max_results=max_results)
+
+
+    def catalog_changed_since(self, since, max_results: int = 1000) -> List[Dict]:
+        """Get the cataloged datasets updated after a datetime or a 'YYYY-MM-DD' string.
+
+        Args:
+            since (datetime or str): The point in time.
+            max_results (int, optional): The max number of results to return. Defaults to 1000.
+
+        Returns:
+            List[Dict]: The datasets updated since then, most recent first.
+        """
+        if self.catalog is None:
+            raise ValueError("Open the catalog with open_catalog first.")
+        return self.catalog.changed_since(since, max_results=max_results)
+
+
+    def mark_ingested(self, dataset: str, dataset_path: str = None) -> None:
+        """Record that a downloaded dataset was ingested, so the download planner evicts it last.
+
+        Args:
+            dataset (str): The ref of the dataset, "owner/dataset".
+            dataset_path (str, optional): The download folder. Defaults to the default_download_folder.
+        """
+        if dataset_path is None:
+            dataset_path = self.get_credentials()[1].get('credentials').get('default_download_folder')
+        DownloadPlanner(dataset_path, logger=self.logger).mark_ingested(dataset)
+
+
+    def download_kaggle_dataset(self, dataset: str = None, dataset_path: str = None, dataset_link: str = None, byte_budget: int = None,
+                                min_free_bytes: int = 1024 ** 3, order_by: str = "size", priority: Callable[[dict], float] = None) -> dict:
         """
         Download a Kaggle dataset.
 
         Args:
             dataset (str): The name of the Kaggle dataset.
             path (str, optional): The path to save the downloaded files. Defaults to None.
+            byte_budget (int, optional): Max bytes of datasets kept in the download folder by the "all" choice. Defaults to None.
+            min_free_bytes (int, optional): Free space the "all" choice leaves on the download disk. Defaults to 1 GiB.
+            order_by (str, optional): Order of the "all" choice: "size" (smallest first), "downloads" or "priority".
+                Defaults to "size".
+            priority (Callable, optional): Scores a search result, highest first, for order_by="priority". Defaults to None.
 
         Returns:
             bool: True if the dataset is downloaded successfully, False otherwise.
         """
+        if order_by == "priority" and priority is None:
+            raise ValueError('order_by="priority" needs a priority callable.')
 
         api = self.ensure_api()
         if dataset_path is None:
@@ -195,7 +294,7 @@ class KaggleHandler():
                 dataset_link = dataset_link.split("/datasets/")[-1]
             dataset_path = os.path.join(self.get_credentials()[1].get('credentials').get('default_download_folder'), dataset_link)
             dataset_to_download = self.search_kaggle_datasets(dataset=dataset_)[1].get('ref')
-            api.dataset_download_files(dataset=dataset_to_download, path=dataset_path, unzip=True)
+            self.api_call("dataset_download_files", api.dataset_download_files, dataset=dataset_to_download, path=dataset_path, unzip=True)
             return f"Dataset {dataset_to_download} Downloaded to {dataset_path}"
         elif not self.args.dataset_name:
             if not dataset:
@@ -220,17 +319,18 @@ class KaggleHandler():
         if not os.path.exists(dataset_path):
             os.makedirs(dataset_path)
         if choice == "all" or choice == "a":
-            for key in dataset:
-                dataset_: str = dataset[int(key)].get('ref')
-                if not os.path.exists(dataset_path + f"/{dataset_}"):
-                    api.dataset_download_files(dataset_, path=dataset_path + f"/{dataset_}", unzip=True)
-            return {200: f"All Datasets downloaded! to {dataset_path}"}
+            planner = DownloadPlanner(dataset_path, byte_budget=byte_budget, min_free_bytes=min_free_bytes, order_by=order_by, logger=self.logger)
+            plan = planner.plan(list(dataset.values()), priority=priority)
+            for record in plan["skipped"]:
+                sys.stdout.write(f"Skipping {record['ref']}: {record['reason']}\n")
+            report = planner.execute(plan, lambda ref, path: self.api_call("dataset_download_files", api.dataset_download_files, ref, path=path, unzip=True))
+            return {200: f"All Datasets downloaded! to {dataset_path}", "report": report, "skipped": plan["skipped"]}
         else:
             for index in choice.split(", "):
                 dataset_ = dataset[int(index)].get('ref')
                 print(dataset_)
                 if not os.path.exists(dataset_path + f"/{dataset_}"):
-                    api.dataset_download_files(dataset_, path=dataset_path + f"/{dataset_}", unzip=True)
+                    self.api_call("dataset_download_files", api.dataset_download_files, dataset_, path=dataset_path + f"/{dataset_}", unzip=True)
             return {200: f"Datasets downloaded to {dataset_path + f'/{dataset_}'}"}
 
 
@@ -1,20 +1,146 @@
 """Log handler module for managing application logs."""
+import atexit
 import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+
+LOG_FORMAT = "%(asctime)s;%(levelname)s;%(message)s"
+
+# File handlers and queue listeners are shared per log file, so every component writing to the same file
+# goes through a single handler. Two rotating handlers on one file would rotate it from under each other.
+_file_handlers = {}
+_queue_handlers = {}
+_queue_listeners = {}
+_registry_lock = threading.Lock()
+
+
+class TruncatingFilter(logging.Filter):
+    """Logging filter that truncates messages longer than `max_length` characters."""
+    def __init__(self, max_length: int = 2000):
+        super().__init__()
+        self.max_length = max_length
+
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Render the record message once and truncate it if it is too large.
+
+        Args:
+            record (logging.LogRecord): The record to inspect.
+
+        Returns:
+            bool: Always True, records are never dropped.
+        """
+        if self.max_length:
+            message = record.getMessage()
+            if len(message) > self.max_length:
+                record.msg = message[:self.max_length] + f"... [truncated {len(message) - self.max_length} chars]"
+                record.args = None
+        return True
+
+
+def get_file_handler(filename: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, when: str = None) -> logging.Handler:
+    """Get the shared rotating file handler for a log file, creating it on first use.
+
+    Args:
+        filename (str): Path of the log file.
+        max_bytes (int, optional): Size in bytes at which the file is rotated. Defaults to 10 MB.
+        backup_count (int, optional): Number of rotated files to keep. Defaults to 5.
+        when (str, optional): Rotate on time instead of size, e.g. "midnight" or "H". Defaults to None.
+
+    Returns:
+        logging.Handler: The file handler writing to `filename`.
+    """
+    filename = os.path.abspath(filename)
+    settings = {"max_bytes": max_bytes, "backup_count": backup_count, "when": when}
+    with _registry_lock:
+        if filename not in _file_handlers:
+            if when:
+                handler = TimedRotatingFileHandler(filename, when=when, backupCount=backup_count, delay=True)
+            else:
+                handler = RotatingFileHandler(filename, mode="a", maxBytes=max_bytes, backupCount=backup_count, delay=True)
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            handler._rotation_settings = settings
+            _file_handlers[filename] = handler
+            return handler
+        handler = _file_handlers[filename]
+    if handler._rotation_settings != settings:
+        handler.handle(logging.LogRecord("log_handler", logging.WARNING, __file__, 0,
+                                         f"log_handler: The log file '{filename}' is already open with the rotation settings "
+                                         f"{handler._rotation_settings}, the settings {settings} are ignored.", None, None))
+    return handler
+
+
+def get_queue_handler(filename: str, **file_handler_kwargs) -> QueueHandler:
+    """Get the shared queue handler for a log file and start its background listener on first use.
+
+    The queue is unbounded so callers never wait on disk I/O, the listener thread drains it into the file handler.
+
+    Args:
+        filename (str): Path of the log file.
+        **file_handler_kwargs: Rotation settings passed to `get_file_handler`.
+
+    Returns:
+        QueueHandler: The queue handler feeding the listener for `filename`.
+    """
+    file_handler = get_file_handler(filename, **file_handler_kwargs)
+    filename = os.path.abspath(filename)
+    with _registry_lock:
+        if filename not in _queue_handlers:
+            log_queue = queue.SimpleQueue()
+            listener = QueueListener(log_queue, file_handler, respect_handler_level=False)
+            listener.start()
+            _queue_handlers[filename] = QueueHandler(log_queue)
+            _queue_listeners[filename] = listener
+        return _queue_handlers[filename]
+
+
+def stop_queue_listeners() -> None:
+    """Flush and stop every background queue listener. Registered to run at interpreter exit."""
+    with _registry_lock:
+        for filename, listener in list(_queue_listeners.items()):
+            listener.stop()
+            del _queue_listeners[filename]
+            _queue_handlers.pop(filename, None)
+
+
+atexit.register(stop_queue_listeners)
 
 
 class Logger():
     """A Logger class to handle logging for the applications.
+
+    Each component gets its own named logger instead of configuring the root logger. With `async_mode`
+    records are put on a queue and written to the rotating file by a background thread. Without a `filename`
+    records go to `~/database_handler.log`, the file DatabaseHandler logs to, whatever the working directory.
     """
-    def __init__(self, name: str = "log_handler", level=logging.INFO, filename:str = "app.log"):
+    def __init__(self, name: str = "log_handler", level=logging.INFO, filename: str = None, async_mode: bool = False,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, when: str = None, max_message_length: int = 2000):
         self.level = level
-        self.filename = filename
+        self.filename = filename or os.path.join(os.path.expanduser('~'), "database_handler.log")
         self.name = name
-        logging.basicConfig(
-            level=self.level,
-            filemode="a",
-            filename=self.filename,
-            format="%(asctime)s;%(levelname)s;%(message)s",
-        )
+        self.async_mode = async_mode
+        self.max_message_length = max_message_length
+        file_handler_kwargs = {"max_bytes": max_bytes, "backup_count": backup_count, "when": when}
+        if self.async_mode:
+            self.handler = get_queue_handler(self.filename, **file_handler_kwargs)
+        else:
+            self.handler = get_file_handler(self.filename, **file_handler_kwargs)
+        logger = logging.getLogger(name=self.name)
+        logger.setLevel(self.level)
+        logger.propagate = False
+        for handler in list(logger.handlers):
+            if handler is not self.handler and getattr(handler, "_log_handler_managed", False):
+                logger.removeHandler(handler)
+        if self.handler not in logger.handlers:
+            self.handler._log_handler_managed = True
+            logger.addHandler(self.handler)
+        for log_filter in list(logger.filters):
+            if isinstance(log_filter, TruncatingFilter):
+                logger.removeFilter(log_filter)
+        logger.addFilter(TruncatingFilter(max_length=self.max_message_length))
 
 
     def get_logger(self) -> logging.Logger:
@@ -38,22 +164,34 @@ class Logger():
         """
         logger = self.get_logger()
         if level == "info":
-            logger.info(f"{self.name}: " + message)
+            logger.info(f"{self.name}: " + str(message))
         elif level == "warning":
-            logger.warning(f"{self.name}: " + message)
+            logger.warning(f"{self.name}: " + str(message))
         elif level == "error":
-            logger.error(f"{self.name}: " + message)
+            logger.error(f"{self.name}: " + str(message))
         elif level == "debug":
-            logger.debug(f"{self.name}: " + message)
+            logger.debug(f"{self.name}: " + str(message))
         elif level == "critical":
-            logger.critical(f"{self.name}: " + message)
+            logger.critical(f"{self.name}: " + str(message))
         elif level == "exception":
-            logger.exception(f"{self.name}: " + message)
+            logger.exception(f"{self.name}: " + str(message))
         else:
-            logger.info(f"{self.name}: " + message)
+            logger.info(f"{self.name}: " + str(message))
         return logger
 
 
+    def flush(self) -> None:
+        """Block until queued records are written. Only waits when running in async mode."""
+        if self.async_mode:
+            # Stopping drains the queue; the lock keeps concurrent flushes and the exit hook from racing on the thread.
+            with _registry_lock:
+                listener = _queue_listeners.get(os.path.abspath(self.filename))
+                if listener is not None:
+                    listener.stop()
+                    listener.start()
+        self.handler.flush()
+
+
 if __name__ == "__main__":
     log_handler = Logger()
     log_handler.log(message="This is an info message.", level="info")
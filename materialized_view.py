@@ -0,0 +1,258 @@
+"""Module for summary tables that are refreshed incrementally from appended rows."""
+import json
+import re
+import time
+from typing import Dict, List, Optional
+import pandas as pd
+from sqlalchemy import Boolean, Column, Float, Integer, MetaData, String, Table, Text, and_, case, exists, func, inspect, literal, or_, select, text, true
+from log_handler import Logger
+from aggregation import AggregationQuery
+
+MERGEABLE_FUNCTIONS = ("count", "sum", "avg", "mean", "min", "max")
+
+PANDAS_FILTERS = {
+    "=": lambda series, value: series == value,
+    "==": lambda series, value: series == value,
+    "!=": lambda series, value: series != value,
+    "<": lambda series, value: series < value,
+    "<=": lambda series, value: series <= value,
+    ">": lambda series, value: series > value,
+    ">=": lambda series, value: series >= value,
+    "in": lambda series, value: series.isin(list(value)),
+    "not in": lambda series, value: ~series.isin(list(value)),
+    # The literal parts of the pattern are escaped so characters such as '.' or '(' match themselves.
+    "like": lambda series, value: series.astype(str).str.fullmatch(
+        "".join(".*" if char == "%" else "." if char == "_" else re.escape(char) for char in value), case=False),
+    "between": lambda series, value: series.between(value[0], value[1]),
+    "is null": lambda series, value: series.isna(),
+    "is not null": lambda series, value: series.notna(),
+}
+
+
+class MaterializedView():
+    """A group-by summary of a table persisted as a table and refreshed by merging the aggregates of appended rows.
+
+    Counts and sums are added, minimums and maximums compared, and averages kept as a hidden sum and count
+    (`__sum_<name>`, `__count_<name>`) so they can be merged too. Definitions and refresh state are stored in the
+    `_materialized_views` metadata table; a view is stale when its source table has rows it hasn't merged.
+    """
+    def __repr__(self):
+        return f"MaterializedView(name='{self.name}', table_name='{self.aggregation.table_name}')"
+
+
+    def __str__(self):
+        return "MaterializedView class that keeps a summary table up to date by merging the aggregates of new rows"
+
+
+    def __init__(self, engine, name: str, aggregation: AggregationQuery, logger: Logger = None):
+        for output, (function, _) in aggregation.aggregates.items():
+            if function.lower() not in MERGEABLE_FUNCTIONS:
+                raise ValueError(f"The aggregate '{output}' uses {function}, which can't be refreshed incrementally.")
+        if aggregation.order_by or aggregation.limit is not None:
+            raise ValueError("Materialized views keep every group: order_by and limit aren't supported.")
+        self.engine = engine
+        self.name = name
+        self.aggregation = aggregation
+        self.logger = logger or Logger(name="materialized_view")
+        self.metadata_table = Table(
+            "_materialized_views", MetaData(),
+            Column("view_name", String(255), primary_key=True),
+            Column("table_name", String(255)),
+            Column("definition", Text),
+            Column("source_rows", Integer),
+            Column("stale", Boolean),
+            Column("refreshed_at", Float),
+            Column("full_refreshed_at", Float),
+        )
+
+
+    def storage_query(self) -> AggregationQuery:
+        """Get the aggregation that fills the view's table, with averages split into a sum and a count."""
+        aggregates = {}
+        for output, (function, column) in self.aggregation.aggregates.items():
+            if function.lower() in ("avg", "mean"):
+                aggregates[output] = (function, column)
+                aggregates[f"__sum_{output}"] = ("sum", column)
+                aggregates[f"__count_{output}"] = ("count", column)
+            else:
+                aggregates[output] = (function, column)
+        return AggregationQuery(self.aggregation.table_name, group_by=self.aggregation.group_by, aggregates=aggregates,
+                                filters=self.aggregation.filters)
+
+
+    def definition(self) -> str:
+        """Serialize the view's aggregation."""
+        return json.dumps({"table_name": self.aggregation.table_name, "group_by": self.aggregation.group_by,
+                           "aggregates": self.aggregation.aggregates, "filters": self.aggregation.filters})
+
+
+    def source_rows(self, connection) -> int:
+        """Count the rows of the source table."""
+        source = Table(self.aggregation.table_name, MetaData(), autoload_with=connection)
+        return connection.execute(select([func.count()]).select_from(source)).scalar()
+
+
+    def save_state(self, connection, full: bool) -> None:
+        """Record the refresh in the `_materialized_views` metadata table."""
+        now = time.time()
+        values = {"table_name": self.aggregation.table_name, "definition": self.definition(), "source_rows": self.source_rows(connection),
+                  "stale": False, "refreshed_at": now}
+        if full:
+            values["full_refreshed_at"] = now
+        table = self.metadata_table
+        if not connection.execute(table.update().where(table.c.view_name == self.name).values(**values)).rowcount:
+            connection.execute(table.insert().values(**{"full_refreshed_at": now, **values, "view_name": self.name}))
+
+
+    def rebuild(self) -> int:
+        """Recompute the whole view from the source table. Returns the number of groups."""
+        start = time.perf_counter()
+        self.metadata_table.create(bind=self.engine, checkfirst=True)
+        groups = self.storage_query().materialize(self.engine, self.name)
+        with self.engine.begin() as connection:
+            self.save_state(connection, full=True)
+        self.logger.log(f"Rebuilt the materialized view '{self.name}' ({groups} groups) in {time.perf_counter() - start:.4f}s.")
+        return groups
+
+
+    def delta(self, new_rows: pd.DataFrame) -> pd.DataFrame:
+        """Aggregate the appended rows the way the view aggregates the table."""
+        rows = new_rows
+        for column, operator, value in self.aggregation.filters:
+            rows = rows[PANDAS_FILTERS[operator.lower()](rows[column], value)]
+        # Without grouping columns every row falls into one group.
+        group_by = self.aggregation.group_by or ["__group"]
+        rows = rows.assign(__group=0) if not self.aggregation.group_by else rows
+        named = {}
+        sums = []
+        for output, (function, column) in self.storage_query().aggregates.items():
+            function = function.lower()
+            if function in ("avg", "mean"):
+                continue
+            named[output] = (group_by[0], "size") if function == "count" and column in (None, "*") else (column, function)
+            if function == "sum":
+                sums.append(output)
+                named[f"__present_{output}"] = (column, "count")
+        if rows.empty:
+            return pd.DataFrame(columns=self.aggregation.group_by + [output for output in named if not output.startswith("__present_")])
+        delta = rows.groupby(group_by, dropna=False, observed=True).agg(**named).reset_index()
+        # The sum of only NULLs is NULL, as in SQL (min_count=1), not 0.
+        for output in sums:
+            delta[output] = delta[output].where(delta[f"__present_{output}"] > 0)
+        delta = delta.drop(columns=[f"__present_{output}" for output in sums])
+        return delta.drop(columns="__group") if not self.aggregation.group_by else delta
+
+
+    def merge(self, new_rows: pd.DataFrame) -> Dict:
+        """Merge the contribution of appended rows into the view.
+
+        The delta is loaded into a temporary table and merged with one UPDATE of the existing groups (plus one for the
+        averages) and one INSERT ... SELECT of the new groups, so the round trips don't grow with the number of groups.
+
+        Args:
+            new_rows (pd.DataFrame): The rows just appended to the source table.
+
+        Returns:
+            dict: The number of 'updated' and 'inserted' groups and the 'wall_time' in seconds.
+        """
+        start = time.perf_counter()
+        delta = self.delta(new_rows)
+        table = Table(self.name, MetaData(), autoload_with=self.engine)
+        storage = self.storage_query().aggregates
+        group_by = self.aggregation.group_by
+        averages = [output for output, (function, _) in self.aggregation.aggregates.items() if function.lower() in ("avg", "mean")]
+        staged = Table(f"{self.name}__delta", MetaData(), *[Column(column, table.c[column].type) for column in group_by],
+                       *[Column(output, table.c[output].type) for output in storage if output not in averages], prefixes=["TEMPORARY"])
+        # Groups match on equal values, NULL matching NULL as GROUP BY does.
+        match = and_(*[or_(table.c[column] == staged.c[column], and_(table.c[column].is_(None), staged.c[column].is_(None)))
+                       for column in group_by]) if group_by else true()
+        matched = exists(select([literal(1)]).select_from(staged).where(match))
+        report = {"updated": 0, "inserted": 0}
+        with self.engine.begin() as connection:
+            if not delta.empty:
+                if self.engine.dialect.name in ("mysql", "mariadb"):
+                    # MySQL doesn't roll back temporary tables, so a failed merge can leave one on the pooled connection.
+                    connection.execute(text(f"DROP TEMPORARY TABLE IF EXISTS {self.engine.dialect.identifier_preparer.quote(staged.name)}"))
+                staged.create(bind=connection)
+                connection.execute(staged.insert(), [{key: None if pd.isna(value) else value.item() if hasattr(value, "item") else value
+                                                      for key, value in group.items()} for group in delta.to_dict(orient="records")])
+                values = {}
+                for output, (function, _) in storage.items():
+                    function, current = function.lower(), table.c[output]
+                    if function in ("avg", "mean"):
+                        continue
+                    value = select([staged.c[output]]).select_from(staged).where(match).scalar_subquery()
+                    # A NULL delta (every value NULL) leaves the stored aggregate as it is.
+                    if function in ("count", "sum"):
+                        values[output] = case([(value.is_(None), current)], else_=func.coalesce(current, 0) + value)
+                    elif function == "min":
+                        values[output] = case([(value.is_(None), current), (or_(current.is_(None), current > value), value)], else_=current)
+                    else:
+                        values[output] = case([(value.is_(None), current), (or_(current.is_(None), current < value), value)], else_=current)
+                report["updated"] = connection.execute(table.update().where(matched).values(**values)).rowcount
+                if averages and report["updated"]:
+                    # A second statement, as MySQL evaluates SET assignments left to right with the updated values.
+                    connection.execute(table.update().where(matched).values(**{
+                        output: case([(table.c[f"__count_{output}"] > 0, table.c[f"__sum_{output}"] * 1.0 / table.c[f"__count_{output}"])], else_=None)
+                        for output in averages}))
+                columns = group_by + list(storage)
+                rows = select([staged.c[column] if column not in averages else
+                               case([(staged.c[f"__count_{column}"] > 0, staged.c[f"__sum_{column}"] * 1.0 / staged.c[f"__count_{column}"])], else_=None)
+                               for column in columns]).where(~exists(select([literal(1)]).select_from(table).where(match)))
+                report["inserted"] = connection.execute(table.insert().from_select(columns, rows)).rowcount
+                staged.drop(bind=connection)
+            self.save_state(connection, full=False)
+        report["wall_time"] = time.perf_counter() - start
+        self.logger.log(f"Merged {len(new_rows)} new rows into the materialized view '{self.name}' "
+                        f"({report['updated']} groups updated, {report['inserted']} inserted) in {report['wall_time']:.4f}s.")
+        return report
+
+
+    def mark_stale(self) -> None:
+        """Flag the view as stale, e.g. when a merge failed."""
+        with self.engine.begin() as connection:
+            connection.execute(self.metadata_table.update().where(self.metadata_table.c.view_name == self.name).values(stale=True))
+
+
+    @classmethod
+    def load(cls, engine, name: str, logger: Logger = None) -> Optional["MaterializedView"]:
+        """Rebuild a view from its stored definition, or None if it doesn't exist."""
+        for view in cls.for_table(engine, None, logger=logger):
+            if view.name == name:
+                return view
+        return None
+
+
+    @classmethod
+    def for_table(cls, engine, table_name: Optional[str], logger: Logger = None) -> List["MaterializedView"]:
+        """Get the views defined on a table, or every view when table_name is None."""
+        if not inspect(engine).has_table("_materialized_views"):
+            return []
+        with engine.connect() as connection:
+            rows = connection.execute(text("SELECT view_name, table_name, definition FROM _materialized_views")).fetchall()
+        views = []
+        for name, source_table, definition in rows:
+            if table_name is not None and source_table != table_name:
+                continue
+            definition = json.loads(definition)
+            aggregation = AggregationQuery(definition["table_name"], group_by=definition["group_by"],
+                                           aggregates={output: tuple(value) for output, value in definition["aggregates"].items()},
+                                           filters=[tuple(condition) for condition in definition["filters"]])
+            views.append(cls(engine, name, aggregation, logger=logger))
+        return views
+
+
+    def status(self) -> Dict:
+        """Get the staleness of the view.
+
+        Returns:
+            dict: 'view_name', 'table_name', 'stale', 'rows_behind' (source rows appended since the last refresh),
+                'refreshed_at', 'full_refreshed_at' and 'age_seconds'.
+        """
+        with self.engine.connect() as connection:
+            row = connection.execute(self.metadata_table.select().where(self.metadata_table.c.view_name == self.name)).mappings().fetchone()
+            current_rows = self.source_rows(connection)
+        rows_behind = current_rows - row["source_rows"]
+        return {"view_name": self.name, "table_name": row["table_name"], "stale": bool(row["stale"]) or rows_behind != 0,
+                "rows_behind": rows_behind, "refreshed_at": row["refreshed_at"], "full_refreshed_at": row["full_refreshed_at"],
+                "age_seconds": time.time() - row["refreshed_at"]}
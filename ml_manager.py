@@ -1,31 +1,272 @@
 """Module for managing Machine Learning tasks."""
 import os
+import time
 import numpy as np
-import sys
+import pandas as pd
+from typing import List, Tuple
+from sqlalchemy import inspect
+from sklearn.linear_model import SGDRegressor
 from log_handler import Logger
+from data_loader import DatabaseBatchLoader
+from hyperparameter_search import HyperparameterSearch
+from feature_cache import FeatureCache
+from batch_predictor import BatchPredictor
 
 
 class MLManager():
     """Class for handling all Machine Learning related functions and data."""
     def __init__(self):
-        self.logger = Logger(name="ml_manager", filename=os.path.join(self.HOME, "database_handler.log"))
+        self.HOME = os.path.expanduser('~')
+        self.logger = Logger(name="ml_manager", filename=os.path.join(self.HOME, "database_handler.log"), async_mode=True)
+        self.coefficients = None
+        self.intercept = None
+        self.feature_columns = None
+        self.model = None
+        self.best_parameters = None
+        self.cache_info = None
 
 
-    def linear_regression(self, ):
+    def load_table(self, database_handler, database: str, table_name: str, target_column: str, feature_columns: List[str] = None,
+                   limit: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Load the feature matrix and target vector of a table stored through the DatabaseHandler.
+
+        Args:
+            database_handler (DatabaseHandler): The handler connected to the database.
+            database (str): The name of the database.
+            table_name (str): The name of the table.
+            target_column (str): The column to predict.
+            feature_columns (List[str], optional): The input columns. Defaults to every numeric column except the target.
+            limit (int, optional): Only load this many rows. Defaults to None.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The float64 feature matrix of shape (rows, features) and the target vector.
+        """
+        columns = ", ".join(feature_columns + [target_column]) if feature_columns else "*"
+        statement = f"SELECT {columns} FROM {table_name}" + (f" LIMIT {int(limit)}" if limit else "")
+        dataframe = pd.read_sql(statement, con=database_handler.get_engine(database))
+        if not feature_columns:
+            feature_columns = [column for column in dataframe.select_dtypes("number").columns if column != target_column]
+        self.feature_columns = feature_columns
+        self.logger.log(f"Loaded {len(dataframe)} rows with features {feature_columns} from table '{table_name}'.")
+        return dataframe[feature_columns].to_numpy(dtype=np.float64), dataframe[target_column].to_numpy(dtype=np.float64)
+
+
+    def load_cached_features(self, database_handler, database: str, table_name: str, target_column: str = None, feature_columns: List[str] = None,
+                             version_column: str = None, cache_directory: str = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Load a table's features from the on-disk feature cache, rebuilding it when the table has changed.
+
+        Args:
+            database_handler (DatabaseHandler): The handler connected to the database.
+            database (str): The name of the database.
+            table_name (str): The name of the table.
+            target_column (str, optional): The column to predict. Defaults to None.
+            feature_columns (List[str], optional): The input columns. Defaults to every numeric column except the target.
+            version_column (str, optional): A monotonic column included in the data version. Defaults to None.
+            cache_directory (str, optional): Where the cache lives. Defaults to ~/.feature_cache.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Read-only memory-mapped features and target.
+        """
+        engine = database_handler.get_engine(database)
+        if not feature_columns:
+            feature_columns = [column['name'] for column in inspect(engine).get_columns(table_name)
+                               if column['name'] != target_column and getattr(column['type'], 'python_type', None) in (int, float)]
+        self.feature_columns = feature_columns
+        features, target, self.cache_info = FeatureCache(cache_directory=cache_directory, logger=self.logger).load(
+            engine, table_name, feature_columns, target_column=target_column, version_column=version_column)
+        return features, target
+
+
+    def linear_regression(self, features: np.ndarray = None, target: np.ndarray = None, method: str = "closed_form", learning_rate: float = 0.01,
+                          batch_size: int = 1024, max_iterations: int = 1000, tolerance: float = 1e-8, seed: int = 0) -> dict:
         """Linear Regression model.
-        y = mx + b
-        m = slope
+        y = Xm + b
+        m = coefficients, one slope per feature
         b = y-intercept
-        x = input feature
+        X = input features
         y = output feature
+
+        Args:
+            features (np.ndarray, optional): Feature matrix of shape (rows, features), or a vector for a single feature.
+                Defaults to the toy data x = [1, 2, 3, 4, 5].
+            target (np.ndarray, optional): Target vector. Defaults to y = [3, 5, 7, 9, 11].
+            method (str, optional): "closed_form" for least squares or "gradient_descent" for mini-batch gradient descent. Defaults to "closed_form".
+            learning_rate (float, optional): Gradient descent step size. Defaults to 0.01.
+            batch_size (int, optional): Gradient descent mini-batch size. Defaults to 1024.
+            max_iterations (int, optional): Maximum number of gradient descent epochs. Defaults to 1000.
+            tolerance (float, optional): Stop once the epoch loss improves by less than this. Defaults to 1e-8.
+            seed (int, optional): Seed of the mini-batch shuffling. Defaults to 0.
+
+        Returns:
+            dict: The 'coefficients', 'intercept', 'loss' (mean squared error), 'iterations' and 'wall_time' in seconds.
+        """
+        self.x = np.array([1, 2, 3, 4, 5]) if features is None else features
+        self.y_true = np.array([3, 5, 7, 9, 11]) if target is None else target
+        features = np.asarray(self.x, dtype=np.float64)
+        features = features.reshape(-1, 1) if features.ndim == 1 else features
+        target = np.asarray(self.y_true, dtype=np.float64).ravel()
+        self.n = len(target)
+        self.learning_rate = learning_rate
+        start = time.perf_counter()
+        if method == "closed_form":
+            design = np.hstack([features, np.ones((self.n, 1))])
+            solution = np.linalg.lstsq(design, target, rcond=None)[0]
+            coefficients, intercept, iterations = solution[:-1], solution[-1], 1
+        elif method == "gradient_descent":
+            coefficients, intercept, iterations = self.mini_batch_gradient_descent(features, target, learning_rate=learning_rate, batch_size=batch_size,
+                                                                                   max_iterations=max_iterations, tolerance=tolerance, seed=seed)
+        else:
+            raise ValueError(f"Unsupported method: {method}")
+        wall_time = time.perf_counter() - start
+        self.coefficients, self.intercept = coefficients, float(intercept)
+        if len(coefficients) == 1:
+            self.m, self.b = float(coefficients[0]), self.intercept
+        self.y = self.predict(features)
+        loss = float(np.mean((self.y - target) ** 2))
+        self.logger.log(f"Linear regression ({method}) fitted on {self.n} rows and {features.shape[1]} features in {wall_time:.4f}s "
+                        f"and {iterations} iterations. MSE: {loss}")
+        return {"coefficients": coefficients, "intercept": self.intercept, "loss": loss, "iterations": iterations, "wall_time": wall_time}
+
+
+    def mini_batch_gradient_descent(self, features: np.ndarray, target: np.ndarray, learning_rate: float = 0.01, batch_size: int = 1024,
+                                    max_iterations: int = 1000, tolerance: float = 1e-8, seed: int = 0) -> Tuple[np.ndarray, float, int]:
+        """Fit a linear model with vectorized mini-batch gradient descent on standardized features.
+
+        Args:
+            features (np.ndarray): Feature matrix of shape (rows, features).
+            target (np.ndarray): Target vector.
+            learning_rate (float, optional): Step size. Defaults to 0.01.
+            batch_size (int, optional): Rows per mini-batch. Defaults to 1024.
+            max_iterations (int, optional): Maximum number of epochs. Defaults to 1000.
+            tolerance (float, optional): Stop once the epoch loss improves by less than this. Defaults to 1e-8.
+            seed (int, optional): Seed of the shuffling. Defaults to 0.
+
+        Returns:
+            Tuple[np.ndarray, float, int]: The coefficients and intercept on the original feature scale, and the number of epochs run.
         """
-        self.m = 0
-        self.b = 0
-        self.x = np.array([1, 2, 3, 4, 5])
-        self.learning_rate = 0.01
-        self.y = self.m * self.x + self.b
-        self.y_true = np.array([3, 5, 7, 9, 11])
-        self.n = len(self.x)
+        rng = np.random.default_rng(seed)
+        mean, scale = features.mean(axis=0), features.std(axis=0)
+        scale[scale == 0] = 1.0
+        scaled = (features - mean) / scale
+        target_mean = target.mean()
+        centered = target - target_mean
+        weights = np.zeros(scaled.shape[1])
+        previous_loss = np.inf
+        epoch = 0
+        for epoch in range(1, max_iterations + 1):
+            order = rng.permutation(len(target))
+            for start in range(0, len(target), batch_size):
+                batch = order[start:start + batch_size]
+                error = scaled[batch] @ weights - centered[batch]
+                weights -= learning_rate * 2 * (scaled[batch].T @ error) / len(batch)
+            loss = np.mean((scaled @ weights - centered) ** 2)
+            if abs(previous_loss - loss) < tolerance:
+                break
+            previous_loss = loss
+        coefficients = weights / scale
+        return coefficients, float(target_mean - mean @ coefficients), epoch
+
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Predict with the fitted linear model.
+
+        Args:
+            features (np.ndarray): Feature matrix of shape (rows, features), or a vector for a single feature.
+
+        Returns:
+            np.ndarray: The predictions.
+        """
+        if self.coefficients is None:
+            raise ValueError("The model is not trained yet. Call linear_regression or train_machine_learning_model first.")
+        features = np.asarray(features, dtype=np.float64)
+        features = features.reshape(-1, 1) if features.ndim == 1 else features
+        return features @ self.coefficients + self.intercept
+
+
+    def stream_table(self, database_handler, database: str, table_name: str, target_column: str = None, feature_columns: List[str] = None,
+                     batch_size: int = 1024, shuffle_buffer: int = 0, prefetch: int = 2, seed: int = None) -> DatabaseBatchLoader:
+        """Create a loader that streams fixed-size NumPy batches of a table stored through the DatabaseHandler.
+
+        Args:
+            database_handler (DatabaseHandler): The handler connected to the database.
+            database (str): The name of the database.
+            table_name (str): The name of the table.
+            target_column (str, optional): The column to predict. Defaults to None.
+            feature_columns (List[str], optional): The input columns. Defaults to every numeric column except the target.
+            batch_size (int, optional): Rows per batch. Defaults to 1024.
+            shuffle_buffer (int, optional): Rows held in the shuffling buffer, 0 disables shuffling. Defaults to 0.
+            prefetch (int, optional): Batches read ahead on a background thread, 0 reads inline. Defaults to 2.
+            seed (int, optional): Seed of the shuffling. Defaults to None.
+
+        Returns:
+            DatabaseBatchLoader: An iterable of (features, target) batches.
+        """
+        engine = database_handler.get_engine(database)
+        if not feature_columns:
+            feature_columns = [column['name'] for column in inspect(engine).get_columns(table_name)
+                               if column['name'] != target_column and getattr(column['type'], 'python_type', None) in (int, float)]
+        self.feature_columns = feature_columns
+        return DatabaseBatchLoader(engine, table_name, feature_columns, target_column=target_column, batch_size=batch_size,
+                                   shuffle_buffer=shuffle_buffer, prefetch=prefetch, seed=seed, logger=self.logger)
+
+
+    def train_incremental(self, loader, model=None, epochs: int = 1, **partial_fit_kwargs) -> dict:
+        """Train a model batch by batch with `partial_fit`, so only one batch is in memory at a time.
+
+        Args:
+            loader (Iterable): Yields (features, target) batches, e.g. from `stream_table`.
+            model (optional): Any estimator with `partial_fit`. Defaults to scikit-learn's SGDRegressor.
+            epochs (int, optional): Number of passes over the loader. Defaults to 1.
+            **partial_fit_kwargs: Extra arguments for `partial_fit`, e.g. classes for classifiers.
+
+        Returns:
+            dict: The trained 'model', and the 'epochs', 'batches', 'rows' and 'wall_time' of the run.
+        """
+        model = model if model is not None else SGDRegressor()
+        start = time.perf_counter()
+        batches = rows = 0
+        for _ in range(epochs):
+            for features, target in loader:
+                model.partial_fit(features, target, **partial_fit_kwargs)
+                batches += 1
+                rows += len(features)
+        wall_time = time.perf_counter() - start
+        self.model = model
+        self.logger.log(f"Incremental training of {type(model).__name__} finished: {epochs} epochs, {batches} batches, {rows} rows in {wall_time:.4f}s.")
+        return {"model": model, "epochs": epochs, "batches": batches, "rows": rows, "wall_time": wall_time}
+
+
+    def predict_table(self, database_handler, database: str, table_name: str, predictions_table: str, feature_columns: List[str] = None,
+                      key_column: str = None, model=None, chunk_size: int = 10000, workers: int = 4, wal: bool = False) -> dict:
+        """Score every row of a table with a trained model and bulk-write the predictions to another table.
+
+        Args:
+            database_handler (DatabaseHandler): The handler connected to the database.
+            database (str): The name of the database.
+            table_name (str): The table to score.
+            predictions_table (str): The table receiving (key, prediction) rows. Created if it doesn't exist.
+            feature_columns (List[str], optional): The input columns. Defaults to the columns the model was trained on.
+            key_column (str, optional): The numeric column identifying each row. Defaults to the table's primary key.
+            model (optional): Any estimator with `predict`. Defaults to the last trained model, or the fitted linear regression.
+            chunk_size (int, optional): Rows per chunk. Defaults to 10000.
+            workers (int, optional): Number of scoring threads. Defaults to 4.
+            wal (bool, optional): Switch a SQLite database to WAL journaling, which persists in the file, so predictions
+                are written while the table is still read. Defaults to False.
+
+        Returns:
+            dict: Throughput metrics: 'rows', 'chunks', 'wall_time', 'rows_per_second' and the time spent reading, scoring and writing.
+        """
+        engine = database_handler.get_engine(database)
+        feature_columns = feature_columns or self.feature_columns
+        if not feature_columns:
+            raise ValueError("Please provide the feature columns, no model has been trained in this session.")
+        key_column = key_column or next(iter(inspect(engine).get_pk_constraint(table_name).get('constrained_columns') or []), None)
+        if key_column is None:
+            raise ValueError(f"The table '{table_name}' has no primary key, please provide the key column.")
+        model = model if model is not None else self.model
+        predict = model.predict if model is not None else self.predict
+        return BatchPredictor(engine, table_name, feature_columns, key_column, predict, predictions_table,
+                              chunk_size=chunk_size, workers=workers, wal=wal, logger=self.logger).run()
 
 
     def capture_data_from_user(self, ):
@@ -33,25 +274,46 @@ class MLManager():
         """
 
 
-    def choose_model_parameters(self, dataset: str = None, dataset_path: str = None):
-        """Choose model parameters.
+    def choose_model_parameters(self, features: np.ndarray, target: np.ndarray, search_space: dict = None, search: str = "grid", n_iter: int = 20,
+                                max_workers: int = None, **search_kwargs) -> dict:
+        """Choose model parameters with a parallel grid or random search.
 
         Args:
-            dataset (str, optional): The name of the dataset to train the model on. Defaults to None.
-            dataset_path (str, optional): The path of the dataset. Defaults to None.
+            features (np.ndarray): Feature matrix of shape (rows, features), e.g. from `load_table`.
+            target (np.ndarray): Target vector.
+            search_space (dict, optional): Values per parameter per model type ("ridge", "lasso", "elastic_net", "sgd"),
+                e.g. {"ridge": {"alpha": [0.1, 1.0]}}. Defaults to `DEFAULT_SEARCH_SPACE`.
+            search (str, optional): "grid" or "random". Defaults to "grid".
+            n_iter (int, optional): Number of candidates drawn by random search. Defaults to 20.
+            max_workers (int, optional): Number of worker processes. Defaults to the number of cores.
+            **search_kwargs: Extra settings for `HyperparameterSearch`, e.g. reduction_factor or validation_fraction.
+
+        Returns:
+            dict: The search report with the 'best' candidate and its 'best_score'.
         """
-        credentials = self.get_credentials()
-        dataset_path = credentials['default_download_folder']
-        dataset_path = self.download_kaggle_dataset(dataset=dataset, dataset_path=dataset_path)
-        for file in os.listdir(dataset_path[200]):
-            sys.stdout.write(file)
+        report = HyperparameterSearch(search_space=search_space, search=search, n_iter=n_iter, max_workers=max_workers,
+                                      logger=self.logger, **search_kwargs).run(features, target)
+        self.best_parameters = report["best"]
+        return report
 
 
-    def train_machine_learning_model(self, dataset: str = None, dataset_path: str = None):
-        """Train a machine learning modelf from a list of machine learning models.
+    def train_machine_learning_model(self, database_handler, database: str, table_name: str, target_column: str, feature_columns: List[str] = None,
+                                     method: str = "closed_form", **training_kwargs) -> dict:
+        """Train a linear regression model on a table loaded through the DatabaseHandler.
 
         Args:
-            dataset (str, optional): The name of the dataset to train the model on. Defaults to None.
-            dataset_path (str, optional): The path of the dataset. Defaults to None.
+            database_handler (DatabaseHandler): The handler connected to the database.
+            database (str): The name of the database.
+            table_name (str): The name of the table to train the model on.
+            target_column (str): The column to predict.
+            feature_columns (List[str], optional): The input columns. Defaults to every numeric column except the target.
+            method (str, optional): "closed_form" or "gradient_descent". Defaults to "closed_form".
+            **training_kwargs: Extra settings passed to `linear_regression`.
+
+        Returns:
+            dict: The training report of `linear_regression`, with the 'feature_columns' used.
         """
-        pass
\ No newline at end of file
+        features, target = self.load_table(database_handler, database, table_name, target_column, feature_columns=feature_columns)
+        report = self.linear_regression(features, target, method=method, **training_kwargs)
+        report["feature_columns"] = self.feature_columns
+        return report
\ No newline at end of file
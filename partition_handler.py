@@ -0,0 +1,286 @@
+"""Module for loading large tables as hash or date partitions and pruning partitions at query time."""
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy import Column, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.sql import sqltypes
+from log_handler import Logger
+
+
+class PartitionHandler():
+    """Partitions a table on a key column.
+
+    MySQL and PostgreSQL get natively partitioned tables (PARTITION BY KEY/HASH or RANGE). Other dialects, SQLite in
+    particular, get one shard table per partition named <table>__p<label>. The layout is recorded in the
+    `_partitions` metadata table so queries can be routed to the shards matching a filter.
+
+    Date partitions are labelled by period (e.g. 202401 for January 2024 with the "month" granularity). Hash
+    partitions are labelled 0..partitions-1 from the hash of the value's canonical string form, which is the same
+    for 0 and 0.0 or for a date string and the equal timestamp, so filter literals hash like the stored keys. Rows
+    with a NULL key go to the "null" partition (on PostgreSQL date tables the DEFAULT partition, on MySQL the first).
+    """
+    def __repr__(self):
+        return f"PartitionHandler(table_name='{self.table_name}', partition_key='{self.partition_key}', strategy='{self.strategy}')"
+
+
+    def __str__(self):
+        return "PartitionHandler class that writes partitioned tables in parallel and prunes partitions for queries"
+
+
+    def __init__(self, engine, table_name: str, partition_key: str, strategy: str = "hash", partitions: int = 8, granularity: str = "month",
+                 logger: Logger = None):
+        if strategy not in ("hash", "date"):
+            raise ValueError(f"Unsupported partition strategy: {strategy}")
+        self.engine = engine
+        self.table_name = table_name
+        self.partition_key = partition_key
+        self.strategy = strategy
+        self.partitions = partitions
+        self.granularity = granularity
+        self.period_formats = {"year": "%Y", "month": "%Y%m", "day": "%Y%m%d"}
+        self.logger = logger or Logger(name="partition_handler")
+        self.native = engine.dialect.name in ("mysql", "mariadb", "postgresql")
+        self.metadata_table = Table(
+            "_partitions", MetaData(),
+            Column("table_name", String(255), primary_key=True),
+            Column("label", String(32), primary_key=True),
+            Column("shard_table", String(255)),
+            Column("partition_key", String(255)),
+            Column("strategy", String(16)),
+            Column("partitions", Integer),
+            Column("granularity", String(16)),
+        )
+
+
+    def canonical(self, values: pd.Series) -> pd.Series:
+        """Convert key values to strings that don't depend on their dtype: integral numbers without a fraction,
+        timestamps as "%Y-%m-%d %H:%M:%S.%f", anything else as str."""
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values.dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+        if pd.api.types.is_bool_dtype(values):
+            return values.astype(int).astype(str)
+        if pd.api.types.is_integer_dtype(values):
+            return values.astype(str)
+        if pd.api.types.is_float_dtype(values):
+            integral = np.isfinite(values) & (values % 1 == 0) & (values.abs() < 2 ** 53)
+            return pd.Series(np.where(integral, values.where(integral, 0).astype(np.int64).astype(str), values.map(repr)), index=values.index)
+        return values.astype(str)
+
+
+    def coerce_literals(self, literals: List[str], key_type) -> Optional[pd.Series]:
+        """Convert filter literals to the partition column's type, or None when that type is unknown or a literal doesn't convert."""
+        literals = pd.Series(literals, dtype=object)
+        if isinstance(key_type, (sqltypes.DateTime, sqltypes.Date)):
+            values = pd.to_datetime(literals, errors="coerce")
+        elif isinstance(key_type, (sqltypes.Integer, sqltypes.Float, sqltypes.Numeric)) and not isinstance(key_type, sqltypes.Boolean):
+            values = pd.to_numeric(literals, errors="coerce")
+        elif isinstance(key_type, sqltypes.String):
+            return literals
+        else:
+            return None
+        return None if values.isna().any() else values
+
+
+    def labels(self, values: pd.Series) -> pd.Series:
+        """Compute the partition label of every value.
+
+        Args:
+            values (pd.Series): Values of the partition key.
+
+        Returns:
+            pd.Series: The labels as strings, aligned with `values`. NULL keys are labelled "null".
+        """
+        if self.strategy == "hash":
+            hashes = pd.util.hash_pandas_object(self.canonical(values), index=False)
+            labels = (hashes % self.partitions).astype(str)
+        else:
+            labels = pd.to_datetime(values).dt.strftime(self.period_formats[self.granularity])
+        return labels.where(values.notna(), "null")
+
+
+    def shard_table(self, label: str) -> str:
+        """Get the name of the table holding a partition."""
+        return f"{self.table_name}__p{label}"
+
+
+    def period_bounds(self, label: str) -> tuple:
+        """Get the [start, end) dates of a date partition label."""
+        start = pd.to_datetime(label, format=self.period_formats[self.granularity])
+        offset = {"year": pd.DateOffset(years=1), "month": pd.DateOffset(months=1), "day": pd.DateOffset(days=1)}[self.granularity]
+        return start.strftime("%Y-%m-%d"), (start + offset).strftime("%Y-%m-%d")
+
+
+    def create_native_table(self, dataframe: pd.DataFrame, labels: List[str]) -> None:
+        """Create a natively partitioned table on MySQL or PostgreSQL from the DataFrame's schema."""
+        create_statement = pd.io.sql.get_schema(dataframe.head(0), self.table_name, con=self.engine).rstrip().rstrip(";")
+        key = self.partition_key
+        postgresql = self.engine.dialect.name == "postgresql"
+        statements = []
+        if self.strategy == "hash" and postgresql:
+            statements.append(f"{create_statement} PARTITION BY HASH ({key})")
+            statements += [f"CREATE TABLE {self.shard_table(str(remainder))} PARTITION OF {self.table_name} "
+                           f"FOR VALUES WITH (MODULUS {self.partitions}, REMAINDER {remainder})" for remainder in range(self.partitions)]
+        elif self.strategy == "hash":
+            statements.append(f"{create_statement} PARTITION BY KEY ({key}) PARTITIONS {self.partitions}")
+        elif postgresql:
+            statements.append(f"{create_statement} PARTITION BY RANGE ({key})")
+            for label in labels:
+                start, end = self.period_bounds(label)
+                statements.append(f"CREATE TABLE {self.shard_table(label)} PARTITION OF {self.table_name} FOR VALUES FROM ('{start}') TO ('{end}')")
+            statements.append(f"CREATE TABLE {self.table_name}__pdefault PARTITION OF {self.table_name} DEFAULT")
+        else:
+            ranges = [f"PARTITION p{label} VALUES LESS THAN ('{self.period_bounds(label)[1]}')" for label in labels]
+            ranges.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+            statements.append(f"{create_statement} PARTITION BY RANGE COLUMNS ({key}) ({', '.join(ranges)})")
+        with self.engine.begin() as connection:
+            for statement in statements:
+                connection.execute(text(statement))
+
+
+    def register(self, labels: List[str]) -> None:
+        """Record the partitions of the table in the `_partitions` metadata table."""
+        self.metadata_table.create(bind=self.engine, checkfirst=True)
+        with self.engine.begin() as connection:
+            existing = {row[0] for row in connection.execute(
+                self.metadata_table.select().with_only_columns([self.metadata_table.c.label]).where(self.metadata_table.c.table_name == self.table_name))}
+            new_labels = [label for label in labels if label not in existing]
+            if new_labels:
+                connection.execute(self.metadata_table.insert(), [
+                    {"table_name": self.table_name, "label": label, "shard_table": self.table_name if self.native else self.shard_table(label),
+                     "partition_key": self.partition_key, "strategy": self.strategy, "partitions": self.partitions, "granularity": self.granularity}
+                    for label in new_labels
+                ])
+
+
+    def write(self, dataframe: pd.DataFrame, workers: int = 4, chunk_size: int = 10000) -> Dict:
+        """Split the DataFrame by partition and write the partitions in parallel.
+
+        SQLite serializes writers on the database file, so its shards are written one after the other.
+
+        Args:
+            dataframe (pd.DataFrame): The rows to write.
+            workers (int, optional): Number of concurrent writers. Defaults to 4, ignored on SQLite.
+            chunk_size (int, optional): Rows per INSERT batch. Defaults to 10000.
+
+        Returns:
+            dict: Rows written per partition label, the 'null_keys' count (rows written to the "null" partition) and
+                the 'wall_time' in seconds.
+        """
+        start = time.perf_counter()
+        labels = self.labels(dataframe[self.partition_key])
+        groups = {label: group for label, group in dataframe.groupby(labels.to_numpy(), sort=True)}
+        null_keys = len(groups.get("null", ()))
+        if null_keys:
+            self.logger.log(f"{null_keys} rows of '{self.table_name}' have a NULL '{self.partition_key}', writing them to the null partition.", level='warning')
+        if self.native and not inspect(self.engine).has_table(self.table_name):
+            self.create_native_table(dataframe, [label for label in groups if label != "null"])
+        if self.engine.dialect.name == "sqlite":
+            workers = 1
+
+        def write_partition(label: str, group: pd.DataFrame) -> int:
+            target = self.table_name if self.native else self.shard_table(label)
+            group.to_sql(name=target, con=self.engine, if_exists="append", index=False, chunksize=chunk_size)
+            return len(group)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {label: executor.submit(write_partition, label, group) for label, group in groups.items()}
+            written = {label: future.result() for label, future in futures.items()}
+        self.register(list(groups))
+        wall_time = time.perf_counter() - start
+        self.logger.log(f"Wrote {len(dataframe)} rows into {len(groups)} partitions of '{self.table_name}' in {wall_time:.4f}s.")
+        return {"partitions": written, "null_keys": null_keys, "wall_time": wall_time}
+
+
+    def prune(self, filter_condition: str, known_labels: List[str], key_type=None) -> Optional[List[str]]:
+        """Find the partitions a filter can match.
+
+        Equality and IN filters on the partition key prune both strategies; for hash partitions the literals are first
+        converted to the key column's type. Range filters (<, <=, >, >=, BETWEEN) with quoted dates prune date partitions.
+
+        Args:
+            filter_condition (str): The WHERE condition.
+            known_labels (List[str]): The labels of the existing partitions.
+            key_type (optional): The SQLAlchemy type of the partition column. Without it hash partitions aren't pruned.
+
+        Returns:
+            List[str]: The labels to scan, or None when the filter can't be used for pruning.
+        """
+        key = re.escape(self.partition_key)
+        if re.search(r"\bOR\b", filter_condition, re.IGNORECASE):
+            return None
+        literal = r"('(?:[^']|'')*'|[-+]?\d+(?:\.\d+)?)"
+        values = []
+        equality = re.search(rf"\b{key}\s*=\s*{literal}", filter_condition, re.IGNORECASE)
+        in_list = re.search(rf"\b{key}\s+IN\s*\(([^)]*)\)", filter_condition, re.IGNORECASE)
+        if equality:
+            values = [equality.group(1)]
+        elif in_list:
+            values = re.findall(literal, in_list.group(1))
+        if values:
+            values = [value[1:-1].replace("''", "'") if value.startswith("'") else value for value in values]
+            if self.strategy == "hash":
+                values = self.coerce_literals(values, key_type)
+                if values is None:
+                    return None
+            return sorted(set(self.labels(pd.Series(values))) & set(known_labels))
+        if self.strategy != "date":
+            return None
+        lower, upper = None, None
+        between = re.search(rf"\b{key}\s+BETWEEN\s+'([^']+)'\s+AND\s+'([^']+)'", filter_condition, re.IGNORECASE)
+        if between:
+            lower, upper = between.group(1), between.group(2)
+        for operator, value in re.findall(rf"\b{key}\s*(>=|<=|>|<)\s*'([^']+)'", filter_condition, re.IGNORECASE):
+            if operator.startswith(">"):
+                lower = value
+            else:
+                upper = value
+        if lower is None and upper is None:
+            return None
+        period_format = self.period_formats[self.granularity]
+        lower_label = pd.to_datetime(lower).strftime(period_format) if lower else None
+        upper_label = pd.to_datetime(upper).strftime(period_format) if upper else None
+        # NULL keys never match a range.
+        return [label for label in known_labels if label != "null" and (lower_label is None or label >= lower_label)
+                and (upper_label is None or label <= upper_label)]
+
+
+    def query(self, filter_condition: str) -> list:
+        """Run SELECT * with the filter, scanning only the partitions it can match.
+
+        Args:
+            filter_condition (str): The WHERE condition.
+
+        Returns:
+            list: The matching rows.
+        """
+        with self.engine.connect() as connection:
+            if self.native:
+                # MySQL and PostgreSQL prune natively partitioned tables themselves.
+                return connection.execute(text(f"SELECT * FROM {self.table_name} WHERE {filter_condition}")).fetchall()
+            rows = connection.execute(self.metadata_table.select().where(self.metadata_table.c.table_name == self.table_name)).mappings().fetchall()
+            shards = {row["label"]: row["shard_table"] for row in rows}
+            key_type = next((column["type"] for column in inspect(self.engine).get_columns(next(iter(shards.values())))
+                             if column["name"] == self.partition_key), None) if shards else None
+            labels = self.prune(filter_condition, list(shards), key_type=key_type)
+            labels = sorted(shards) if labels is None else labels
+            self.logger.log(f"Query on '{self.table_name}' scans {len(labels)} of {len(shards)} partitions.")
+            if not labels:
+                return []
+            statement = " UNION ALL ".join(f"SELECT * FROM {shards[label]} WHERE {filter_condition}" for label in labels)
+            return connection.execute(text(statement)).fetchall()
+
+
+    @classmethod
+    def from_metadata(cls, engine, table_name: str, logger: Logger = None) -> Optional["PartitionHandler"]:
+        """Rebuild the handler of a partitioned table from the `_partitions` metadata table, or None if it isn't partitioned."""
+        if not inspect(engine).has_table("_partitions"):
+            return None
+        with engine.connect() as connection:
+            row = connection.execute(text("SELECT partition_key, strategy, partitions, granularity FROM _partitions WHERE table_name = :table_name"),
+                                     {"table_name": table_name}).fetchone()
+        if row is None:
+            return None
+        return cls(engine, table_name, row[0], strategy=row[1], partitions=row[2], granularity=row[3], logger=logger)
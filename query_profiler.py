@@ -0,0 +1,165 @@
+"""Module for profiling the SQL statements executed through the DatabaseHandler."""
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+from sqlalchemy import text
+
+
+class QueryProfiler():
+    """Records every statement executed through the DatabaseHandler and captures EXPLAIN plans for slow ones."""
+    def __repr__(self):
+        return f"QueryProfiler(slow_query_threshold={self.slow_query_threshold})"
+
+
+    def __str__(self):
+        return "QueryProfiler class that records statement timings, fingerprints and EXPLAIN plans of slow queries"
+
+
+    def __init__(self, slow_query_threshold: float = 0.5, max_records: int = 10000, capture_explain: bool = True):
+        self.slow_query_threshold = slow_query_threshold
+        self.capture_explain = capture_explain
+        self.records = deque(maxlen=max_records)
+        self.lock = threading.Lock()
+        self.explain_prefixes = {
+            "sqlite": "EXPLAIN QUERY PLAN",
+            "mysql": "EXPLAIN",
+            "mariadb": "EXPLAIN",
+            "postgresql": "EXPLAIN",
+        }
+
+
+    def fingerprint(self, statement: str) -> str:
+        """Normalize a SQL statement so that queries differing only in literals share a fingerprint.
+
+        Args:
+            statement (str): The SQL statement.
+
+        Returns:
+            str: The normalized statement, e.g. "select * from users where age > ?".
+
+        Example:
+            >>> QueryProfiler().fingerprint("SELECT * FROM users WHERE name = 'bob' AND age IN (1, 2, 3)")
+            'select * from users where name = ? and age in (?)'
+        """
+        sql = re.sub(r"'(?:[^']|'')*'", "?", str(statement))
+        sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+        sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", sql)
+        sql = re.sub(r"\s+", " ", sql).strip().rstrip(";")
+        return sql.lower()
+
+
+    def explain(self, connection, statement: str) -> Optional[List]:
+        """Run the dialect's EXPLAIN for a SELECT statement on the given connection.
+
+        Args:
+            connection: The SQLAlchemy connection the statement was executed on.
+            statement (str): The SQL statement to explain.
+
+        Returns:
+            list: The rows of the query plan, or None if the dialect or statement can't be explained.
+        """
+        prefix = self.explain_prefixes.get(connection.dialect.name)
+        if prefix is None or not str(statement).lstrip().lower().startswith(("select", "with")):
+            return None
+        try:
+            return [tuple(row) for row in connection.execute(text(f"{prefix} {statement}")).fetchall()]
+        except Exception as exception:
+            return [f"EXPLAIN failed: {exception}"]
+
+
+    def execute(self, connection, statement: str, database: str = None) -> list:
+        """Execute a statement, record its duration and row count, and explain it if it was slow.
+
+        Args:
+            connection: The SQLAlchemy connection to execute on.
+            statement (str): The SQL statement.
+            database (str, optional): The database name, stored with the record. Defaults to None.
+
+        Returns:
+            list: The fetched rows, or an empty list for statements that don't return rows.
+        """
+        start = time.perf_counter()
+        result = connection.execute(text(statement) if isinstance(statement, str) else statement)
+        rows = result.fetchall() if result.returns_rows else []
+        duration = time.perf_counter() - start
+        explain = None
+        if self.capture_explain and duration >= self.slow_query_threshold:
+            explain = self.explain(connection, str(statement))
+        self.record(statement=str(statement), duration=duration,
+                    rows=len(rows) if result.returns_rows else max(result.rowcount, 0),
+                    database=database, explain=explain)
+        return rows
+
+
+    def record(self, statement: str, duration: float, rows: int, database: str = None, explain: Optional[List] = None) -> Dict:
+        """Store a profiling record.
+
+        Args:
+            statement (str): The executed SQL statement.
+            duration (float): Wall time in seconds.
+            rows (int): Number of rows returned or affected.
+            database (str, optional): The database the statement ran on. Defaults to None.
+            explain (list, optional): The captured query plan. Defaults to None.
+
+        Returns:
+            dict: The stored record.
+        """
+        record = {
+            "statement": statement,
+            "fingerprint": self.fingerprint(statement),
+            "database": database,
+            "duration": duration,
+            "rows": rows,
+            "slow": duration >= self.slow_query_threshold,
+            "explain": explain,
+            "timestamp": time.time(),
+        }
+        with self.lock:
+            self.records.append(record)
+        return record
+
+
+    def slow_query_report(self, top_n: int = 10) -> List[Dict]:
+        """Aggregate the records by fingerprint and return the most expensive statements.
+
+        Args:
+            top_n (int, optional): Number of fingerprints to return. Defaults to 10.
+
+        Returns:
+            List[Dict]: One entry per fingerprint sorted by total time, with call count, total, mean and max
+                duration, total rows, a sample statement and the latest captured EXPLAIN plan.
+        """
+        with self.lock:
+            records = list(self.records)
+        report = {}
+        for record in records:
+            entry = report.setdefault(record["fingerprint"], {
+                "fingerprint": record["fingerprint"],
+                "calls": 0,
+                "slow_calls": 0,
+                "total_time": 0.0,
+                "max_time": 0.0,
+                "rows": 0,
+                "sample": record["statement"],
+                "explain": None,
+            })
+            entry["calls"] += 1
+            entry["slow_calls"] += int(record["slow"])
+            entry["total_time"] += record["duration"]
+            entry["rows"] += record["rows"]
+            if record["duration"] >= entry["max_time"]:
+                entry["max_time"] = record["duration"]
+                entry["sample"] = record["statement"]
+            if record["explain"] is not None:
+                entry["explain"] = record["explain"]
+        for entry in report.values():
+            entry["mean_time"] = entry["total_time"] / entry["calls"]
+        return sorted(report.values(), key=lambda entry: entry["total_time"], reverse=True)[:top_n]
+
+
+    def reset(self) -> None:
+        """Remove all the recorded statements."""
+        with self.lock:
+            self.records.clear()
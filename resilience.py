@@ -0,0 +1,297 @@
+"""Module for retrying transient database and Kaggle API failures with backoff and per-endpoint circuit breakers."""
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, Iterable, Tuple
+from sqlalchemy.exc import DBAPIError, DisconnectionError, TimeoutError as PoolTimeoutError
+from log_handler import Logger
+
+# Messages of errors that usually go away when the operation is tried again.
+TRANSIENT_ERROR_PATTERNS = re.compile(
+    r"connection reset|connection refused|connection aborted|broken pipe|server has gone away|lost connection|"
+    r"server closed the connection|could not connect|timed out|timeout expired|lock wait timeout|deadlock|"
+    r"database is locked|database table is locked|too many connections|temporarily unavailable|try again|"
+    r"too many requests|rate limit|service unavailable|bad gateway|gateway time-?out",
+    re.IGNORECASE,
+)
+
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def status_code(error: Exception):
+    """Get the HTTP status of an API error (Kaggle's ApiException, requests' HTTPError), or None."""
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None) or getattr(response, "status", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Tell whether an error is transient: a dropped connection, a lock or pool timeout, a deadlock, or an HTTP 429/5xx.
+
+    Constraint violations, SQL errors, missing files and other errors that would fail again the same way are not.
+    """
+    if isinstance(error, (ConnectionError, TimeoutError, DisconnectionError, PoolTimeoutError)):
+        return True
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return TRANSIENT_ERROR_PATTERNS.search(str(error)) is not None
+
+
+def retry_after(error: Exception):
+    """Get the seconds an API asked to wait in its Retry-After header, or None."""
+    headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After")) if headers.get("Retry-After") is not None else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+
+class CircuitBreaker():
+    """Stops calling an endpoint after `failure_threshold` consecutive calls failed on retryable errors.
+
+    A call counts once however many attempts it retried. The breaker stays open for `reset_timeout` seconds, then lets
+    one trial call through (half open): a success, or an error showing the endpoint answered, closes it, a retryable
+    failure opens it again.
+    """
+    def __repr__(self):
+        return f"CircuitBreaker(endpoint='{self.endpoint}', state='{self.state}', failures={self.failures})"
+
+
+    def __str__(self):
+        return "CircuitBreaker class that stops calling a failing endpoint until it had time to recover"
+
+
+    def __init__(self, endpoint: str, failure_threshold: int = 5, reset_timeout: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+
+    def allow(self) -> bool:
+        """Tell whether a call may go through, moving an open breaker to half open once the reset timeout passed."""
+        with self.lock:
+            if self.state == "open" and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return True
+            return self.state == "closed"
+
+
+    def record_success(self) -> None:
+        """Close the breaker."""
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.opened_at = None
+
+
+    def record_failure(self) -> None:
+        """Count a call that failed on retryable errors, opening the breaker at the threshold or when the trial call failed."""
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = self.clock()
+
+
+class Resilience():
+    """Runs operations with retries on transient errors, jittered exponential backoff and per-endpoint circuit breakers.
+
+    The delay before retry n is drawn uniformly from [0, min(max_delay, base_delay * 2 ** n)] ("full jitter"), or is
+    the server's Retry-After when that is longer. Only errors `is_retryable` accepts are retried; anything else is
+    raised at once. Shared by DatabaseHandler (endpoint: the database URL without the password) and KaggleHandler
+    (endpoint: "kaggle"). Retries, failures and short-circuited calls are counted per operation in `stats`.
+
+    The breaker counts a call as one failure once its attempts ran out, so `max_attempts` retries of one call don't
+    open it on their own. The trial call of a half-open breaker gets a single attempt.
+    """
+    def __repr__(self):
+        return f"Resilience(max_attempts={self.max_attempts}, base_delay={self.base_delay}, max_delay={self.max_delay})"
+
+
+    def __str__(self):
+        return "Resilience class that retries transient failures with backoff behind per-endpoint circuit breakers"
+
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 30.0, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0, classify: Callable[[Exception], bool] = is_retryable, sleep: Callable[[float], None] = time.sleep,
+                 seed: int = None, logger: Logger = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.classify = classify
+        self.sleep = sleep
+        self.random = random.Random(seed)
+        self.logger = logger or Logger(name="resilience")
+        self.breakers = {}
+        self.stats = defaultdict(lambda: {"calls": 0, "retries": 0, "failures": 0, "short_circuited": 0})
+        self.lock = threading.Lock()
+
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        """Get the circuit breaker of an endpoint."""
+        with self.lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout)
+            return self.breakers[endpoint]
+
+
+    def backoff(self, attempt: int, error: Exception = None) -> float:
+        """Get the jittered delay before retrying after the given (0-based) failed attempt."""
+        delay = self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        requested = retry_after(error) if error is not None else None
+        return min(self.max_delay, requested) if requested is not None and requested > delay else delay
+
+
+    def count(self, operation: str, key: str) -> None:
+        """Increment a counter of an operation."""
+        with self.lock:
+            self.stats[operation][key] += 1
+
+
+    def call(self, operation: str, function: Callable, *args, endpoint: str = "default", attempts: int = None, **kwargs):
+        """Call a function, retrying it on transient errors.
+
+        The function must be safe to call again after a failure, e.g. a read, a download to a fixed path or a write in
+        one transaction.
+
+        Args:
+            operation (str): The name the attempts are counted and logged under, e.g. "write_batch".
+            function (Callable): The function to call with *args and **kwargs.
+            endpoint (str, optional): The endpoint whose circuit breaker guards the call. Defaults to "default".
+            attempts (int, optional): The attempts for this call, e.g. 1 when the function retries internally. Defaults
+                to `max_attempts`.
+
+        Returns:
+            The function's result.
+
+        Raises:
+            CircuitOpenError: If the endpoint's breaker is open.
+            Exception: The function's last error when it isn't retryable or the attempts ran out.
+        """
+        breaker = self.breaker(endpoint)
+        attempts = attempts or self.max_attempts
+        self.count(operation, "calls")
+        for attempt in range(attempts):
+            if not breaker.allow():
+                self.count(operation, "short_circuited")
+                raise CircuitOpenError(f"The circuit breaker of '{endpoint}' is open after {breaker.failures} failures, '{operation}' was not attempted.")
+            try:
+                result = function(*args, **kwargs)
+            except Exception as error:
+                if not self.classify(error):
+                    # The endpoint answered: it is reachable, which also ends a half-open trial.
+                    breaker.record_success()
+                    raise
+                if breaker.state == "half_open" or attempt + 1 == attempts:
+                    breaker.record_failure()
+                    self.count(operation, "failures")
+                    self.logger.log(f"'{operation}' on '{endpoint}' failed after {attempt + 1} attempts: {error}", level='error')
+                    raise
+                delay = self.backoff(attempt, error)
+                self.count(operation, "retries")
+                self.logger.log(f"'{operation}' on '{endpoint}' failed ({type(error).__name__}: {str(error).splitlines()[0] if str(error) else ''}), "
+                                f"retry {attempt + 1}/{attempts - 1} in {delay:.2f}s.", level='warning')
+                self.sleep(delay)
+                continue
+            breaker.record_success()
+            return result
+
+
+    def run_chunks(self, operation: str, chunks: Iterable[Tuple[Hashable, object]], function: Callable, endpoint: str = "default",
+                   completed: set = None, attempts: int = None) -> Dict:
+        """Process chunks one by one, retrying only the chunk that failed, so a transient error doesn't redo finished work.
+
+        Args:
+            operation (str): The name the attempts are counted and logged under.
+            chunks (Iterable): (key, chunk) pairs; the key identifies the chunk across runs, e.g. a file name or a row offset.
+            function (Callable): Processes one chunk, called as function(chunk). It must be idempotent per chunk.
+            endpoint (str, optional): The endpoint whose circuit breaker guards the calls. Defaults to "default".
+            completed (set, optional): Keys finished by an earlier run, which are skipped. Updated in place. Defaults to None.
+            attempts (int, optional): The attempts per chunk, see `call`. Defaults to `max_attempts`.
+
+        Returns:
+            dict: The 'completed' keys, the 'skipped' keys, the 'failed' keys with their error, and the 'results' by key.
+                After the breaker opens the remaining chunks fail without being attempted.
+        """
+        completed = completed if completed is not None else set()
+        report = {"completed": [], "skipped": [], "failed": {}, "results": {}}
+        for key, chunk in chunks:
+            if key in completed:
+                report["skipped"].append(key)
+                continue
+            try:
+                report["results"][key] = self.call(operation, function, chunk, endpoint=endpoint, attempts=attempts)
+            except Exception as error:
+                report["failed"][key] = f"{type(error).__name__}: {error}"
+                continue
+            completed.add(key)
+            report["completed"].append(key)
+        return report
+
+
+class FaultInjector():
+    """Test stub that makes a callable fail like a flaky server.
+
+    The first `failures` calls raise `error`, then each call fails with probability `rate`. `patch` replaces a method
+    of an object (e.g. a KaggleApi instance or a DataFrame writer) with the injector.
+
+    Example:
+        >>> flaky = FaultInjector(api.dataset_list, failures=2, error=ConnectionResetError("Connection reset by peer"))
+        >>> Resilience(base_delay=0).call("dataset_list", flaky, search="weather")  # succeeds on the third call
+    """
+    def __repr__(self):
+        return f"FaultInjector(failures={self.failures}, rate={self.rate}, calls={self.calls}, injected={self.injected})"
+
+
+    def __str__(self):
+        return "FaultInjector class that raises injected errors before calling the wrapped function"
+
+
+    def __init__(self, function: Callable = None, failures: int = 1, error: Exception = None, rate: float = 0.0, seed: int = 0):
+        self.function = function
+        self.failures = failures
+        self.error = error if error is not None else ConnectionResetError("Connection reset by peer (injected)")
+        self.rate = rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.injected = 0
+        self.lock = threading.Lock()
+
+
+    def __call__(self, *args, **kwargs):
+        with self.lock:
+            self.calls += 1
+            fail = self.calls <= self.failures or (self.rate and self.random.random() < self.rate)
+            if fail:
+                self.injected += 1
+        if fail:
+            raise self.error
+        return self.function(*args, **kwargs) if self.function is not None else None
+
+
+    def patch(self, target, name: str) -> "FaultInjector":
+        """Replace a method of an object with the injector, wrapping the original."""
+        self.function = getattr(target, name)
+        setattr(target, name, self)
+        return self
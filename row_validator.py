@@ -0,0 +1,211 @@
+"""Module for validating rows against a table schema before bulk loading and quarantining the failures."""
+import os
+import time
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+from sqlalchemy import Column, MetaData, Table, inspect, select
+from sqlalchemy.sql import sqltypes
+from log_handler import Logger
+
+TRUE_VALUES = {"true", "t", "yes", "y", "1", "1.0"}
+FALSE_VALUES = {"false", "f", "no", "n", "0", "0.0"}
+
+
+class RowValidator():
+    """Checks a DataFrame against a table's columns with vectorized column operations.
+
+    Each column is checked for NULLs in NOT NULL columns (without a server default), values that don't convert to the
+    column type (integers within the SMALLINT/INT/BIGINT range, floats, booleans, dates and datetimes) and strings
+    longer than the VARCHAR/CHAR length. Primary keys repeated within the batch are rejected too, and so are keys
+    already in the table when an engine and table name are given to `validate`. Columns the table doesn't have are
+    dropped with a warning.
+    Rows failing any check are split off with their reasons, the valid rows are returned converted to the column types.
+    """
+    def __repr__(self):
+        return f"RowValidator(columns={[column.name for column in self.columns]})"
+
+
+    def __str__(self):
+        return "RowValidator class that splits a DataFrame into valid rows and quarantined rows with reasons"
+
+
+    def __init__(self, columns: List[Column], logger: Logger = None):
+        self.columns = list(columns)
+        self.logger = logger or Logger(name="row_validator")
+
+
+    def add_reason(self, reasons: pd.Series, mask: pd.Series, reason: str) -> None:
+        """Append a reason to the rows selected by the mask."""
+        if mask.any():
+            reasons[mask] = reasons[mask] + reason + "; "
+
+
+    def convert(self, column: Column, values: pd.Series) -> Tuple[pd.Series, pd.Series, str]:
+        """Convert a column's values to its type.
+
+        Returns:
+            Tuple[pd.Series, pd.Series, str]: The converted values, the mask of the non-null values that failed to
+                convert, and the reason to report for them.
+        """
+        column_type = column.type
+        present = values.notna()
+        if isinstance(column_type, sqltypes.Boolean):
+            if pd.api.types.is_bool_dtype(values):
+                return values, pd.Series(False, index=values.index), ""
+            lowered = values.astype(str).str.strip().str.lower()
+            converted = pd.Series(np.where(lowered.isin(TRUE_VALUES), True, np.where(lowered.isin(FALSE_VALUES), False, None)),
+                                  index=values.index, dtype=object)
+            converted[~present] = None
+            return converted, present & converted.isna(), "not a boolean"
+        if isinstance(column_type, sqltypes.Integer):
+            numbers = pd.to_numeric(values, errors="coerce")
+            invalid = present & (numbers.isna() | (numbers % 1 != 0))
+            bits = 16 if isinstance(column_type, sqltypes.SmallInteger) else 64 if isinstance(column_type, sqltypes.BigInteger) else 32
+            # Compared as floats so values past int64 don't overflow; the bounds are exact in float64.
+            outside = present & ~invalid & ((numbers.astype(float) < -2.0 ** (bits - 1)) | (numbers.astype(float) >= 2.0 ** (bits - 1)))
+            reason = "not an integer"
+            if outside.any():
+                reason = f"out of the {bits}-bit integer range" if not invalid.any() else f"not an integer or out of the {bits}-bit range"
+            invalid = invalid | outside
+            return numbers.where(~invalid).astype("Int64"), invalid, reason
+        if isinstance(column_type, (sqltypes.Float, sqltypes.Numeric)):
+            numbers = pd.to_numeric(values, errors="coerce")
+            return numbers, present & numbers.isna(), "not a number"
+        if isinstance(column_type, (sqltypes.DateTime, sqltypes.Date)):
+            dates = pd.to_datetime(values, errors="coerce")
+            invalid = present & dates.isna()
+            if isinstance(column_type, sqltypes.Date) and not isinstance(column_type, sqltypes.DateTime):
+                return dates.dt.date.where(dates.notna(), None), invalid, "not a date"
+            return dates, invalid, "not a date"
+        if isinstance(column_type, sqltypes.String) and getattr(column_type, "length", None):
+            too_long = present & (values.astype(str).str.len() > column_type.length)
+            return values, too_long, f"longer than {column_type.length} characters"
+        return values, pd.Series(False, index=values.index), ""
+
+
+    def existing_keys(self, keys: pd.DataFrame, engine, table_name: str, chunk_size: int = 500) -> pd.Series:
+        """Tell which primary keys are already in a table.
+
+        The table is queried with IN lists of `chunk_size` values of the first key column, and the full keys are matched
+        after converting the stored values to the dtypes of the incoming ones.
+
+        Args:
+            keys (pd.DataFrame): The primary key columns of the incoming rows, converted to the column types.
+            engine: The engine of the table.
+            table_name (str): The table.
+            chunk_size (int, optional): Values per IN list. Defaults to 500.
+
+        Returns:
+            pd.Series: True for the rows whose key is already stored.
+        """
+        table = Table(table_name, MetaData(), autoload_with=engine)
+        first = keys.columns[0]
+        values = keys[first].dropna().unique().tolist()
+        stored = []
+        with engine.connect() as connection:
+            for start in range(0, len(values), chunk_size):
+                statement = select([table.c[name] for name in keys.columns]).where(table.c[first].in_(values[start:start + chunk_size]))
+                stored += [tuple(row) for row in connection.execute(statement)]
+        if not stored:
+            return pd.Series(False, index=keys.index)
+        stored = pd.DataFrame(stored, columns=list(keys.columns))
+        for name in keys.columns:
+            try:
+                stored[name] = stored[name].astype(keys[name].dtype)
+            except (TypeError, ValueError):
+                pass
+        return pd.Series(pd.MultiIndex.from_frame(keys).isin(pd.MultiIndex.from_frame(stored)), index=keys.index)
+
+
+    def validate(self, dataframe: pd.DataFrame, engine=None, table_name: str = None) -> Tuple[pd.DataFrame, pd.DataFrame, Dict]:
+        """Split a DataFrame into valid and rejected rows.
+
+        Args:
+            dataframe (pd.DataFrame): The rows to load.
+            engine (optional): The engine of the target table, to reject primary keys it already holds. Defaults to None.
+            table_name (str, optional): The target table. Defaults to None.
+
+        Returns:
+            Tuple[pd.DataFrame, pd.DataFrame, dict]: The valid rows converted to the column types, the rejected rows
+                with a `_reasons` column, and a report with the 'rows', 'valid_rows', 'rejected_rows', the number of
+                failures per 'reasons', the 'dropped_columns' the table doesn't have and the 'seconds' taken.
+        """
+        start = time.perf_counter()
+        reasons = pd.Series("", index=dataframe.index, dtype=object)
+        known = {column.name for column in self.columns}
+        converted = {}
+        failures = {}
+        # Extra columns are dropped rather than failing every row.
+        dropped = [name for name in dataframe.columns if name not in known]
+        if dropped:
+            self.logger.log(f"Dropping columns that aren't in the table: {dropped}", level='warning')
+        for column in self.columns:
+            generated = column.primary_key and isinstance(column.type, sqltypes.Integer) and column.autoincrement in (True, "auto")
+            required = not column.nullable and column.server_default is None and not generated
+            if column.name not in dataframe.columns:
+                if required:
+                    self.add_reason(reasons, pd.Series(True, index=dataframe.index), f"{column.name}: missing required column")
+                    failures[f"{column.name}: missing required column"] = len(dataframe)
+                continue
+            values, invalid, reason = self.convert(column, dataframe[column.name])
+            converted[column.name] = values
+            if invalid.any():
+                self.add_reason(reasons, invalid, f"{column.name}: {reason}")
+                failures[f"{column.name}: {reason}"] = int(invalid.sum())
+            if required:
+                nulls = dataframe[column.name].isna()
+                if nulls.any():
+                    self.add_reason(reasons, nulls, f"{column.name}: NULL in NOT NULL column")
+                    failures[f"{column.name}: NULL in NOT NULL column"] = int(nulls.sum())
+        primary_key = [column.name for column in self.columns if column.primary_key and column.name in converted]
+        if primary_key:
+            # Only rows that passed so far compete for a key, so a valid row isn't rejected for repeating a bad one.
+            passed = reasons == ""
+            duplicates = pd.DataFrame({name: converted[name][passed] for name in primary_key}).duplicated(keep="first").reindex(
+                dataframe.index, fill_value=False)
+            if duplicates.any():
+                self.add_reason(reasons, duplicates, f"{', '.join(primary_key)}: duplicate primary key")
+                failures[f"{', '.join(primary_key)}: duplicate primary key"] = int(duplicates.sum())
+            if engine is not None and table_name and inspect(engine).has_table(table_name):
+                stored = self.existing_keys(pd.DataFrame({name: converted[name] for name in primary_key}), engine, table_name)
+                if stored.any():
+                    self.add_reason(reasons, stored, f"{', '.join(primary_key)}: primary key already in the table")
+                    failures[f"{', '.join(primary_key)}: primary key already in the table"] = int(stored.sum())
+        rejected_mask = reasons != ""
+        valid = pd.DataFrame({name: values[~rejected_mask] for name, values in converted.items()}, index=dataframe.index[~rejected_mask])
+        rejected = dataframe[rejected_mask].assign(_reasons=reasons[rejected_mask].str.rstrip("; "))
+        report = {"rows": len(dataframe), "valid_rows": len(valid), "rejected_rows": len(rejected), "reasons": failures,
+                  "dropped_columns": dropped, "seconds": time.perf_counter() - start}
+        if len(rejected):
+            self.logger.log(f"Validation rejected {len(rejected)} of {len(dataframe)} rows: {failures}", level='warning')
+        return valid, rejected, report
+
+
+    def quarantine(self, rejected: pd.DataFrame, engine=None, table_name: str = None, path: str = None) -> int:
+        """Store rejected rows in a quarantine table or append them to a CSV file.
+
+        Each rejected row is stored as its original values in JSON ('row_data'), its 'reasons' and 'quarantined_at', so
+        rows of differently shaped files can share one quarantine table.
+
+        Args:
+            rejected (pd.DataFrame): The rejected rows returned by `validate`.
+            engine (optional): The engine of the quarantine table. Defaults to None.
+            table_name (str, optional): The name of the quarantine table. Defaults to None.
+            path (str, optional): The CSV file to append to instead of a table. Defaults to None.
+
+        Returns:
+            int: The number of quarantined rows.
+        """
+        if rejected.empty:
+            return 0
+        rows = pd.DataFrame({
+            "row_data": rejected.drop(columns="_reasons").to_json(orient="records", lines=True, date_format="iso", default_handler=str).splitlines(),
+            "reasons": rejected["_reasons"].to_numpy(),
+            "quarantined_at": pd.Timestamp.now().isoformat(sep=" "),
+        })
+        if path is not None:
+            rows.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+        else:
+            rows.to_sql(name=table_name, con=engine, if_exists="append", index=False)
+        return len(rows)
@@ -0,0 +1,15 @@
+"""Module for converting the dataset sizes reported by Kaggle into bytes."""
+import re
+from typing import Optional
+
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+
+
+def parse_size(size) -> Optional[int]:
+    """Convert a size in bytes or a string such as '12MB' into bytes, or None when it can't be read."""
+    if size is None or isinstance(size, (int, float)):
+        return None if size is None else int(size)
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?B)?\s*", str(size), re.IGNORECASE)
+    if not match:
+        return None
+    return int(float(match.group(1)) * SIZE_UNITS[(match.group(2) or "B").upper()])
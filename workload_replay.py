@@ -0,0 +1,232 @@
+"""Module for recording DatabaseHandler calls and replaying them as a concurrent load test."""
+import contextvars
+import io
+import json
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence
+import numpy as np
+import pandas as pd
+from log_handler import Logger
+
+NOT_RECORDED = {"record_workload", "replay_workload", "get_engine", "get_connection_settings", "generate_database_url", "get_credentials",
+                "get_args", "enable_profiler", "disable_profiler", "slow_query_report", "parse_column_definition", "execute_statement",
+                "database_endpoint", "time_statement"}
+
+# Set while a recorded call runs. Worker threads see it when they run in a copy of the caller's context, as `fan_out` does.
+RECORDING = contextvars.ContextVar("workload_recording", default=False)
+
+
+def returned_error(result):
+    """Get the error a handler call reported through its return value: False, a returned exception or a {500: ...} dict."""
+    if result is False:
+        return "returned False"
+    if isinstance(result, Exception):
+        return f"returned {type(result).__name__}: {result}"
+    if isinstance(result, dict) and 500 in result:
+        return f"returned {{500: {result[500]!r}}}"
+    return None
+
+
+def encode_argument(value):
+    """Make an argument JSON serializable. DataFrames are stored in the split orientation, NumPy scalars and arrays as
+    their Python values, other objects by repr."""
+    if isinstance(value, pd.DataFrame):
+        return {"__dataframe__": value.to_json(orient="split", date_format="iso")}
+    if isinstance(value, (list, tuple)):
+        return [encode_argument(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): encode_argument(item) for key, item in value.items()}
+    if isinstance(value, (np.generic, np.ndarray)):
+        return encode_argument(value.tolist())
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return {"__repr__": repr(value)}
+
+
+def decode_argument(value):
+    """Rebuild an argument encoded by `encode_argument`."""
+    if isinstance(value, list):
+        return [decode_argument(item) for item in value]
+    if isinstance(value, dict):
+        if "__dataframe__" in value:
+            return pd.read_json(io.StringIO(value["__dataframe__"]), orient="split")
+        if "__repr__" in value:
+            raise ValueError(f"The argument {value['__repr__']} can't be replayed.")
+        return {key: decode_argument(item) for key, item in value.items()}
+    return value
+
+
+class WorkloadRecorder():
+    """Records the top-level calls made on a handler to a JSON-lines file.
+
+    Public methods are wrapped on the instance. Only the outermost call of each call tree is recorded, so a replay
+    doesn't run nested calls twice; this covers worker threads that run in a copy of the caller's context (see
+    `RECORDING`), as `fan_out` does. Each line holds the call's offset from the start of the recording, the method, its
+    arguments, its duration and its error, raised or returned (see `returned_error`), if any.
+    """
+    def __repr__(self):
+        return f"WorkloadRecorder(path='{self.path}', calls={self.calls})"
+
+
+    def __str__(self):
+        return "WorkloadRecorder class that records handler calls with their arguments and timings"
+
+
+    def __init__(self, handler, path: str, methods: Sequence[str] = None):
+        self.handler = handler
+        self.path = path
+        self.methods = list(methods) if methods else [name for name in dir(type(handler))
+                                                      if not name.startswith("_") and name not in NOT_RECORDED and callable(getattr(type(handler), name))]
+        self.lock = threading.Lock()
+        self.file = None
+        self.start_time = None
+        self.calls = 0
+
+
+    def wrap(self, name: str):
+        """Wrap a bound method so its top-level calls are recorded."""
+        method = getattr(self.handler, name)
+
+        def recorded(*args, **kwargs):
+            if RECORDING.get():
+                return method(*args, **kwargs)
+            token = RECORDING.set(True)
+            offset = time.perf_counter() - self.start_time
+            error = None
+            try:
+                result = method(*args, **kwargs)
+                error = returned_error(result)
+                return result
+            except Exception as exception:
+                error = f"{type(exception).__name__}: {exception}"
+                raise
+            finally:
+                RECORDING.reset(token)
+                entry = {"offset": offset, "method": name, "args": encode_argument(list(args)), "kwargs": encode_argument(kwargs),
+                         "duration": time.perf_counter() - self.start_time - offset, "error": error}
+                with self.lock:
+                    if self.file is not None:
+                        self.file.write(json.dumps(entry) + "\n")
+                        self.calls += 1
+
+        return recorded
+
+
+    def start(self) -> "WorkloadRecorder":
+        """Start recording, appending to the file."""
+        self.file = open(self.path, "a")
+        self.start_time = time.perf_counter()
+        for name in self.methods:
+            setattr(self.handler, name, self.wrap(name))
+        return self
+
+
+    def stop(self) -> int:
+        """Stop recording and restore the handler's methods. Returns the number of recorded calls."""
+        for name in self.methods:
+            self.handler.__dict__.pop(name, None)
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        return self.calls
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class WorkloadReplayer():
+    """Replays a recorded workload against a handler at a given concurrency and speed and reports per-method statistics.
+
+    With speed 1.0 calls start at their recorded offsets, 2.0 replays twice as fast, and 0 sends them as fast as the
+    workers allow. When paced, latency is measured from the time a call was scheduled to start, so the time it waits
+    for a busy worker counts (no coordinated omission). A call counts as an error if it raises or returns one of the
+    handler's failure values: False, an exception or a {500: ...} dict.
+    """
+    def __repr__(self):
+        return f"WorkloadReplayer(path='{self.path}', concurrency={self.concurrency}, speed={self.speed})"
+
+
+    def __str__(self):
+        return "WorkloadReplayer class that replays recorded handler calls concurrently and reports latency percentiles"
+
+
+    def __init__(self, handler, path: str, concurrency: int = 4, speed: float = 1.0, logger: Logger = None):
+        self.handler = handler
+        self.path = path
+        self.concurrency = concurrency
+        self.speed = speed
+        self.logger = logger or Logger(name="workload_replay")
+
+
+    def load(self) -> List[Dict]:
+        """Read the recorded calls in the order they started."""
+        with open(self.path, "r") as file:
+            entries = [json.loads(line) for line in file if line.strip()]
+        return sorted(entries, key=lambda entry: entry["offset"])
+
+
+    def summarize(self, latencies: List[float], errors: int, wall_time: float) -> Dict:
+        """Summarize the latencies and errors of a group of calls."""
+        calls = len(latencies)
+        percentiles = np.percentile(latencies, [50, 95, 99]) if calls else [0.0, 0.0, 0.0]
+        return {"calls": calls, "errors": errors, "error_rate": errors / calls if calls else 0.0,
+                "throughput": calls / wall_time if wall_time else 0.0, "mean": float(np.mean(latencies)) if calls else 0.0,
+                "p50": float(percentiles[0]), "p95": float(percentiles[1]), "p99": float(percentiles[2])}
+
+
+    def run(self) -> Dict:
+        """Replay the workload.
+
+        Returns:
+            dict: 'methods' with the calls, errors, error_rate, throughput (calls per second) and mean/p50/p95/p99
+                latencies in seconds (from the scheduled start when paced) of every method, the same statistics under
+                'total', the first error message of each method under 'error_samples' and the 'wall_time'.
+        """
+        entries = self.load()
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        error_samples = {}
+        lock = threading.Lock()
+        start = time.perf_counter()
+
+        def replay(entry: Dict) -> None:
+            call_start = time.perf_counter()
+            if self.speed:
+                call_start = start + entry["offset"] / self.speed
+                if call_start > time.perf_counter():
+                    time.sleep(call_start - time.perf_counter())
+            error = None
+            try:
+                result = getattr(self.handler, entry["method"])(*decode_argument(entry["args"]), **decode_argument(entry["kwargs"]))
+                error = returned_error(result)
+            except Exception as exception:
+                error = f"{type(exception).__name__}: {exception}"
+            duration = time.perf_counter() - call_start
+            with lock:
+                latencies[entry["method"]].append(duration)
+                if error is not None:
+                    errors[entry["method"]] += 1
+                    error_samples.setdefault(entry["method"], error)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="replay") as executor:
+            list(executor.map(replay, entries))
+        wall_time = time.perf_counter() - start
+        report = {
+            "methods": {method: self.summarize(values, errors[method], wall_time) for method, values in sorted(latencies.items())},
+            "total": self.summarize([value for values in latencies.values() for value in values], sum(errors.values()), wall_time),
+            "error_samples": error_samples,
+            "wall_time": wall_time,
+        }
+        self.logger.log(f"Replayed {report['total']['calls']} calls with concurrency {self.concurrency} in {wall_time:.4f}s: "
+                        f"{report['total']['throughput']:.1f} calls/s, p95 {report['total']['p95']:.4f}s, "
+                        f"error rate {report['total']['error_rate']:.2%}.")
+        return report